@@ -0,0 +1,243 @@
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import json
+import numpy as np
+import c_columnar
+from h_event_segmentation import get_event_numbers
+
+
+# Aligned rasters of the mean distance of a slice at two timepoints, over the union extent of both.
+# Arrays are (columns, rows): column index 0 is first_col, row index 0 is top_row (rows run top down, the order
+# events are derived in). Values are NaN and present is False where a timepoint has no voxel
+class ChangeRaster:
+
+    def __init__(self, first_tp=None, second_tp=None):
+
+        # Names of the timepoints
+        self.first_tp = first_tp
+        self.second_tp = second_tp
+        # X of the first column and Z of the top row
+        self.first_col = 0
+        self.top_row = 0
+        # Rasters of each timepoint
+        self.first_values = np.empty((0, 0))
+        self.first_present = np.empty((0, 0), dtype=bool)
+        self.second_values = np.empty((0, 0))
+        self.second_present = np.empty((0, 0), dtype=bool)
+
+    # Build from (vox_x, vox_z, value) arrays of each timepoint's voxels
+    @classmethod
+    def from_voxel_arrays(cls, first_tp, second_tp, first_arrays, second_arrays):
+        # Make the object
+        raster = cls(first_tp=first_tp, second_tp=second_tp)
+        # Union extent
+        all_x = np.concatenate((first_arrays[0], second_arrays[0]))
+        all_z = np.concatenate((first_arrays[1], second_arrays[1]))
+        if not len(all_x):
+            return raster
+        raster.first_col = int(all_x.min())
+        raster.top_row = int(all_z.max())
+        shape = (int(all_x.max()) - raster.first_col + 1, raster.top_row - int(all_z.min()) + 1)
+        # Rasterize each timepoint
+        for vox_x, vox_z, values, prefix in [(*first_arrays, 'first'), (*second_arrays, 'second')]:
+            value_raster = np.full(shape, np.nan)
+            present_raster = np.zeros(shape, dtype=bool)
+            index = (np.asarray(vox_x) - raster.first_col, raster.top_row - np.asarray(vox_z))
+            value_raster[index] = values
+            present_raster[index] = True
+            setattr(raster, f'{prefix}_values', value_raster)
+            setattr(raster, f'{prefix}_present', present_raster)
+        return raster
+
+    # Change of every cell (second minus first, NaN unless both timepoints have the voxel)
+    def get_changes(self):
+        return self.second_values - self.first_values
+
+    # Bit mask of the timepoints missing every cell (1: first, 2: second)
+    def get_missing_masks(self):
+        return (~self.first_present).astype(np.uint8) | ((~self.second_present).astype(np.uint8) << 1)
+
+    # Derive the events of every column at once, as a c_columnar.PairColumns in the pair output layout:
+    # columns between the first and last are listed, the first column itself is not; columns without voxels in
+    # either timepoint come first (missing from both), then the others in order. A column missing from one
+    # timepoint is recorded as such; the others are segmented from their top voxel down to two rows above their
+    # bottom voxel (the derivation has always stopped there).
+    # With workers > 1, the columns are split into chunks of chunk_columns (by default enough for four chunks per
+    # worker) that are segmented on a process pool. Event numbers restart in every column, so the chunks are simply
+    # joined in column order and the result is the same as in one piece
+    def to_pair_columns(self, slice_name=None, workers=1, chunk_columns=None):
+        # Make the object
+        pair_columns = c_columnar.PairColumns(slice_name=slice_name, first_tp=self.first_tp, second_tp=self.second_tp)
+        # Columns with voxels in each timepoint
+        first_has_col = self.first_present.any(axis=1)
+        second_has_col = self.second_present.any(axis=1)
+        has_col = first_has_col | second_has_col
+        # If there are no voxels
+        if not has_col.any():
+            return c_columnar.PairColumns.from_pair_results([], slice_name=slice_name, first_tp=self.first_tp,
+                                                            second_tp=self.second_tp)
+        # Columns in the output order (gaps between the pair's first and last columns, then those with voxels,
+        # skipping the first). The raster may be wider than the pair (e.g. from a RasterStack)
+        has_col_idxs = np.flatnonzero(has_col)
+        gap_idxs = np.flatnonzero(~has_col[has_col_idxs[0]:has_col_idxs[-1] + 1]) + has_col_idxs[0]
+        col_idxs = np.concatenate((gap_idxs, has_col_idxs[1:]))
+        col_missing = (~first_has_col[col_idxs]).astype(np.uint8) | ((~second_has_col[col_idxs]).astype(np.uint8) << 1)
+        # Columns to segment
+        segmented = np.zeros(len(has_col), dtype=bool)
+        segmented[col_idxs[col_missing == 0]] = True
+        # Chunks of columns
+        col_count = len(has_col)
+        chunk_columns = chunk_columns or max(1, -(-col_count // (workers * 4)))
+        chunk_args = [(self.first_values[start:start + chunk_columns],
+                       self.first_present[start:start + chunk_columns],
+                       self.second_values[start:start + chunk_columns],
+                       self.second_present[start:start + chunk_columns],
+                       segmented[start:start + chunk_columns])
+                      for start in range(0, col_count, chunk_columns)]
+        # Segment the chunks (in order)
+        if workers > 1 and len(chunk_args) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                chunk_results = list(executor.map(segment_columns, *zip(*chunk_args)))
+        else:
+            chunk_results = [segment_columns(*args) for args in chunk_args]
+        # Join them (chunk cell columns are relative to the chunk start)
+        cell_cols = np.concatenate([chunk_result[0] + chunk_idx * chunk_columns
+                                    for chunk_idx, chunk_result in enumerate(chunk_results)])
+        cell_rows, changes, missing, event_numbers = [np.concatenate([chunk_result[array_idx]
+                                                                      for chunk_result in chunk_results])
+                                                      for array_idx in range(1, 5)]
+        # Start of each output column's voxels
+        col_voxel_counts = np.bincount(cell_cols, minlength=col_count)[col_idxs]
+        col_starts = np.concatenate(([0], np.cumsum(col_voxel_counts)[:-1])) if len(col_idxs) \
+            else np.zeros(0, dtype=np.int64)
+        # Transfer the arrays
+        pair_columns.col = (col_idxs + self.first_col).astype(np.int64)
+        pair_columns.col_missing = col_missing
+        pair_columns.col_starts = col_starts.astype(np.int64)
+        pair_columns.row = (self.top_row - cell_rows).astype(np.int64)
+        pair_columns.event_number = event_numbers.astype(np.int64)
+        pair_columns.change = np.where(missing != 0, np.nan, changes)
+        pair_columns.missing = missing
+        # Return the object
+        return pair_columns
+
+
+# Mean distance rasters of a slice at any number of timepoints, aligned over their union extent (as ChangeRaster,
+# with a leading timepoint axis). Built once per slice, so each timepoint is read and rasterized once however many
+# pairs are derived. The change of any pair is the difference of its two rasters, which is exactly what the pair
+# derivation has always computed (summing the adjacent changes in between would round differently and would
+# also need every timepoint in between to have the voxel), so deriving a pair is one subtraction and segmentation
+class RasterStack:
+
+    def __init__(self, slice_name=None, timepoint_names=None):
+
+        # Names of the slice and the timepoints (in the order of the stack)
+        self.slice_name = slice_name
+        self.timepoint_names = timepoint_names or []
+        # X of the first column and Z of the top row
+        self.first_col = 0
+        self.top_row = 0
+        # Rasters (timepoints, columns, rows), and keys of the sources they were built from (c_columnar.get_source_key)
+        self.values = np.empty((len(self.timepoint_names), 0, 0))
+        self.present = np.empty((len(self.timepoint_names), 0, 0), dtype=bool)
+        self.source_keys = {}
+
+    # Build from {timepoint name: (vox_x, vox_z, value) arrays}
+    @classmethod
+    def from_voxel_arrays(cls, slice_name, timepoint_arrays):
+        # Make the object
+        stack = cls(slice_name=slice_name, timepoint_names=list(timepoint_arrays.keys()))
+        # Union extent
+        all_x = np.concatenate([arrays[0] for arrays in timepoint_arrays.values()])
+        all_z = np.concatenate([arrays[1] for arrays in timepoint_arrays.values()])
+        if not len(all_x):
+            return stack
+        stack.first_col = int(all_x.min())
+        stack.top_row = int(all_z.max())
+        shape = (len(timepoint_arrays), int(all_x.max()) - stack.first_col + 1, stack.top_row - int(all_z.min()) + 1)
+        # Rasterize each timepoint
+        stack.values = np.full(shape, np.nan)
+        stack.present = np.zeros(shape, dtype=bool)
+        for tp_idx, (vox_x, vox_z, values) in enumerate(timepoint_arrays.values()):
+            index = (np.asarray(vox_x) - stack.first_col, stack.top_row - np.asarray(vox_z))
+            stack.values[tp_idx][index] = values
+            stack.present[tp_idx][index] = True
+        return stack
+
+    # ChangeRaster of a pair of timepoints (views of the stack, nothing is copied)
+    def get_change_raster(self, first_tp, second_tp):
+        raster = ChangeRaster(first_tp=first_tp, second_tp=second_tp)
+        raster.first_col = self.first_col
+        raster.top_row = self.top_row
+        first_idx = self.timepoint_names.index(first_tp)
+        second_idx = self.timepoint_names.index(second_tp)
+        raster.first_values = self.values[first_idx]
+        raster.first_present = self.present[first_idx]
+        raster.second_values = self.values[second_idx]
+        raster.second_present = self.present[second_idx]
+        return raster
+
+    # Save as a directory of .npy arrays plus a JSON header
+    def save(self, dir_path):
+        header = {'Format Version': c_columnar.FORMAT_VERSION,
+                  'Slice Name': self.slice_name,
+                  'Timepoint Names': self.timepoint_names,
+                  'First Column': self.first_col,
+                  'Top Row': self.top_row,
+                  'Source Keys': self.source_keys}
+        c_columnar.save_arrays(dir_path, self, ['values', 'present'], header)
+
+    # Load from a directory written by save. Arrays are memory mapped
+    @classmethod
+    def load(cls, dir_path, mmap_mode='r'):
+        # Load the header
+        with open(Path(dir_path, 'header.json'), 'r') as f:
+            header = json.load(f)
+        # Make the object
+        stack = cls(slice_name=header['Slice Name'], timepoint_names=header['Timepoint Names'])
+        stack.first_col = header['First Column']
+        stack.top_row = header['Top Row']
+        stack.source_keys = {timepoint_name: tuple(source_key)
+                             for timepoint_name, source_key in header['Source Keys'].items()}
+        # Map each array
+        for array_name in ['values', 'present']:
+            setattr(stack, array_name, np.load(Path(dir_path, f'{array_name}.npy'), mmap_mode=mmap_mode))
+        # Return the object
+        return stack
+
+
+# Segment the columns of raster arrays (rows top down) flagged in segmented, from each column's top voxel down to
+# two rows above its bottom voxel. Returns the column and row index, change, missing timepoint mask (1: first,
+# 2: second) and event number of every segmented cell, column by column and top down
+def segment_columns(first_values, first_present, second_values, second_present, segmented):
+    # Rows of each column (top voxel down to two rows above the bottom voxel)
+    union_present = first_present | second_present
+    row_count = union_present.shape[1]
+    top_idxs = np.argmax(union_present, axis=1)
+    bottom_idxs = row_count - 1 - np.argmax(union_present[:, ::-1], axis=1)
+    row_idxs = np.arange(row_count)
+    window = segmented[:, np.newaxis] & (row_idxs >= top_idxs[:, np.newaxis]) & \
+        (row_idxs <= bottom_idxs[:, np.newaxis] - 2)
+    # Cells of the segmented columns, column by column and top down
+    cell_cols, cell_rows = np.nonzero(window)
+    changes = second_values[cell_cols, cell_rows] - first_values[cell_cols, cell_rows]
+    missing = (~first_present[cell_cols, cell_rows]).astype(np.uint8) | \
+        ((~second_present[cell_cols, cell_rows]).astype(np.uint8) << 1)
+    # Event numbers of all of the columns at once
+    column_starts = np.concatenate(([True], cell_cols[1:] != cell_cols[:-1])) if len(cell_cols) \
+        else np.zeros(0, dtype=bool)
+    event_numbers = get_event_numbers(missing != 0, changes, column_starts)
+    return cell_cols, cell_rows, changes, missing, event_numbers
+
+
+# (vox_x, vox_z, mean distance) arrays of a voxels dictionary ({x: {z: VoxelStats.flatten()}})
+def get_voxel_arrays(voxels):
+    vox_x = []
+    vox_z = []
+    values = []
+    for x, voxel_column in voxels.items():
+        for z, voxel in voxel_column.items():
+            vox_x.append(int(x))
+            vox_z.append(int(z))
+            values.append(voxel[0][2])
+    return np.array(vox_x, dtype=np.int64), np.array(vox_z, dtype=np.int64), np.array(values, dtype=np.float64)
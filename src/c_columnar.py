@@ -0,0 +1,558 @@
+from collections import OrderedDict
+from os import makedirs, remove, replace, stat
+from os.path import exists
+from pathlib import Path
+import threading
+import logging
+import shutil
+import json
+import numpy as np
+from h_json_stream import iter_json_object_entries
+
+# Version of the columnar layout written to the header
+FORMAT_VERSION = 1
+# Suffix of a columnar slice/timepoint directory
+COLUMNS_SUFFIX = '.columns'
+# Number of statistics per voxel (VoxelStats.flatten order: min, max, mean, median, stdev)
+STAT_COUNT = 5
+# Arrays saved for slice/timepoint and pair results
+SLICE_TIMEPOINT_ARRAYS = ['vox_x', 'vox_z', 'distance', 'reflectance', 'has_reflectance', 'scan_counts']
+PAIR_ARRAYS = ['col', 'col_missing', 'col_starts', 'row', 'event_number', 'change', 'missing']
+# Directory (next to the JSON outputs) of decoded copies of JSON results
+DECODED_CACHE_DIR = 'decoded_cache'
+# Number of loaded results kept in memory (0 to keep none)
+MEMORY_CACHE_SIZE = 32
+
+# Loaded results ((source path, size, modification time): object), least recently used first
+_memory_cache = OrderedDict()
+_memory_cache_lock = threading.Lock()
+
+
+# Columnar (struct of arrays) form of a slice/timepoint result. One entry per voxel, sorted by X then Z:
+# vox_x, vox_z: integer voxel coordinates
+# distance, reflectance: (voxels, 5) stat arrays in VoxelStats.flatten order (reflectance NaN where not exported)
+# has_reflectance: whether the voxel had reflectance results
+# scan_counts: (voxels, scans) point counts, one column per name in scan_names
+# vox_y: integer voxel Y for results with a Y axis (c_sparse_grid.SparseVoxelGrid, sorted by X, Z, then Y), None
+# otherwise. Their JSON layout nests the voxels one level deeper ([X][Z][Y]: flattened voxel)
+class SliceTimepointColumns:
+
+    def __init__(self, grid_name=None, slice_name=None, timepoint_name=None):
+
+        # Names for the result
+        self.grid_name = grid_name
+        self.slice_name = slice_name
+        self.timepoint_name = timepoint_name
+        # Column arrays
+        self.vox_x = None
+        self.vox_z = None
+        self.distance = None
+        self.reflectance = None
+        self.has_reflectance = None
+        self.scan_counts = None
+        self.vox_y = None
+        # Names of the scan count columns
+        self.scan_names = []
+
+    # Build from the nested 'Voxels' dictionary of a slice/timepoint JSON output ([X][Z]: flattened voxel)
+    @classmethod
+    def from_voxels_dict(cls, voxels_dict, **kwargs):
+        return cls.from_voxel_columns(voxels_dict.items(), **kwargs)
+
+    # Build from an iterable of (X, {Z: flattened voxel}) columns, e.g. read one at a time from a JSON output
+    # (or (X, {Z: {Y: flattened voxel}}) columns for results with a Y axis)
+    @classmethod
+    def from_voxel_columns(cls, voxel_columns, **kwargs):
+        # Make the object
+        columns = cls(**kwargs)
+        # Rows for the arrays
+        vox_xs = []
+        vox_zs = []
+        vox_ys = []
+        distance = []
+        reflectance = []
+        has_reflectance = []
+        scan_rows = []
+        # Scan names in the order they appear
+        scan_names = {}
+        # For each voxel X
+        for vox_x, voxel_column in voxel_columns:
+            # For each voxel Z
+            for vox_z, z_entry in voxel_column.items():
+                # Voxels at the Z (by Y if the result has a Y axis)
+                y_entries = z_entry.items() if isinstance(z_entry, dict) else [(None, z_entry)]
+                # For each voxel
+                for vox_y, flat_voxel in y_entries:
+                    vox_xs.append(int(vox_x))
+                    vox_zs.append(int(vox_z))
+                    vox_ys.append(None if vox_y is None else int(vox_y))
+                    distance.append(flat_voxel[0])
+                    # If there were no reflectance results
+                    if not flat_voxel[1]:
+                        reflectance.append([np.nan] * STAT_COUNT)
+                        has_reflectance.append(False)
+                    else:
+                        reflectance.append(flat_voxel[1])
+                        has_reflectance.append(True)
+                    # Scans contributing to the voxel (only exported with reflectance results)
+                    scans = flat_voxel[2] if len(flat_voxel) > 2 and flat_voxel[2] else {}
+                    for scan_name in scans.keys():
+                        scan_names.setdefault(scan_name, len(scan_names))
+                    scan_rows.append(scans)
+        # Scan count matrix
+        scan_counts = np.zeros((len(scan_rows), len(scan_names)), dtype=np.int32)
+        for row_idx, scans in enumerate(scan_rows):
+            for scan_name, point_count in scans.items():
+                scan_counts[row_idx, scan_names[scan_name]] = point_count
+        # Transfer the arrays
+        columns.set_arrays(np.array(vox_xs, dtype=np.int64),
+                           np.array(vox_zs, dtype=np.int64),
+                           np.array(distance, dtype=np.float64).reshape(-1, STAT_COUNT),
+                           np.array(reflectance, dtype=np.float64).reshape(-1, STAT_COUNT),
+                           np.array(has_reflectance, dtype=bool),
+                           scan_counts,
+                           list(scan_names.keys()),
+                           np.array(vox_ys, dtype=np.int64) if vox_ys and vox_ys[0] is not None else None)
+        # Return the object
+        return columns
+
+    # Set the column arrays (sorted by X then Z, then Y if there is a Y axis)
+    def set_arrays(self, vox_x, vox_z, distance, reflectance, has_reflectance, scan_counts, scan_names, vox_y=None):
+        # Order by X then Z (then Y)
+        order = np.lexsort((vox_z, vox_x)) if vox_y is None else np.lexsort((vox_y, vox_z, vox_x))
+        self.vox_y = None if vox_y is None else vox_y[order]
+        self.vox_x = vox_x[order]
+        self.vox_z = vox_z[order]
+        self.distance = distance[order]
+        self.reflectance = reflectance[order]
+        self.has_reflectance = has_reflectance[order]
+        self.scan_counts = scan_counts[order]
+        self.scan_names = list(scan_names)
+
+    # Number of voxels
+    def get_voxel_count(self):
+        return len(self.vox_x)
+
+    # Nested 'Voxels' dictionary in the slice/timepoint JSON layout (string keys, as after json.load)
+    def to_voxels_dict(self):
+        return dict(self.iter_voxel_columns())
+
+    # Yield the 'Voxels' entries of the slice/timepoint JSON layout one column at a time (X: {Z: flattened voxel},
+    # or X: {Z: {Y: flattened voxel}} with a Y axis, string keys), e.g. for JsonStreamWriter
+    def iter_voxel_columns(self):
+        # Convert the arrays to lists once
+        vox_xs = self.vox_x.tolist()
+        vox_zs = self.vox_z.tolist()
+        vox_ys = self.vox_y.tolist() if self.vox_y is not None else None
+        distance = self.distance.tolist()
+        reflectance = self.reflectance.tolist()
+        has_reflectance = self.has_reflectance.tolist()
+        scan_counts = self.scan_counts.tolist()
+        # Current column
+        column_x = None
+        voxel_column = {}
+        # For each voxel (sorted by X, so each column is contiguous)
+        for voxel_idx, (vox_x, vox_z) in enumerate(zip(vox_xs, vox_zs)):
+            # If the voxel starts a new column
+            if vox_x != column_x:
+                # Yield the finished one
+                if column_x is not None:
+                    yield str(column_x), voxel_column
+                column_x = vox_x
+                voxel_column = {}
+            # Entries the voxel goes in, and its key (Z, or Y under Z with a Y axis)
+            entries, voxel_key = voxel_column, str(vox_z)
+            if vox_ys is not None:
+                entries, voxel_key = voxel_column.setdefault(str(vox_z), {}), str(vox_ys[voxel_idx])
+            # If there were no reflectance results
+            if not has_reflectance[voxel_idx]:
+                # Distance results, and None
+                entries[voxel_key] = [distance[voxel_idx], None]
+                continue
+            # Scans contributing to the voxel
+            scans = {scan_name: point_count
+                     for scan_name, point_count in zip(self.scan_names, scan_counts[voxel_idx]) if point_count}
+            entries[voxel_key] = [distance[voxel_idx], reflectance[voxel_idx], scans]
+        # Yield the last column
+        if column_x is not None:
+            yield str(column_x), voxel_column
+
+    # Full slice/timepoint JSON output dictionary (for interchange)
+    def to_output_dict(self):
+        return {'Grid Name': self.grid_name,
+                'Timepoint Name': self.timepoint_name,
+                'Slice Name': self.slice_name,
+                'Voxels': self.to_voxels_dict()}
+
+    # Save as a directory of .npy arrays plus a JSON header (source_header: entries identifying the decoded source)
+    def save(self, dir_path, source_header=None):
+        header = {'Format Version': FORMAT_VERSION,
+                  'Grid Name': self.grid_name,
+                  'Timepoint Name': self.timepoint_name,
+                  'Slice Name': self.slice_name,
+                  'Scan Names': self.scan_names,
+                  'Voxel Count': self.get_voxel_count(),
+                  'Y Axis': self.vox_y is not None,
+                  **(source_header or {})}
+        save_arrays(dir_path, self, SLICE_TIMEPOINT_ARRAYS + (['vox_y'] if self.vox_y is not None else []), header)
+
+    # Load from a directory written by save. Arrays are memory mapped (read only views, nothing is parsed)
+    @classmethod
+    def load(cls, dir_path, mmap_mode='r'):
+        # Load the header
+        with open(Path(dir_path, 'header.json'), 'r') as f:
+            header = json.load(f)
+        # Make the object
+        columns = cls(grid_name=header['Grid Name'],
+                      slice_name=header['Slice Name'],
+                      timepoint_name=header['Timepoint Name'])
+        columns.scan_names = header['Scan Names']
+        # Map each column
+        for column in SLICE_TIMEPOINT_ARRAYS + (['vox_y'] if header.get('Y Axis') else []):
+            setattr(columns, column, np.load(Path(dir_path, f'{column}.npy'), mmap_mode=mmap_mode))
+        # Return the object
+        return columns
+
+
+# Path of the columnar directory for a slice/timepoint
+def get_columns_path(dir_path, slice_name, timepoint_name):
+    return Path(dir_path, f'{slice_name}_{timepoint_name}{COLUMNS_SUFFIX}')
+
+
+# Load a slice/timepoint result from a directory, using the columnar form if it is current (see columns_are_current)
+# and the JSON if not
+def load_slice_timepoint(dir_path, slice_name, timepoint_name):
+    # Columnar and JSON paths
+    columns_path = get_columns_path(dir_path, slice_name, timepoint_name)
+    json_path = Path(dir_path, f'{slice_name}_{timepoint_name}.json')
+    # If the columnar form is current
+    if columns_are_current(columns_path, json_path):
+        # Memory map it
+        return load_cached(Path(columns_path, 'header.json'), lambda: SliceTimepointColumns.load(columns_path))
+
+    # Otherwise, parse the JSON one column at a time (the header entries are read before the voxels)
+
+    def decode():
+        header = {}
+        columns = SliceTimepointColumns.from_voxel_columns(
+            iter_json_object_entries(json_path, key='Voxels', header=header))
+        columns.grid_name = header.get('Grid Name')
+        columns.slice_name = header.get('Slice Name', slice_name)
+        columns.timepoint_name = header.get('Timepoint Name', timepoint_name)
+        return columns
+
+    return load_decoded(json_path, get_columns_path(Path(dir_path, DECODED_CACHE_DIR), slice_name, timepoint_name),
+                        SliceTimepointColumns, decode)
+
+
+# Path of the file load_slice_timepoint reads a slice/timepoint result from (the columnar header if it is current)
+def get_slice_timepoint_source(dir_path, slice_name, timepoint_name):
+    columns_path = get_columns_path(dir_path, slice_name, timepoint_name)
+    json_path = Path(dir_path, f'{slice_name}_{timepoint_name}.json')
+    if columns_are_current(columns_path, json_path):
+        return Path(columns_path, 'header.json')
+    return json_path
+
+
+# Columnar form of the results for a slice and timepoint pair (Grid.derive_events_from_timepoints), in file order.
+# Columns (one entry per column in the results):
+# col: column X, col_missing: bit mask of the timepoints missing the whole column (1: first, 2: second; 0 if both
+# have it), col_starts: start of the column's voxels in the voxel arrays (the end is the next column's start)
+# Voxels (one entry per voxel of an event or missing-data run):
+# row, event_number, change: voxel Z, event number and change (NaN for missing data)
+# missing: bit mask of the timepoints missing the voxel (0 for gain/loss voxels)
+class PairColumns:
+
+    def __init__(self, slice_name=None, first_tp=None, second_tp=None):
+
+        # Names for the result
+        self.slice_name = slice_name
+        self.first_tp = first_tp
+        self.second_tp = second_tp
+        # Column arrays
+        self.col = None
+        self.col_missing = None
+        self.col_starts = None
+        # Voxel arrays
+        self.row = None
+        self.event_number = None
+        self.change = None
+        self.missing = None
+
+    # Bit mask of a list of missing timepoints
+    def get_missing_mask(self, timepoints):
+        return (1 if self.first_tp in timepoints else 0) | (2 if self.second_tp in timepoints else 0)
+
+    # List of the missing timepoints in a bit mask
+    def get_missing_timepoints(self, mask):
+        return [timepoint for bit, timepoint in [(1, self.first_tp), (2, self.second_tp)] if mask & bit]
+
+    # Build from an iterable of (column, results) pairs, e.g. read one at a time from a pair JSON output
+    @classmethod
+    def from_pair_results(cls, pair_results, **kwargs):
+        # Make the object
+        pair_columns = cls(**kwargs)
+        # Column rows
+        cols = []
+        col_missing = []
+        col_starts = []
+        # Voxel rows
+        rows = []
+        event_numbers = []
+        changes = []
+        missing = []
+        # For each column
+        for col, col_results in pair_results:
+            cols.append(int(col))
+            col_starts.append(len(rows))
+            # If the whole column is missing
+            if isinstance(col_results, list):
+                col_missing.append(pair_columns.get_missing_mask(col_results))
+                continue
+            col_missing.append(0)
+            # For each event in the column
+            for event_number, event_voxels in col_results.items():
+                for row, value in event_voxels.items():
+                    rows.append(int(row))
+                    event_numbers.append(int(event_number))
+                    # If the voxel is missing data
+                    if isinstance(value, list):
+                        changes.append(np.nan)
+                        missing.append(pair_columns.get_missing_mask(value))
+                    else:
+                        changes.append(value)
+                        missing.append(0)
+        # Transfer the arrays
+        pair_columns.col = np.array(cols, dtype=np.int64)
+        pair_columns.col_missing = np.array(col_missing, dtype=np.uint8)
+        pair_columns.col_starts = np.array(col_starts, dtype=np.int64)
+        pair_columns.row = np.array(rows, dtype=np.int64)
+        pair_columns.event_number = np.array(event_numbers, dtype=np.int64)
+        pair_columns.change = np.array(changes, dtype=np.float64)
+        pair_columns.missing = np.array(missing, dtype=np.uint8)
+        # Return the object
+        return pair_columns
+
+    # Number of columns and voxels
+    def get_column_count(self):
+        return len(self.col)
+
+    def get_voxel_count(self):
+        return len(self.row)
+
+    # Yield (column, results) in the pair JSON layout (string keys, as after json.load), one column at a time
+    def iter_pair_results(self):
+        # Convert the arrays to lists once
+        cols = self.col.tolist()
+        col_missing = self.col_missing.tolist()
+        bounds = self.col_starts.tolist() + [self.get_voxel_count()]
+        rows = self.row.tolist()
+        event_numbers = self.event_number.tolist()
+        changes = self.change.tolist()
+        missing = self.missing.tolist()
+        # For each column
+        for col_idx, col in enumerate(cols):
+            # If the whole column is missing
+            if col_missing[col_idx]:
+                yield str(col), self.get_missing_timepoints(col_missing[col_idx])
+                continue
+            # Events of the column
+            col_results = {}
+            for voxel_idx in range(bounds[col_idx], bounds[col_idx + 1]):
+                event_voxels = col_results.setdefault(str(event_numbers[voxel_idx]), {})
+                if missing[voxel_idx]:
+                    event_voxels[str(rows[voxel_idx])] = self.get_missing_timepoints(missing[voxel_idx])
+                else:
+                    event_voxels[str(rows[voxel_idx])] = changes[voxel_idx]
+            yield str(col), col_results
+
+    # Save as a directory of .npy arrays plus a JSON header (source_header: entries identifying the decoded source)
+    def save(self, dir_path, source_header=None):
+        header = {'Format Version': FORMAT_VERSION,
+                  'Slice Name': self.slice_name,
+                  'First Timepoint': self.first_tp,
+                  'Second Timepoint': self.second_tp,
+                  'Column Count': self.get_column_count(),
+                  'Voxel Count': self.get_voxel_count(),
+                  **(source_header or {})}
+        save_arrays(dir_path, self, PAIR_ARRAYS, header)
+
+    # Load from a directory written by save. Arrays are memory mapped
+    @classmethod
+    def load(cls, dir_path, mmap_mode='r'):
+        # Load the header
+        with open(Path(dir_path, 'header.json'), 'r') as f:
+            header = json.load(f)
+        # Make the object
+        pair_columns = cls(slice_name=header['Slice Name'],
+                           first_tp=header['First Timepoint'],
+                           second_tp=header['Second Timepoint'])
+        # Map each array
+        for column in PAIR_ARRAYS:
+            setattr(pair_columns, column, np.load(Path(dir_path, f'{column}.npy'), mmap_mode=mmap_mode))
+        # Return the object
+        return pair_columns
+
+
+# Save arrays of an object and a JSON header to a directory (via a temporary directory, so a partial write
+# never looks complete)
+def save_arrays(dir_path, source, array_names, header):
+    dir_path = Path(dir_path)
+    tmp_path = Path(f'{dir_path}.tmp')
+    if exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    makedirs(tmp_path)
+    # Save each array
+    for array_name in array_names:
+        np.save(Path(tmp_path, f'{array_name}.npy'), getattr(source, array_name))
+    # Save the header
+    with open(Path(tmp_path, 'header.json'), 'w') as of:
+        json.dump(header, of)
+    # Replace any existing directory
+    if exists(dir_path):
+        shutil.rmtree(dir_path)
+    replace(tmp_path, dir_path)
+
+
+# Path of the columnar directory for a slice and timepoint pair
+def get_pair_columns_path(dir_path, slice_name, first_tp, second_tp):
+    return Path(dir_path, f'{slice_name}_{first_tp}_{second_tp}{COLUMNS_SUFFIX}')
+
+
+# Yield (column, results) for a slice and timepoint pair from a directory, using the columnar form if it is current
+# and reading the JSON one column at a time if not
+def iter_pair_results(dir_path, slice_name, first_tp, second_tp):
+    # Columnar and JSON paths
+    columns_path = get_pair_columns_path(dir_path, slice_name, first_tp, second_tp)
+    json_path = Path(dir_path, f'{slice_name}_{first_tp}_{second_tp}.json')
+    # If the columnar form is current
+    if columns_are_current(columns_path, json_path):
+        return PairColumns.load(columns_path).iter_pair_results()
+    # Otherwise, read the JSON
+    return iter_json_object_entries(json_path)
+
+
+# Load the results for a slice and timepoint pair from a directory as a PairColumns object, memory mapping the
+# columnar form if it is current and reading the JSON one column at a time if not
+def load_pair_results(dir_path, slice_name, first_tp, second_tp):
+    # Columnar and JSON paths
+    columns_path = get_pair_columns_path(dir_path, slice_name, first_tp, second_tp)
+    json_path = Path(dir_path, f'{slice_name}_{first_tp}_{second_tp}.json')
+    # If the columnar form is current
+    if columns_are_current(columns_path, json_path):
+        return load_cached(Path(columns_path, 'header.json'), lambda: PairColumns.load(columns_path))
+    # Otherwise, read the JSON
+    return load_decoded(json_path,
+                        get_pair_columns_path(Path(dir_path, DECODED_CACHE_DIR), slice_name, first_tp, second_tp),
+                        PairColumns,
+                        lambda: PairColumns.from_pair_results(iter_json_object_entries(json_path),
+                                                              slice_name=slice_name,
+                                                              first_tp=first_tp,
+                                                              second_tp=second_tp))
+
+
+# Path of the file load_pair_results reads a slice and timepoint pair's results from (the columnar header if it is
+# current)
+def get_pair_source(dir_path, slice_name, first_tp, second_tp):
+    columns_path = get_pair_columns_path(dir_path, slice_name, first_tp, second_tp)
+    json_path = Path(dir_path, f'{slice_name}_{first_tp}_{second_tp}.json')
+    if columns_are_current(columns_path, json_path):
+        return Path(columns_path, 'header.json')
+    return json_path
+
+
+# Check whether results for a slice and timepoint pair exist in a directory (columnar or JSON)
+def pair_results_exist(dir_path, slice_name, first_tp, second_tp):
+    return exists(Path(get_pair_columns_path(dir_path, slice_name, first_tp, second_tp), 'header.json')) or \
+        exists(Path(dir_path, f'{slice_name}_{first_tp}_{second_tp}.json'))
+
+
+# Remove the results for a slice and timepoint pair from a directory (JSON, columnar form and decoded copy)
+def remove_pair_results(dir_path, slice_name, first_tp, second_tp):
+    json_path = Path(dir_path, f'{slice_name}_{first_tp}_{second_tp}.json')
+    if exists(json_path):
+        remove(json_path)
+    for columns_path in [get_pair_columns_path(dir_path, slice_name, first_tp, second_tp),
+                         get_pair_columns_path(Path(dir_path, DECODED_CACHE_DIR), slice_name, first_tp, second_tp)]:
+        shutil.rmtree(columns_path, ignore_errors=True)
+
+
+# Key identifying a version of a source file (path, size and modification time)
+def get_source_key(file_path):
+    file_stat = stat(file_path)
+    return str(Path(file_path).resolve()), file_stat.st_size, file_stat.st_mtime_ns
+
+
+# Header entries recording the version of the source file a columnar form was made from (see save's source_header)
+def get_source_header(file_path):
+    source_path_key, source_size, source_modified = get_source_key(file_path)
+    return {'Source Path': source_path_key, 'Source Size': source_size, 'Source Modified': source_modified}
+
+
+# Check whether the columnar form at columns_path can be used in place of the JSON at json_path: it exists, and
+# either there is no JSON, or its header records the JSON's current version (get_source_header). A columnar form
+# that does not record a source (e.g. one exported before sources were recorded) is used only if it is newer than
+# the JSON
+def columns_are_current(columns_path, json_path):
+    header_path = Path(columns_path, 'header.json')
+    # If there is no columnar form
+    if not exists(header_path):
+        return False
+    # If there is no JSON to be stale against
+    if not exists(json_path):
+        return True
+    # Load the header
+    try:
+        with open(header_path, 'r') as f:
+            header = json.load(f)
+    # If it is unreadable, use the JSON
+    except (OSError, ValueError):
+        return False
+    # If the source was recorded
+    if 'Source Path' in header:
+        return (header.get('Source Path'), header.get('Source Size'), header.get('Source Modified')) == \
+            get_source_key(json_path)
+    # Otherwise, compare the modification times
+    return stat(header_path).st_mtime_ns >= stat(json_path).st_mtime_ns
+
+
+# Result loaded from a source file, kept in memory (least recently used results are dropped past
+# MEMORY_CACHE_SIZE). A changed source has a new key, so its old result is never returned
+def load_cached(source_path, load):
+    source_key = get_source_key(source_path)
+    # If it is in memory
+    with _memory_cache_lock:
+        if source_key in _memory_cache:
+            _memory_cache.move_to_end(source_key)
+            return _memory_cache[source_key]
+    # Otherwise, load it
+    result = load()
+    # Keep it
+    with _memory_cache_lock:
+        _memory_cache[source_key] = result
+        while len(_memory_cache) > MEMORY_CACHE_SIZE:
+            _memory_cache.popitem(last=False)
+    return result
+
+
+# Result decoded from a JSON source file, through the memory cache and then an on-disk decoded copy at cache_path
+# (used only if it was made from the same path, size and modification time). Otherwise the source is decoded and
+# the copy is (re)written
+def load_decoded(source_path, cache_path, result_class, decode):
+    source_header = get_source_header(source_path)
+
+    def load():
+        # If the decoded copy matches the source
+        if columns_are_current(cache_path, source_path):
+            # Memory map it
+            return result_class.load(cache_path)
+        # Otherwise, decode the source
+        result = decode()
+        # Save the decoded copy (a read-only drive just means no copy)
+        try:
+            result.save(cache_path, source_header=source_header)
+        except OSError as e:
+            logging.warning(f'Could not save a decoded copy of {source_path}. {e}')
+        return result
+
+    return load_cached(source_path, load)
@@ -0,0 +1,210 @@
+from collections.abc import Mapping
+import numpy as np
+import c_columnar
+import c_voxels
+
+# Order of the statistics in the stat arrays (same as VoxelStats.flatten)
+STAT_NAMES = ['min', 'max', 'mean', 'median', 'stdev']
+
+
+class DenseVoxelGrid:
+
+    def __init__(self, name=None, timepoint_name=None, voxel_size=None):
+
+        # Name of the grid (project)
+        self.name = name
+        # Name of the timepoint the statistics are for
+        self.timepoint_name = timepoint_name
+        # Size of each voxel in the grid
+        self.voxel_size = voxel_size
+        # Voxel X and Z of array index [0, 0]
+        self.x_origin = 0
+        self.z_origin = 0
+        # Stat arrays with shape (X, Z, 5), NaN where there is no voxel
+        self.distance = None
+        self.reflectance = None
+        # Boolean array with shape (X, Z), True where there is a voxel
+        self.occupied = None
+        # Scan names and point counts per scan with shape (X, Z, scans)
+        self.scan_names = []
+        self.scan_counts = None
+
+    # Build from voxel coordinate arrays and per-voxel stat rows
+    # vox_x, vox_z: integer arrays (one entry per voxel)
+    # distance, reflectance: (voxels, 5) arrays in VoxelStats.flatten order (reflectance NaN where not exported)
+    # scan_counts: (voxels, scans) array of point counts, one column per name in scan_names
+    # origin: optional (X, Z) voxel for index [0, 0], e.g. from the grid offsets (extended to cover the data)
+    @classmethod
+    def from_arrays(cls, vox_x, vox_z, distance, reflectance, scan_counts, scan_names, origin=None, **kwargs):
+        # Make the object
+        dense = cls(**kwargs)
+        vox_x = np.asarray(vox_x, dtype=np.int64)
+        vox_z = np.asarray(vox_z, dtype=np.int64)
+        # If there are no voxels
+        if len(vox_x) == 0:
+            # Empty arrays
+            x_min, z_min, x_max, z_max = 0, 0, -1, -1
+        # Otherwise
+        else:
+            # Extent of the voxels
+            x_min, z_min, x_max, z_max = vox_x.min(), vox_z.min(), vox_x.max(), vox_z.max()
+        # If an origin was given
+        if origin is not None:
+            # Use it, unless the data extend below it
+            x_min = min(x_min, origin[0])
+            z_min = min(z_min, origin[1])
+        dense.x_origin = int(x_min)
+        dense.z_origin = int(z_min)
+        # Shape of the grid
+        shape = (int(x_max - x_min + 1), int(z_max - z_min + 1))
+        # Array indices of the voxels
+        x_idx = vox_x - dense.x_origin
+        z_idx = vox_z - dense.z_origin
+        # Fill the arrays
+        dense.occupied = np.zeros(shape, dtype=bool)
+        dense.occupied[x_idx, z_idx] = True
+        dense.distance = np.full(shape + (len(STAT_NAMES),), np.nan)
+        dense.distance[x_idx, z_idx] = distance
+        dense.reflectance = np.full(shape + (len(STAT_NAMES),), np.nan)
+        dense.reflectance[x_idx, z_idx] = reflectance
+        dense.scan_names = list(scan_names)
+        dense.scan_counts = np.zeros(shape + (len(dense.scan_names),), dtype=np.int32)
+        dense.scan_counts[x_idx, z_idx] = scan_counts
+        # Return the object
+        return dense
+
+    # Build from a slice/timepoint result loaded in columnar form (c_columnar.SliceTimepointColumns), e.g. with
+    # c_columnar.load_slice_timepoint, without going through Voxel objects
+    # origin: optional (X, Z) voxel for index [0, 0] (see Grid.get_voxel_origin)
+    @classmethod
+    def from_columns(cls, columns, origin=None, **kwargs):
+        # If the result has a Y axis, it has several voxels per (X, Z)
+        if columns.vox_y is not None:
+            raise ValueError(f'{columns.slice_name}_{columns.timepoint_name} has a Y axis and no dense X/Z grid.')
+        return cls.from_arrays(columns.vox_x, columns.vox_z,
+                               columns.distance,
+                               columns.reflectance,
+                               columns.scan_counts,
+                               columns.scan_names,
+                               origin=origin,
+                               name=kwargs.pop('name', columns.grid_name),
+                               timepoint_name=kwargs.pop('timepoint_name', columns.timepoint_name),
+                               **kwargs)
+
+    # Columnar form of the grid for a slice (c_columnar.SliceTimepointColumns), for export and the project store.
+    # Voxels whose reflectance stats are all NaN are treated as having no reflectance results
+    def to_columns(self, slice_name=None):
+        # Array indices and coordinates of the occupied voxels
+        x_idx, z_idx = np.nonzero(self.occupied)
+        reflectance = self.reflectance[x_idx, z_idx]
+        # Make the object
+        columns = c_columnar.SliceTimepointColumns(grid_name=self.name,
+                                                   slice_name=slice_name,
+                                                   timepoint_name=self.timepoint_name)
+        columns.set_arrays(x_idx + self.x_origin,
+                           z_idx + self.z_origin,
+                           self.distance[x_idx, z_idx],
+                           reflectance,
+                           ~np.isnan(reflectance).all(axis=1),
+                           self.scan_counts[x_idx, z_idx],
+                           self.scan_names)
+        # Return the object
+        return columns
+
+    # Get a statistic for every voxel as an (X, Z) array, e.g. get_stat('distance', 'mean')
+    def get_stat(self, stats_set, stat):
+        return getattr(self, stats_set)[:, :, STAT_NAMES.index(stat)]
+
+    # Array index for voxel X and Z (None if outside the grid)
+    def get_index(self, vox_x, vox_z):
+        x_idx = int(vox_x) - self.x_origin
+        z_idx = int(vox_z) - self.z_origin
+        if 0 <= x_idx < self.occupied.shape[0] and 0 <= z_idx < self.occupied.shape[1]:
+            return x_idx, z_idx
+        return None
+
+    # Coordinates of the occupied voxels as (vox_x, vox_z) arrays
+    def get_voxel_coords(self):
+        x_idx, z_idx = np.nonzero(self.occupied)
+        return x_idx + self.x_origin, z_idx + self.z_origin
+
+    # Make a Voxel object (with VoxelStats) for voxel X and Z, for code that expects one
+    def make_voxel(self, vox_x, vox_z):
+        # Array index
+        x_idx, z_idx = self.get_index(vox_x, vox_z)
+        # Make the Voxel object
+        new_voxel = c_voxels.Voxel(x=int(vox_x), z=int(vox_z))
+        new_voxel.stats_by_timepoint[self.timepoint_name] = {}
+        # For each set of stats
+        for stats_set in ['distance', 'reflectance']:
+            stat_row = getattr(self, stats_set)[x_idx, z_idx]
+            # If there are no stats (the file had no reflectance)
+            if np.isnan(stat_row).all():
+                new_voxel.stats_by_timepoint[self.timepoint_name][stats_set] = None
+                continue
+            # Make the VoxelStats object
+            vox_stats = c_voxels.VoxelStats()
+            for stat, value in zip(STAT_NAMES, stat_row.tolist()):
+                setattr(vox_stats, stat, value)
+            new_voxel.stats_by_timepoint[self.timepoint_name][stats_set] = vox_stats
+        # Scans contributing points to the voxel
+        for scan_idx, point_count in enumerate(self.scan_counts[x_idx, z_idx].tolist()):
+            if point_count:
+                new_voxel.scans[self.scan_names[scan_idx]] = point_count
+        # Return the voxel
+        return new_voxel
+
+    # Compatibility view indexed like Grid.voxels[x][z]
+    @property
+    def voxels(self):
+        return DenseVoxelView(self)
+
+
+# Read-only view of a DenseVoxelGrid with nested keys [X][Z], making Voxel objects on access
+class DenseVoxelView(Mapping):
+
+    def __init__(self, dense):
+
+        self.dense = dense
+
+    def __getitem__(self, vox_x):
+        # Array index of the column
+        x_idx = int(vox_x) - self.dense.x_origin
+        # If the column has no voxels
+        if not 0 <= x_idx < self.dense.occupied.shape[0] or not self.dense.occupied[x_idx].any():
+            raise KeyError(vox_x)
+        return DenseColumnView(self.dense, int(vox_x))
+
+    def __iter__(self):
+        # Columns with at least one voxel
+        for x_idx in np.nonzero(self.dense.occupied.any(axis=1))[0].tolist():
+            yield x_idx + self.dense.x_origin
+
+    def __len__(self):
+        return int(self.dense.occupied.any(axis=1).sum())
+
+
+# Read-only view of one column of a DenseVoxelGrid with keys [Z]
+class DenseColumnView(Mapping):
+
+    def __init__(self, dense, vox_x):
+
+        self.dense = dense
+        self.vox_x = vox_x
+
+    def __getitem__(self, vox_z):
+        # Array index of the voxel
+        index = self.dense.get_index(self.vox_x, vox_z)
+        # If there is no voxel
+        if index is None or not self.dense.occupied[index]:
+            raise KeyError(vox_z)
+        return self.dense.make_voxel(self.vox_x, vox_z)
+
+    def __iter__(self):
+        # Rows with a voxel
+        x_idx = self.vox_x - self.dense.x_origin
+        for z_idx in np.nonzero(self.dense.occupied[x_idx])[0].tolist():
+            yield z_idx + self.dense.z_origin
+
+    def __len__(self):
+        return int(self.dense.occupied[self.vox_x - self.dense.x_origin].sum())
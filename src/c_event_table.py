@@ -0,0 +1,274 @@
+import numpy as np
+
+# Event type codes (the sign of the event's first voxel change, as Grid.load_events has always classified them)
+GAIN = 1
+LOSS = -1
+NO_CHANGE = 0
+TYPE_NAMES = {GAIN: 'Gain', LOSS: 'Loss', NO_CHANGE: 'No Change'}
+TYPE_CODES = {name: code for code, name in TYPE_NAMES.items()}
+# Row (and event number) of a missing-data record for a whole column
+WHOLE_COLUMN = np.iinfo(np.int64).min
+
+# One record per gain/loss event:
+# pair, slice: codes of the timepoint pair and slice (indexes into EventTable.pairs and EventTable.slice_names)
+# col, event: column and event number (as in the pair results)
+# type: GAIN, LOSS or NO_CHANGE
+# voxel_count, min_row, max_row: number of voxels and row span
+# net_change: sum of the voxel changes, volume: net change as a volume, mean_height: mean row height
+# voxel_start: index of the event's first voxel in EventTable.voxel_rows / voxel_changes
+EVENT_DTYPE = np.dtype([('pair', np.int32),
+                        ('slice', np.int32),
+                        ('col', np.int64),
+                        ('event', np.int64),
+                        ('type', np.int8),
+                        ('voxel_count', np.int64),
+                        ('min_row', np.int64),
+                        ('max_row', np.int64),
+                        ('net_change', np.float64),
+                        ('volume', np.float64),
+                        ('mean_height', np.float64),
+                        ('voxel_start', np.int64)])
+# One record per missing voxel, or per missing column (row and event WHOLE_COLUMN):
+# timepoints: bit mask of the timepoints missing it (1: first timepoint of the pair, 2: second)
+MISSING_DTYPE = np.dtype([('pair', np.int32),
+                          ('slice', np.int32),
+                          ('col', np.int64),
+                          ('row', np.int64),
+                          ('event', np.int64),
+                          ('timepoints', np.uint8)])
+
+
+# Array-backed table of the events of any number of slices and timepoint pairs (filled by Grid.load_events).
+# Events are stored as records of EVENT_DTYPE with their voxels in flat row/change arrays, and missing data as
+# records of MISSING_DTYPE, so loading many slices keeps every event (they are keyed by slice and pair as well as
+# column) and per-event metrics are computed for all events at once.
+class EventTable:
+
+    def __init__(self):
+
+        # Names for the slice and pair codes
+        self.slice_names = []
+        self.pairs = []
+        # Loaded (pair code, slice code) results
+        self.loaded = set()
+        # Blocks added since the arrays were last joined
+        self.event_blocks = []
+        self.missing_blocks = []
+        self.row_blocks = []
+        self.change_blocks = []
+        # Joined arrays
+        self._events = np.empty(0, dtype=EVENT_DTYPE)
+        self._missing = np.empty(0, dtype=MISSING_DTYPE)
+        self._voxel_rows = np.empty(0, dtype=np.int64)
+        self._voxel_changes = np.empty(0, dtype=np.float64)
+        # Number of event voxels added (joined or not)
+        self.voxel_total = 0
+        # Size of each voxel (from the grid the events were loaded for)
+        self.voxel_size = None
+        # Cached results of get_metrics and get_voxel_volumes (cleared when events are added)
+        self.metrics = None
+        self.voxel_volumes = None
+
+    # Number of events
+    def __len__(self):
+        return len(self.events)
+
+    # Code of a slice name (added if necessary)
+    def get_slice_code(self, slice_name):
+        if slice_name not in self.slice_names:
+            self.slice_names.append(slice_name)
+        return self.slice_names.index(slice_name)
+
+    # Code of a timepoint pair (added if necessary)
+    def get_pair_code(self, first_tp, second_tp):
+        if (first_tp, second_tp) not in self.pairs:
+            self.pairs.append((first_tp, second_tp))
+        return self.pairs.index((first_tp, second_tp))
+
+    # Check whether results for a slice and timepoint pair have been added
+    def has_results(self, slice_name, first_tp, second_tp):
+        return (slice_name in self.slice_names and (first_tp, second_tp) in self.pairs and
+                (self.pairs.index((first_tp, second_tp)), self.slice_names.index(slice_name)) in self.loaded)
+
+    # Add the results for a slice and timepoint pair from a c_columnar.PairColumns object
+    def add_pair_columns(self, pair_columns, voxel_size):
+        # Codes for the slice and pair
+        slice_code = self.get_slice_code(pair_columns.slice_name)
+        pair_code = self.get_pair_code(pair_columns.first_tp, pair_columns.second_tp)
+        self.loaded.add((pair_code, slice_code))
+        # Voxel size for the metrics
+        self.voxel_size = voxel_size
+        # Column of every voxel
+        col_bounds = np.append(np.asarray(pair_columns.col_starts), pair_columns.get_voxel_count())
+        voxel_cols = np.repeat(np.asarray(pair_columns.col), np.diff(col_bounds))
+        rows = np.asarray(pair_columns.row)
+        event_numbers = np.asarray(pair_columns.event_number)
+        changes = np.asarray(pair_columns.change)
+        missing = np.asarray(pair_columns.missing)
+        # Gain/loss voxels (in file order, so each event's voxels are contiguous)
+        present = missing == 0
+        event_cols = voxel_cols[present]
+        event_numbers_present = event_numbers[present]
+        event_rows = rows[present]
+        event_changes = changes[present]
+        # Start of each event (where the column or event number changes)
+        new_event = np.ones(len(event_rows), dtype=bool)
+        new_event[1:] = (event_cols[1:] != event_cols[:-1]) | (event_numbers_present[1:] != event_numbers_present[:-1])
+        starts = np.flatnonzero(new_event)
+        # Event records
+        events = np.empty(len(starts), dtype=EVENT_DTYPE)
+        events['pair'] = pair_code
+        events['slice'] = slice_code
+        if len(starts):
+            counts = np.diff(np.append(starts, len(event_rows)))
+            events['col'] = event_cols[starts]
+            events['event'] = event_numbers_present[starts]
+            # Type from the sign of the first voxel's change
+            events['type'] = np.sign(event_changes[starts])
+            events['voxel_count'] = counts
+            events['min_row'] = np.minimum.reduceat(event_rows, starts)
+            events['max_row'] = np.maximum.reduceat(event_rows, starts)
+            events['net_change'] = np.add.reduceat(event_changes, starts)
+            events['volume'] = events['net_change'] * voxel_size ** 2
+            events['mean_height'] = np.add.reduceat(event_rows, starts) / counts * voxel_size
+            events['voxel_start'] = starts + self.voxel_total
+        # Missing voxels, then missing columns
+        whole_columns = np.asarray(pair_columns.col_missing) != 0
+        missing_records = np.empty(int((~present).sum() + whole_columns.sum()), dtype=MISSING_DTYPE)
+        missing_records['pair'] = pair_code
+        missing_records['slice'] = slice_code
+        missing_records['col'] = np.concatenate((voxel_cols[~present], np.asarray(pair_columns.col)[whole_columns]))
+        missing_records['row'] = np.concatenate((rows[~present], np.full(whole_columns.sum(), WHOLE_COLUMN)))
+        missing_records['event'] = np.concatenate((event_numbers[~present], np.full(whole_columns.sum(), WHOLE_COLUMN)))
+        missing_records['timepoints'] = np.concatenate((missing[~present],
+                                                        np.asarray(pair_columns.col_missing)[whole_columns]))
+        # Store the blocks
+        self.event_blocks.append(events)
+        self.missing_blocks.append(missing_records)
+        self.row_blocks.append(event_rows)
+        self.change_blocks.append(event_changes)
+        self.voxel_total += len(event_rows)
+        # Clear the cached metrics
+        self.metrics = None
+        self.voxel_volumes = None
+
+    # Join any added blocks into the arrays
+    def join_blocks(self):
+        if self.event_blocks:
+            self._events = np.concatenate([self._events] + self.event_blocks)
+            self._missing = np.concatenate([self._missing] + self.missing_blocks)
+            self._voxel_rows = np.concatenate([self._voxel_rows] + self.row_blocks)
+            self._voxel_changes = np.concatenate([self._voxel_changes] + self.change_blocks)
+            self.event_blocks = []
+            self.missing_blocks = []
+            self.row_blocks = []
+            self.change_blocks = []
+
+    # Event records (EVENT_DTYPE)
+    @property
+    def events(self):
+        self.join_blocks()
+        return self._events
+
+    # Missing-data records (MISSING_DTYPE)
+    @property
+    def missing(self):
+        self.join_blocks()
+        return self._missing
+
+    # Rows and changes of every event voxel (each event's voxels start at its voxel_start)
+    @property
+    def voxel_rows(self):
+        self.join_blocks()
+        return self._voxel_rows
+
+    @property
+    def voxel_changes(self):
+        self.join_blocks()
+        return self._voxel_changes
+
+    # Event index of every event voxel
+    def get_voxel_event_index(self):
+        return np.repeat(np.arange(len(self.events)), self.events['voxel_count'])
+
+    # Rows and changes of one event's voxels
+    def get_event_voxels(self, event_idx):
+        start = self.events['voxel_start'][event_idx]
+        end = start + self.events['voxel_count'][event_idx]
+        return self.voxel_rows[start:end], self.voxel_changes[start:end]
+
+    # Boolean mask of the records (events by default) matching optional filters. Values that are lists, tuples
+    # or sets match any of their entries. event_type may be a code or a name ('Gain', 'Loss', 'No Change')
+    def select(self, slices=None, first_tp=None, second_tp=None, event_type=None, col=None, records=None):
+        records = self.events if records is None else records
+        mask = np.ones(len(records), dtype=bool)
+        # Slices
+        if slices is not None:
+            slices = [slices] if isinstance(slices, str) else slices
+            mask &= np.isin(records['slice'], [self.slice_names.index(name) for name in slices
+                                               if name in self.slice_names])
+        # Timepoint pairs
+        if first_tp is not None or second_tp is not None:
+            mask &= np.isin(records['pair'], [pair_code for pair_code, (first, second) in enumerate(self.pairs)
+                                              if first_tp in (None, first) and second_tp in (None, second)])
+        # Event types
+        if event_type is not None:
+            event_types = event_type if isinstance(event_type, (list, tuple, set)) else [event_type]
+            mask &= np.isin(records['type'], [TYPE_CODES.get(name, name) for name in event_types])
+        # Columns
+        if col is not None:
+            mask &= np.isin(records['col'], list(col) if isinstance(col, (list, tuple, set)) else [int(col)])
+        return mask
+
+    # Number of events (gain/loss events and missing voxels, each its own event number) in each column of each
+    # slice and pair that has any, for optional slice and pair filters
+    def get_event_counts_per_col(self, slices=None, first_tp=None, second_tp=None, include_missing=True):
+        # Key fields of the counted records
+        key_dtype = np.dtype([('pair', np.int32), ('slice', np.int32), ('col', np.int64)])
+        # Events
+        events = self.events[self.select(slices, first_tp, second_tp)]
+        keys = [events[['pair', 'slice', 'col']].astype(key_dtype)]
+        # Missing voxels (not whole columns)
+        if include_missing:
+            missing = self.missing[self.select(slices, first_tp, second_tp, records=self.missing) &
+                                   (self.missing['row'] != WHOLE_COLUMN)]
+            keys.append(missing[['pair', 'slice', 'col']].astype(key_dtype))
+        # Count per column
+        return np.unique(np.concatenate(keys), return_counts=True)[1]
+
+    # Metrics of every event, computed for all events at once and cached until more events are added:
+    # volume, mean_height, min_height, max_height, height_range and coeff_var (stdev / mean of the voxel changes)
+    def get_metrics(self):
+        # If the metrics are cached
+        if self.metrics is not None:
+            return self.metrics
+        events = self.events
+        # Heights from the row span
+        min_height = events['min_row'] * self.voxel_size if len(events) else np.empty(0)
+        max_height = events['max_row'] * self.voxel_size if len(events) else np.empty(0)
+        # Coefficient of variation of each event's voxel changes (population standard deviation, as np.std)
+        means = events['net_change'] / np.maximum(events['voxel_count'], 1)
+        deviations = (self.voxel_changes - means[self.get_voxel_event_index()]) ** 2
+        stdevs = np.sqrt(self.reduce_events(deviations) / np.maximum(events['voxel_count'], 1))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            coeff_var = stdevs / means
+        # Cache the metrics
+        self.metrics = {'volume': events['volume'],
+                        'mean_height': events['mean_height'],
+                        'min_height': min_height,
+                        'max_height': max_height,
+                        'height_range': max_height - min_height,
+                        'coeff_var': coeff_var}
+        return self.metrics
+
+    # Volume of every event voxel's change (cached until more events are added)
+    def get_voxel_volumes(self):
+        if self.voxel_volumes is None:
+            self.voxel_volumes = self.voxel_changes * self.voxel_size ** 2
+        return self.voxel_volumes
+
+    # Sum of a per-voxel array over each event's voxels
+    def reduce_events(self, voxel_values):
+        if len(self.events) == 0:
+            return np.empty(0)
+        return np.add.reduceat(voxel_values, self.events['voxel_start'])
@@ -0,0 +1,281 @@
+from pathlib import Path
+import shutil
+import tempfile
+import logging
+import numpy as np
+import c_voxels
+import c_dense_grid
+from h_grouped_stats import grouped_summary_stats
+
+# Layout of a spilled point record
+RECORD_DTYPE = np.dtype([('key', np.int64),
+                         ('distance', np.float64),
+                         ('reflectance', np.float64),
+                         ('scan', np.int32),
+                         ('has_reflectance', np.uint8)])
+# Bias added to signed voxel coordinates (within +/- 2^30) so the (X, Z) key sorts by X, then Z
+KEY_BIAS = 1 << 30
+
+
+# Encode voxel X and Z into an int64 key that sorts by X, then Z. Raises ValueError if a coordinate is not within
+# +/- 2^30 (its key would collide or not sort)
+def encode_voxel_key(vox_x, vox_z):
+    biased_x = np.asarray(vox_x, dtype=np.int64) + KEY_BIAS
+    biased_z = np.asarray(vox_z, dtype=np.int64) + KEY_BIAS
+    # If any coordinate does not fit in its 31 bits
+    if np.any((biased_x < 0) | (biased_x >= 2 * KEY_BIAS) | (biased_z < 0) | (biased_z >= 2 * KEY_BIAS)):
+        raise ValueError(f'Voxel X and Z must be within +/- {KEY_BIAS} to be encoded as sort keys.')
+    return (biased_x << 32) | biased_z
+
+
+# Decode keys from encode_voxel_key back into voxel X and Z
+def decode_voxel_key(keys):
+    keys = np.asarray(keys, dtype=np.int64)
+    return (keys >> 32) - KEY_BIAS, (keys & 0xffffffff) - KEY_BIAS
+
+
+# Out-of-core ingestion of the point clouds for one slice/timepoint into a Grid.
+# Points are spilled as (voxel key, distance, reflectance, scan) records to sorted run files, the runs are k-way
+# merged, and each voxel is reduced as soon as all of its records have been seen. Peak memory is bounded by
+# memory_budget (bytes) rather than by the point count, and the statistics match the in-memory path exactly.
+# Points are read from the binary point cloud cache (Grid.build_point_cloud_cache) where it is current.
+# dense: reduce the voxels into a c_dense_grid.DenseVoxelGrid (dense_grid) instead of Voxel objects in the grid, so
+# the results never go through per-voxel Python objects
+class ExternalSortIngest:
+
+    def __init__(self, grid, memory_budget=1000000000, temp_dir=None, use_cache=True, dense=False):
+
+        # If the grid's voxels are not located by X and Z (e.g. c_sparse_grid.SparseVoxelGrid)
+        if grid.coord_names != c_voxels.Grid.coord_names:
+            raise ValueError(f'Out-of-core ingest keys voxels by X and Z only, not by {grid.coord_names}.')
+
+        # Grid the voxels are added to
+        self.grid = grid
+        # Memory budget for the point records (bytes)
+        self.memory_budget = memory_budget
+        # Directory for the run files (system temporary directory if None)
+        self.temp_dir = temp_dir
+        # Whether to read the binary point cloud cache where it is current
+        self.use_cache = use_cache
+        # Paths of the run files
+        self.run_paths = []
+        # Scan names, indexed by the scan id stored in the records
+        self.scan_names = []
+        # Whether to reduce into a DenseVoxelGrid, the reduced arrays waiting to be joined into it, and the grid
+        self.dense = dense
+        self.dense_blocks = []
+        self.dense_grid = None
+
+    # Number of records held in memory for one sorted run (leaving room for the sort)
+    def get_run_length(self):
+        return max(int(self.memory_budget // (RECORD_DTYPE.itemsize * 4)), 1000)
+
+    # Ingest a list of ASCII point clouds for the same timepoint, then generate the voxels' summary stats
+    def process_point_clouds(self, file_paths, percentiles=None):
+        # Directory for this ingest's run files
+        run_dir = Path(tempfile.mkdtemp(prefix='voxel_runs_', dir=self.temp_dir))
+        try:
+            # Spill the points to sorted runs
+            timepoint_name = self.spill_runs(file_paths, run_dir)
+            # If there were no files
+            if timepoint_name is None:
+                return
+            # Merge the runs and reduce each voxel
+            self.merge_runs(timepoint_name, percentiles)
+            # If reducing into a dense grid
+            if self.dense:
+                # Join the reduced arrays into it
+                self.build_dense_grid(timepoint_name)
+        finally:
+            # Remove the run files
+            shutil.rmtree(run_dir, ignore_errors=True)
+            self.run_paths = []
+
+    # Read the point clouds and write sorted runs of records. Returns the timepoint name
+    def spill_runs(self, file_paths, run_dir):
+        # Timepoint for the ingest
+        timepoint_name = None
+        # Records waiting to be sorted and spilled
+        buffer = []
+        buffer_length = 0
+        run_length = self.get_run_length()
+        # For each file
+        for file_path in file_paths:
+            # Get the components from the file name from the path
+            slice_name, scan_name, file_timepoint = self.grid.get_file_name_components(file_path)
+            # If this is the first file
+            if timepoint_name is None:
+                timepoint_name = file_timepoint
+                # Create Timepoint
+                self.grid.add_timepoint(timepoint_name)
+            # If the file is for another timepoint
+            elif file_timepoint != timepoint_name:
+                # Log an error
+                logging.error(f'Out-of-core ingest of {file_path} skipped. Expected timepoint {timepoint_name}.')
+                # Skip it
+                continue
+            # Add a scan to the Timepoint object
+            self.grid.timepoints[timepoint_name].add_scan(scan_name)
+            # Scan id for the records
+            if scan_name not in self.scan_names:
+                self.scan_names.append(scan_name)
+            scan_id = self.scan_names.index(scan_name)
+            # If using the binary cache and it is up to date
+            if self.use_cache and self.grid.point_cloud_cache_is_current(file_path):
+                # Read the chunks from the memory-mapped cache
+                chunks = self.grid.yield_cached_point_chunks(file_path, chunk_size=run_length)
+            # Otherwise
+            else:
+                # Parse the chunks from the ASCII file
+                chunks = self.grid.yield_point_chunks(file_path, chunk_size=run_length)
+            # Iterate over the chunks of the file
+            for coords, reflectance in chunks:
+                # Make the records for the chunk
+                vox_coords = self.grid.get_voxel_coords_array(coords)
+                records = np.empty(len(coords), dtype=RECORD_DTYPE)
+                records['key'] = encode_voxel_key(vox_coords[:, 0], vox_coords[:, 2])
+                records['distance'] = coords[:, 1]
+                records['reflectance'] = reflectance if reflectance is not None else np.nan
+                records['scan'] = scan_id
+                records['has_reflectance'] = reflectance is not None
+                buffer.append(records)
+                buffer_length += len(records)
+                # If the buffer is full
+                if buffer_length >= run_length:
+                    # Spill it
+                    self.write_run(np.concatenate(buffer), run_dir)
+                    buffer = []
+                    buffer_length = 0
+        # Spill whatever is left
+        if buffer_length:
+            self.write_run(np.concatenate(buffer), run_dir)
+        # Return the timepoint name
+        return timepoint_name
+
+    # Sort records by voxel key and write them as a run file
+    def write_run(self, records, run_dir):
+        # Run path
+        run_path = Path(run_dir, f'run_{len(self.run_paths):05d}.bin')
+        # Sort and write
+        records[np.argsort(records['key'], kind='stable')].tofile(run_path)
+        self.run_paths.append(run_path)
+        # Log info
+        logging.debug(f'Spilled {len(records)} point records to {run_path}.')
+
+    # K-way merge the runs, reducing voxels as soon as all of their records have been read
+    def merge_runs(self, timepoint_name, percentiles=None):
+        # Memory map the runs
+        runs = [np.memmap(run_path, dtype=RECORD_DTYPE, mode='r') for run_path in self.run_paths]
+        # Records read per run at a time (the budget shared between the runs)
+        block_length = max(self.get_run_length() // max(len(runs), 1), 1000)
+        # Next record to read in each run, and the records read but not yet reduced
+        positions = [0] * len(runs)
+        buffers = [np.empty(0, dtype=RECORD_DTYPE) for _ in runs]
+        # While any run has records left
+        while any(len(buffer) for buffer in buffers) or any(pos < len(run) for pos, run in zip(positions, runs)):
+            # Top up each buffer from its run
+            for run_idx, run in enumerate(runs):
+                if len(buffers[run_idx]) < block_length and positions[run_idx] < len(run):
+                    block = np.array(run[positions[run_idx]:positions[run_idx] + block_length])
+                    positions[run_idx] += len(block)
+                    buffers[run_idx] = np.concatenate((buffers[run_idx], block))
+            # Every key below the bound has been read from all runs (a run with unread records may still
+            # have more of the last key in its buffer)
+            bound = None
+            for run_idx, run in enumerate(runs):
+                if positions[run_idx] < len(run) and len(buffers[run_idx]):
+                    last_key = buffers[run_idx]['key'][-1]
+                    bound = last_key if bound is None else min(bound, last_key)
+            # Records from each buffer that can be reduced now
+            ready = []
+            for run_idx, buffer in enumerate(buffers):
+                split = len(buffer) if bound is None else np.searchsorted(buffer['key'], bound, side='left')
+                ready.append(buffer[:split])
+                buffers[run_idx] = buffer[split:]
+            ready = np.concatenate(ready)
+            # If nothing could be reduced, the bound run needs to read further
+            if len(ready) == 0:
+                for run_idx, run in enumerate(runs):
+                    if positions[run_idx] < len(run) and len(buffers[run_idx]) and \
+                            buffers[run_idx]['key'][-1] == bound:
+                        block = np.array(run[positions[run_idx]:positions[run_idx] + block_length])
+                        positions[run_idx] += len(block)
+                        buffers[run_idx] = np.concatenate((buffers[run_idx], block))
+                continue
+            # Reduce the complete voxels
+            self.reduce_records(ready[np.argsort(ready['key'], kind='stable')], timepoint_name, percentiles)
+        # Release the memory maps
+        del runs
+
+    # Reduce key-sorted records of complete voxels into Voxel objects with VoxelStats
+    def reduce_records(self, records, timepoint_name, percentiles=None):
+        # Unique voxels and their record counts
+        voxel_keys, starts, counts = np.unique(records['key'], return_index=True, return_counts=True)
+        # Voxel index of every record
+        record_voxels = np.repeat(np.arange(len(voxel_keys)), counts)
+        # Distance statistics for every voxel
+        distance_results = grouped_summary_stats(records['distance'], counts, percentiles)
+        # Reflectance statistics, only from records whose file exported it
+        has_reflectance = records['has_reflectance'].astype(bool)
+        reflectance_counts = np.bincount(record_voxels[has_reflectance], minlength=len(voxel_keys))
+        reflectance_results = grouped_summary_stats(records['reflectance'][has_reflectance],
+                                                    reflectance_counts,
+                                                    percentiles)
+        # Point counts per voxel and scan
+        scan_counts = np.zeros((len(voxel_keys), len(self.scan_names)), dtype=np.int64)
+        np.add.at(scan_counts, (record_voxels, records['scan']), 1)
+        # If reducing into a dense grid
+        if self.dense:
+            # Keep the voxels' coordinates, stat rows and scan counts (no percentiles)
+            vox_x, vox_z = decode_voxel_key(voxel_keys)
+            self.dense_blocks.append((vox_x,
+                                      vox_z,
+                                      np.column_stack([distance_results[stat] for stat in c_dense_grid.STAT_NAMES]),
+                                      np.column_stack([reflectance_results[stat]
+                                                       for stat in c_dense_grid.STAT_NAMES]),
+                                      scan_counts))
+            return
+        # Voxel coordinates
+        vox_xs, vox_zs = (coord.tolist() for coord in decode_voxel_key(voxel_keys))
+        # For each voxel
+        for voxel_idx in range(len(voxel_keys)):
+            # Add a voxel (if necessary)
+            self.grid.add_voxel(vox_xs[voxel_idx], vox_zs[voxel_idx])
+            # Reference the current voxel
+            curr_voxel = self.grid.voxels[vox_xs[voxel_idx]][vox_zs[voxel_idx]]
+            # Distance stats
+            distance_stats = c_voxels.VoxelStats()
+            distance_stats.populate_from_results(distance_results, voxel_idx, percentiles)
+            # Reflectance stats (None if no file exported it)
+            reflectance_stats = None
+            if reflectance_counts[voxel_idx]:
+                reflectance_stats = c_voxels.VoxelStats()
+                reflectance_stats.populate_from_results(reflectance_results, voxel_idx, percentiles)
+            curr_voxel.stats_by_timepoint[timepoint_name] = {'distance': distance_stats,
+                                                             'reflectance': reflectance_stats}
+            # Point counts for the scans (in file order)
+            for scan_idx, point_count in enumerate(scan_counts[voxel_idx].tolist()):
+                if point_count:
+                    curr_voxel.scans[self.scan_names[scan_idx]] = point_count
+
+    # Join the reduced arrays into a DenseVoxelGrid (dense_grid), with index [0, 0] at the grid offsets
+    def build_dense_grid(self, timepoint_name):
+        # If there were voxels
+        if self.dense_blocks:
+            # Join the blocks (one per merge step)
+            vox_x, vox_z, distance, reflectance, scan_counts = (np.concatenate(arrays)
+                                                                for arrays in zip(*self.dense_blocks))
+        # Otherwise
+        else:
+            # Empty arrays
+            vox_x = vox_z = np.empty(0, dtype=np.int64)
+            distance = reflectance = np.empty((0, len(c_dense_grid.STAT_NAMES)))
+            scan_counts = np.empty((0, len(self.scan_names)), dtype=np.int64)
+        self.dense_blocks = []
+        # Make the grid
+        self.dense_grid = c_dense_grid.DenseVoxelGrid.from_arrays(vox_x, vox_z, distance, reflectance, scan_counts,
+                                                                  self.scan_names,
+                                                                  origin=self.grid.get_voxel_origin(),
+                                                                  name=self.grid.name,
+                                                                  timepoint_name=timepoint_name,
+                                                                  voxel_size=self.grid.voxel_size)
@@ -0,0 +1,277 @@
+from pathlib import Path
+import sqlite3
+import logging
+import math
+
+# Statistic column names (VoxelStats.flatten order) for distance and reflectance
+STAT_NAMES = ['min', 'max', 'mean', 'median', 'stdev']
+DISTANCE_COLUMNS = [f'distance_{stat}' for stat in STAT_NAMES]
+REFLECTANCE_COLUMNS = [f'reflectance_{stat}' for stat in STAT_NAMES]
+# Scan name used for results that combine every scan position
+COMBINED_SCANS = ''
+# Columns of pair results inserted per transaction (bounds the rows held in memory and how long the write lock is
+# held while a pair is being derived)
+PAIR_BATCH_COLUMNS = 100
+
+# Voxel tables have a vox_y column for results with a Y axis (c_sparse_grid.SparseVoxelGrid), NULL otherwise. Their
+# rows are replaced a whole slice, timepoint and scan at a time, so they are indexed rather than keyed
+SCHEMA = f'''
+CREATE TABLE IF NOT EXISTS voxel_stats (
+    slice TEXT NOT NULL,
+    timepoint TEXT NOT NULL,
+    scan TEXT NOT NULL,
+    vox_x INTEGER NOT NULL,
+    vox_z INTEGER NOT NULL,
+    vox_y INTEGER,
+    {', '.join(f'{column} REAL' for column in DISTANCE_COLUMNS + REFLECTANCE_COLUMNS)}
+);
+CREATE INDEX IF NOT EXISTS voxel_stats_idx ON voxel_stats (slice, timepoint, scan, vox_x, vox_z, vox_y);
+CREATE TABLE IF NOT EXISTS voxel_scans (
+    slice TEXT NOT NULL,
+    timepoint TEXT NOT NULL,
+    scan TEXT NOT NULL,
+    vox_x INTEGER NOT NULL,
+    vox_z INTEGER NOT NULL,
+    vox_y INTEGER,
+    scan_position TEXT NOT NULL,
+    point_count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS voxel_scans_idx ON voxel_scans (slice, timepoint, scan, vox_x, vox_z, vox_y);
+CREATE TABLE IF NOT EXISTS events (
+    slice TEXT NOT NULL,
+    first_tp TEXT NOT NULL,
+    second_tp TEXT NOT NULL,
+    col INTEGER NOT NULL,
+    event_number INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    voxel_count INTEGER NOT NULL,
+    min_row INTEGER NOT NULL,
+    max_row INTEGER NOT NULL,
+    net_change REAL NOT NULL,
+    PRIMARY KEY (slice, first_tp, second_tp, col, event_number)
+);
+CREATE TABLE IF NOT EXISTS event_voxels (
+    slice TEXT NOT NULL,
+    first_tp TEXT NOT NULL,
+    second_tp TEXT NOT NULL,
+    col INTEGER NOT NULL,
+    row INTEGER NOT NULL,
+    event_number INTEGER NOT NULL,
+    change REAL,
+    missing_timepoints TEXT,
+    PRIMARY KEY (slice, first_tp, second_tp, col, row)
+);
+CREATE TABLE IF NOT EXISTS missing_data (
+    slice TEXT NOT NULL,
+    first_tp TEXT NOT NULL,
+    second_tp TEXT NOT NULL,
+    col INTEGER NOT NULL,
+    row INTEGER,
+    event_number INTEGER,
+    missing_timepoints TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS missing_data_idx ON missing_data (slice, first_tp, second_tp, col, row);
+CREATE INDEX IF NOT EXISTS events_type_idx ON events (first_tp, second_tp, type, slice);
+'''
+
+
+# Single SQLite database holding a project's voxel statistics, derived events and missing data (whole columns in
+# missing_data, single voxels in event_voxels with a NULL change and the timepoints missing them)
+class ProjectStore:
+
+    def __init__(self, db_path):
+
+        # Path to the database file
+        self.db_path = Path(db_path)
+        # Make sure its directory exists
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # Open the connection (waiting on other writers rather than failing)
+        self.connection = sqlite3.connect(self.db_path, timeout=60)
+        # Write-ahead logging lets readers work while a writer is busy
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        # Make sure the tables exist
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    # Bulk insert (replace) the voxel statistics of a SliceTimepointColumns object
+    def insert_voxel_stats(self, columns, scan_name=COMBINED_SCANS):
+        # Convert the arrays to lists once
+        vox_xs = columns.vox_x.tolist()
+        vox_zs = columns.vox_z.tolist()
+        vox_ys = columns.vox_y.tolist() if columns.vox_y is not None else [None] * len(vox_xs)
+        distance = columns.distance.tolist()
+        reflectance = columns.reflectance.tolist()
+        has_reflectance = columns.has_reflectance.tolist()
+        scan_counts = columns.scan_counts.tolist()
+        # Rows for the tables
+        stat_rows = []
+        scan_rows = []
+        for voxel_idx, (vox_x, vox_z, vox_y) in enumerate(zip(vox_xs, vox_zs, vox_ys)):
+            # Reflectance is NULL where it was not exported
+            voxel_reflectance = reflectance[voxel_idx] if has_reflectance[voxel_idx] else [None] * len(STAT_NAMES)
+            stat_rows.append((columns.slice_name, columns.timepoint_name, scan_name, vox_x, vox_z, vox_y,
+                              *distance[voxel_idx], *voxel_reflectance))
+            for scan_position, point_count in zip(columns.scan_names, scan_counts[voxel_idx]):
+                if point_count:
+                    scan_rows.append((columns.slice_name, columns.timepoint_name, scan_name, vox_x, vox_z, vox_y,
+                                      scan_position, point_count))
+        # Insert in one transaction
+        with self.connection:
+            self.connection.execute('DELETE FROM voxel_stats WHERE slice = ? AND timepoint = ? AND scan = ?',
+                                    (columns.slice_name, columns.timepoint_name, scan_name))
+            self.connection.execute('DELETE FROM voxel_scans WHERE slice = ? AND timepoint = ? AND scan = ?',
+                                    (columns.slice_name, columns.timepoint_name, scan_name))
+            self.connection.executemany(f'INSERT INTO voxel_stats VALUES ({", ".join(["?"] * 16)})', stat_rows)
+            self.connection.executemany('INSERT INTO voxel_scans VALUES (?, ?, ?, ?, ?, ?, ?, ?)', scan_rows)
+        # Log info
+        logging.info(f'Stored {len(stat_rows)} voxels for {columns.slice_name}_{columns.timepoint_name}.')
+
+    # Bulk insert (replace) the results of Grid.derive_events_from_timepoints for a slice and timepoint pair.
+    # pair_results: dictionary of col: results, or an iterable of (col, results) pairs (e.g. as they are streamed
+    # to a file), inserted PAIR_BATCH_COLUMNS columns per transaction so the whole pair is never held in memory
+    def insert_pair_results(self, slice_name, first_tp, second_tp, pair_results):
+        # Columns as (col, results) pairs
+        pair_columns = pair_results.items() if isinstance(pair_results, dict) else pair_results
+        # Remove the old results
+        self.delete_pair_results(slice_name, first_tp, second_tp)
+        # Rows for the tables (one batch of columns at a time)
+        rows = {'events': [], 'event_voxels': [], 'missing_data': []}
+        event_count = 0
+        # For each column
+        for col_idx, (col, col_results) in enumerate(pair_columns):
+            # Add its rows
+            self.add_pair_column_rows(rows, slice_name, first_tp, second_tp, int(col), col_results)
+            # If the batch is full
+            if (col_idx + 1) % PAIR_BATCH_COLUMNS == 0:
+                event_count += self.flush_pair_rows(rows)
+        # Insert the last batch
+        event_count += self.flush_pair_rows(rows)
+        # Log info
+        logging.info(f'Stored {event_count} events for {slice_name}_{first_tp}_{second_tp}.')
+
+    # Delete the events and missing data stored for a slice and timepoint pair (in one transaction)
+    def delete_pair_results(self, slice_name, first_tp, second_tp):
+        with self.connection:
+            for table in ['events', 'event_voxels', 'missing_data']:
+                self.connection.execute(f'DELETE FROM {table} WHERE slice = ? AND first_tp = ? AND second_tp = ?',
+                                        (slice_name, first_tp, second_tp))
+
+    # Add the table rows for one column of pair results to the lists in rows
+    @staticmethod
+    def add_pair_column_rows(rows, slice_name, first_tp, second_tp, col, col_results):
+        # If the whole column is missing (a list of the timepoints without it)
+        if isinstance(col_results, list):
+            rows['missing_data'].append((slice_name, first_tp, second_tp, col, None, None, ','.join(col_results)))
+            return
+        # For each event in the column
+        for event_number, event_voxels in col_results.items():
+            # Get the first voxel's value
+            first_value = next(iter(event_voxels.values()))
+            # If there is a list in the event (i.e. there were missing data)
+            if isinstance(first_value, list):
+                for row, missing_timepoints in event_voxels.items():
+                    rows['event_voxels'].append((slice_name, first_tp, second_tp, col, int(row), int(event_number),
+                                                 None, ','.join(missing_timepoints)))
+                continue
+            # Type of the event (from its first voxel, as Grid.load_events)
+            if first_value > 0:
+                event_type = 'Gain'
+            elif first_value < 0:
+                event_type = 'Loss'
+            else:
+                event_type = 'No Change'
+            # Changes, with NaN (no change when the events were segmented) stored as NULL
+            changes = [None if math.isnan(change) else change for change in event_voxels.values()]
+            event_rows = [int(row) for row in event_voxels.keys()]
+            rows['events'].append((slice_name, first_tp, second_tp, col, int(event_number), event_type,
+                                   len(event_rows), min(event_rows), max(event_rows),
+                                   sum(change for change in changes if change is not None)))
+            for row, change in zip(event_rows, changes):
+                rows['event_voxels'].append((slice_name, first_tp, second_tp, col, row, int(event_number), change,
+                                             None))
+
+    # Insert the rows collected by add_pair_column_rows in one transaction and clear them. Returns the event count
+    def flush_pair_rows(self, rows):
+        with self.connection:
+            self.connection.executemany('INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows['events'])
+            self.connection.executemany('INSERT INTO event_voxels VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                        rows['event_voxels'])
+            self.connection.executemany('INSERT INTO missing_data VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                        rows['missing_data'])
+        event_count = len(rows['events'])
+        for table_rows in rows.values():
+            table_rows.clear()
+        return event_count
+
+    # Check whether results for a slice and timepoint pair are stored
+    def has_pair_results(self, slice_name, first_tp, second_tp):
+        for table in ['event_voxels', 'missing_data']:
+            cursor = self.connection.execute(f'SELECT 1 FROM {table} WHERE slice = ? AND first_tp = ? '
+                                             f'AND second_tp = ? LIMIT 1', (slice_name, first_tp, second_tp))
+            if cursor.fetchone():
+                return True
+        return False
+
+    # Build a WHERE clause from optional filters. Values that are lists or tuples match any of their entries
+    @staticmethod
+    def build_where(filters):
+        clauses = []
+        params = []
+        for column, value in filters.items():
+            # No filter
+            if value is None:
+                continue
+            # Any of several values
+            if isinstance(value, (list, tuple, set)):
+                clauses.append(f'{column} IN ({", ".join(["?"] * len(value))})')
+                params.extend(value)
+            # A single value
+            else:
+                clauses.append(f'{column} = ?')
+                params.append(value)
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    # Run a query and return the rows as dictionaries
+    def query(self, sql, params=()):
+        cursor = self.connection.execute(sql, params)
+        names = [description[0] for description in cursor.description]
+        return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    # Events, e.g. get_events(slices=['03', ..., '12'], first_tp='TP1', second_tp='TP4', event_type='Loss')
+    def get_events(self, slices=None, first_tp=None, second_tp=None, event_type=None, col=None):
+        where, params = self.build_where({'slice': slices, 'first_tp': first_tp, 'second_tp': second_tp,
+                                          'type': event_type, 'col': col})
+        return self.query(f'SELECT * FROM events{where} ORDER BY slice, first_tp, second_tp, col, event_number',
+                          params)
+
+    # Voxels of events (with the event type), filtered like get_events and optionally by row range
+    def get_event_voxels(self, slices=None, first_tp=None, second_tp=None, event_type=None, col=None,
+                         min_row=None, max_row=None):
+        where, params = self.build_where({'v.slice': slices, 'v.first_tp': first_tp, 'v.second_tp': second_tp,
+                                          'e.type': event_type, 'v.col': col})
+        # Row range
+        for clause, value in [('v.row >= ?', min_row), ('v.row <= ?', max_row)]:
+            if value is not None:
+                where += (' AND ' if where else ' WHERE ') + clause
+                params.append(value)
+        return self.query('SELECT v.*, e.type FROM event_voxels v JOIN events e ON v.slice = e.slice '
+                          'AND v.first_tp = e.first_tp AND v.second_tp = e.second_tp AND v.col = e.col '
+                          f'AND v.event_number = e.event_number{where} '
+                          'ORDER BY v.slice, v.first_tp, v.second_tp, v.col, v.row', params)
+
+    # Missing-data records: whole columns (row and event_number are None) and missing voxels
+    def get_missing_data(self, slices=None, first_tp=None, second_tp=None, col=None):
+        where, params = self.build_where({'slice': slices, 'first_tp': first_tp, 'second_tp': second_tp, 'col': col})
+        voxel_where = where + (' AND ' if where else ' WHERE ') + 'missing_timepoints IS NOT NULL'
+        return self.query(f'SELECT * FROM missing_data{where} UNION ALL '
+                          'SELECT slice, first_tp, second_tp, col, row, event_number, missing_timepoints '
+                          f'FROM event_voxels{voxel_where} ORDER BY slice, first_tp, second_tp, col, row',
+                          params + params)
+
+    # Voxel statistics for slices and timepoints (combined scans unless a scan is given)
+    def get_voxel_stats(self, slices=None, timepoints=None, scan_name=COMBINED_SCANS):
+        where, params = self.build_where({'slice': slices, 'timepoint': timepoints, 'scan': scan_name})
+        return self.query(f'SELECT * FROM voxel_stats{where} ORDER BY slice, timepoint, vox_x, vox_z, vox_y',
+                          params)
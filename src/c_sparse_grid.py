@@ -0,0 +1,207 @@
+import numpy as np
+import c_voxels
+
+# Bits per axis in a Morton key (3 x 21 bits fit in a positive int64)
+MORTON_BITS = 21
+# Bias added to signed voxel coordinates (relative to the origin) so they are non-negative (coordinates must be
+# within +/- 2^20 voxels of the origin)
+MORTON_BIAS = 1 << (MORTON_BITS - 1)
+
+# Offsets to the 6 face neighbours and all 26 neighbours of a voxel
+FACE_OFFSETS = [(-1, 0, 0), (1, 0, 0), (0, -1, 0), (0, 1, 0), (0, 0, -1), (0, 0, 1)]
+ALL_OFFSETS = [(dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1) if (dx, dy, dz) != (0, 0, 0)]
+
+
+# Spread the lower 21 bits of each value so there are two zero bits between each bit
+def _spread_bits(values):
+    values = values.astype(np.uint64) & np.uint64(0x1fffff)
+    values = (values | values << np.uint64(32)) & np.uint64(0x1f00000000ffff)
+    values = (values | values << np.uint64(16)) & np.uint64(0x1f0000ff0000ff)
+    values = (values | values << np.uint64(8)) & np.uint64(0x100f00f00f00f00f)
+    values = (values | values << np.uint64(4)) & np.uint64(0x10c30c30c30c30c3)
+    values = (values | values << np.uint64(2)) & np.uint64(0x1249249249249249)
+    return values
+
+
+# Inverse of _spread_bits
+def _compact_bits(values):
+    values = values.astype(np.uint64) & np.uint64(0x1249249249249249)
+    values = (values ^ (values >> np.uint64(2))) & np.uint64(0x10c30c30c30c30c3)
+    values = (values ^ (values >> np.uint64(4))) & np.uint64(0x100f00f00f00f00f)
+    values = (values ^ (values >> np.uint64(8))) & np.uint64(0x1f0000ff0000ff)
+    values = (values ^ (values >> np.uint64(16))) & np.uint64(0x1f00000000ffff)
+    values = (values ^ (values >> np.uint64(32))) & np.uint64(0x1fffff)
+    return values
+
+
+# Biased coordinates (relative to the origin) of voxel X, Y and Z, and whether each voxel fits in a Morton key
+def _bias_coords(vox_x, vox_y, vox_z, origin):
+    biased = [np.asarray(coord, dtype=np.int64) - origin_coord + MORTON_BIAS
+              for coord, origin_coord in zip((vox_x, vox_y, vox_z), origin)]
+    in_range = np.logical_and.reduce([(coord >= 0) & (coord < 1 << MORTON_BITS) for coord in biased])
+    return biased, in_range
+
+
+# Check which voxels (X, Y and Z integer arrays or scalars) can be encoded relative to an origin
+def morton_in_range(vox_x, vox_y, vox_z, origin=(0, 0, 0)):
+    return _bias_coords(vox_x, vox_y, vox_z, origin)[1]
+
+
+# Encode voxel X, Y and Z (integer arrays or scalars) as int64 Morton (Z-order) keys, relative to an origin voxel
+# (X, Y, Z). Raises ValueError if a voxel is not within +/- 2^20 voxels of the origin (its key would collide)
+def morton_encode(vox_x, vox_y, vox_z, origin=(0, 0, 0)):
+    # Bias the coordinates to be non-negative
+    biased, in_range = _bias_coords(vox_x, vox_y, vox_z, origin)
+    # If any voxel does not fit
+    if not np.all(in_range):
+        raise ValueError(f'Voxel coordinates must be within +/- {MORTON_BIAS} voxels of the origin {tuple(origin)} '
+                         f'to be Morton encoded.')
+    # Interleave the bits (X lowest)
+    keys = _spread_bits(biased[0]) | (_spread_bits(biased[1]) << np.uint64(1)) | (_spread_bits(biased[2]) << np.uint64(2))
+    return keys.astype(np.int64)
+
+
+# Decode int64 Morton keys (encoded relative to an origin voxel) back into voxel X, Y and Z
+def morton_decode(keys, origin=(0, 0, 0)):
+    keys = np.asarray(keys, dtype=np.int64).astype(np.uint64)
+    return tuple(_compact_bits(keys >> np.uint64(shift)).astype(np.int64) - MORTON_BIAS + origin_coord
+                 for shift, origin_coord in zip((0, 1, 2), origin))
+
+
+# Grid that keeps the Y axis, storing occupied voxels in a dictionary keyed by Morton code (Morton key: Voxel).
+# Keys are relative to the voxel of the grid offsets, so the grid covers +/- 2^20 voxels around them
+class SparseVoxelGrid(c_voxels.Grid):
+
+    # Coordinates that locate a voxel (the partial aggregate arrays are named after them)
+    coord_names = ['vox_x', 'vox_y', 'vox_z']
+
+    # Voxel (X, Y, Z) of the grid offsets (0 for an offset the specification does not have)
+    def get_morton_origin(self):
+        return tuple(0 if offset is None else int(np.floor(offset / self.voxel_size))
+                     for offset in (self.x_offset, self.y_offset, self.z_offset))
+
+    # Morton keys of voxel X, Y and Z in this grid (ValueError outside its range)
+    def encode_keys(self, vox_x, vox_y, vox_z):
+        return morton_encode(vox_x, vox_y, vox_z, self.get_morton_origin())
+
+    # Voxel X, Y and Z of Morton keys in this grid
+    def decode_keys(self, keys):
+        return morton_decode(keys, self.get_morton_origin())
+
+    # Bin a chunk of points into the 3D voxels for a timepoint and scan
+    def add_point_chunk(self, timepoint_name, scan_name, coords, reflectance=None):
+        # If the chunk is empty
+        if len(coords) == 0:
+            # Nothing to do
+            return
+        # Get the voxel coordinates for every point at once
+        vox_coords = self.get_voxel_coords_array(coords)
+        # Morton key of every point
+        point_keys = self.encode_keys(vox_coords[:, 0], vox_coords[:, 1], vox_coords[:, 2])
+        # Unique keys and the voxel index of each point
+        voxel_keys, point_voxels = np.unique(point_keys, return_inverse=True)
+        point_voxels = point_voxels.reshape(-1)
+        # Order the points by voxel (stable, so values keep their file order)
+        order = np.argsort(point_voxels, kind='stable')
+        # Start and end of each voxel's points in the ordered arrays
+        bounds = np.concatenate(([0], np.cumsum(np.bincount(point_voxels, minlength=len(voxel_keys))))).tolist()
+        # Distance and reflectance values grouped by voxel
+        distances = coords[order, 1]
+        if reflectance is not None:
+            reflectance = reflectance[order]
+        # Coordinates of the unique voxels
+        vox_xs, vox_ys, vox_zs = (coord.tolist() for coord in self.decode_keys(voxel_keys))
+        # For each voxel in the chunk
+        for voxel_idx, voxel_key in enumerate(voxel_keys.tolist()):
+            # If the voxel does not exist
+            if voxel_key not in self.voxels:
+                # Add a Voxel object
+                self.voxels[voxel_key] = c_voxels.Voxel(x=vox_xs[voxel_idx], y=vox_ys[voxel_idx], z=vox_zs[voxel_idx])
+            # Reference the current voxel
+            curr_voxel = self.voxels[voxel_key]
+            # Add timepoint to the voxel
+            curr_voxel.add_timepoint_stats(self.timepoints[timepoint_name])
+            # Reference the voxel's stat generators for the timepoint
+            curr_stats = curr_voxel.stats_by_timepoint[timepoint_name]
+            # Slice of the ordered arrays for this voxel
+            start, end = bounds[voxel_idx], bounds[voxel_idx + 1]
+            # Add the distance values
+            curr_stats['distance'].add_values(distances[start:end])
+            # If the reflectance properties were exported from Cloud Compare
+            if reflectance is not None:
+                # Add the reflectance values
+                curr_stats['reflectance'].add_values(reflectance[start:end])
+            # Add to the point count for the scan
+            curr_voxel.scans[scan_name] = curr_voxel.scans.get(scan_name, 0) + end - start
+
+    # Add a voxel to the grid (returns its Morton key). Y comes after X and Z, as Grid.add_voxel has X and Z only
+    def add_voxel(self, vox_x, vox_z, vox_y):
+        # Morton key of the voxel
+        voxel_key = int(self.encode_keys(vox_x, vox_y, vox_z))
+        # If the voxel does not exist
+        if voxel_key not in self.voxels:
+            # Add a Voxel object
+            self.voxels[voxel_key] = c_voxels.Voxel(x=vox_x, y=vox_y, z=vox_z)
+        return voxel_key
+
+    # Get the Voxel object at voxel X, Y and Z (None if it is not occupied)
+    def get_voxel(self, vox_x, vox_y, vox_z):
+        # If the voxel is outside the grid's range
+        if not morton_in_range(vox_x, vox_y, vox_z, self.get_morton_origin()):
+            return None
+        return self.voxels.get(int(self.encode_keys(vox_x, vox_y, vox_z)))
+
+    # Get the Morton keys of the occupied neighbours of a voxel (6 face neighbours, or all 26)
+    def get_neighbour_keys(self, voxel_key, all_neighbours=False):
+        # Coordinates of the voxel
+        vox_x, vox_y, vox_z = (int(coord) for coord in self.decode_keys(voxel_key))
+        # Offsets to check
+        offsets = np.array(ALL_OFFSETS if all_neighbours else FACE_OFFSETS, dtype=np.int64)
+        # Coordinates of the neighbours (within the grid's range)
+        neighbour_coords = [vox_x + offsets[:, 0], vox_y + offsets[:, 1], vox_z + offsets[:, 2]]
+        in_range = morton_in_range(*neighbour_coords, self.get_morton_origin())
+        # Keys of the neighbours
+        neighbour_keys = self.encode_keys(*(coords[in_range] for coords in neighbour_coords))
+        # Return the occupied ones
+        return [key for key in neighbour_keys.tolist() if key in self.voxels]
+
+    # Morton keys of the occupied voxels in sorted (Z-order) order
+    def get_sorted_keys(self):
+        return np.sort(np.fromiter(self.voxels.keys(), dtype=np.int64, count=len(self.voxels)))
+
+    # Yield every Voxel object in the grid (in Z-order)
+    def iter_voxels(self):
+        for voxel_key in self.get_sorted_keys().tolist():
+            yield self.voxels[voxel_key]
+
+    # Yield the coordinates (X, Y, Z) and Voxel object of every voxel in the grid (in Z-order)
+    def iter_located_voxels(self):
+        for curr_voxel in self.iter_voxels():
+            yield (curr_voxel.x, curr_voxel.y, curr_voxel.z), curr_voxel
+
+    # Merge voxels from another sparse grid into this grid (keys are recomputed, in case the grids' origins differ)
+    def merge_voxels(self, other_voxels):
+        for other_voxel in other_voxels.values():
+            self.merge_voxel((other_voxel.x, other_voxel.y, other_voxel.z), other_voxel)
+
+    # Merge another Voxel object into this grid's voxel at X, Y and Z
+    def merge_voxel(self, coords, other_voxel):
+        # Add the voxel (if it is not in this grid)
+        voxel_key = self.add_voxel(coords[0], coords[2], coords[1])
+        # Merge the other voxel into this grid's voxel
+        self.voxels[voxel_key].merge(other_voxel)
+
+    # Make an (empty) Voxel object at X, Y and Z
+    def make_voxel(self, coords):
+        return c_voxels.Voxel(x=coords[0], y=coords[1], z=coords[2])
+
+    # Yield the flattened voxel results for export one top-level entry at a time (X: {Z: {Y: flattened voxel}}), the
+    # layout c_columnar.SliceTimepointColumns reads with a Y axis (so Grid.get_slice_timepoint_columns and the
+    # project store work unchanged)
+    def iter_export_voxels(self):
+        # Nest the voxels by X, Z and Y
+        export_voxels = {}
+        for curr_voxel in self.iter_voxels():
+            export_voxels.setdefault(curr_voxel.x, {}).setdefault(curr_voxel.z, {})[curr_voxel.y] = curr_voxel.flatten()
+        # Yield the columns
+        yield from export_voxels.items()
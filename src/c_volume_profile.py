@@ -0,0 +1,131 @@
+from pathlib import Path
+import json
+import numpy as np
+import c_columnar
+import c_event_table
+from h_event_aggregation import aggregate_events
+
+# Arrays saved for a volume profile
+PROFILE_ARRAYS = ['volume_sums', 'voxel_sums']
+# Event type codes in the order of the profile's first axis
+PROFILE_TYPES = [c_event_table.LOSS, c_event_table.NO_CHANGE, c_event_table.GAIN]
+
+
+# Height profile of event volume at the native voxel resolution, for each event type, timepoint pair and slice.
+# volume_sums, voxel_sums: prefix sums over the rows of the absolute event volume and the event voxel count,
+# shape (types, pairs, slices, rows + 1), so the total over rows [low, high) is sums[..., high] - sums[..., low].
+# Any bin size, height window or slice subset is then answered without going back to the events
+class VolumeProfile:
+
+    def __init__(self, slice_names=None, pairs=None, first_row=0, voxel_size=None):
+
+        # Slices and timepoint pairs (in the order of the profile's axes)
+        self.slice_names = slice_names or []
+        self.pairs = pairs or []
+        # Row of the first profile entry
+        self.first_row = first_row
+        # Voxel size the volumes were computed with
+        self.voxel_size = voxel_size
+        # Keys of the pair results the profile was built from ({slice_first_second: c_columnar.get_source_key})
+        self.source_keys = {}
+        # Prefix sums
+        self.volume_sums = np.zeros((len(PROFILE_TYPES), len(self.pairs), len(self.slice_names), 1))
+        self.voxel_sums = np.zeros((len(PROFILE_TYPES), len(self.pairs), len(self.slice_names), 1), dtype=np.int64)
+
+    # Build the profile from the events loaded in a c_event_table.EventTable
+    @classmethod
+    def from_event_table(cls, table):
+        # Volume and voxel count of every row of every slice and pair, by event type
+        groups, results = aggregate_events(table,
+                                           group_by=['type', 'pair', 'slice', 'row'],
+                                           aggregations={'volume': ('sum', 'abs_volume'),
+                                                         'voxels': ('count',)},
+                                           level='voxel')
+        # Make the object
+        first_row = int(groups['row'].min()) if len(groups['row']) else 0
+        row_count = int(groups['row'].max()) - first_row + 1 if len(groups['row']) else 0
+        profile = cls(slice_names=list(table.slice_names),
+                      pairs=[tuple(pair) for pair in table.pairs],
+                      first_row=first_row,
+                      voxel_size=table.voxel_size)
+        # Per-row totals (type codes -1, 0, 1 are the indices 0, 1, 2)
+        shape = (len(PROFILE_TYPES), len(profile.pairs), len(profile.slice_names), row_count)
+        volumes = np.zeros(shape)
+        voxels = np.zeros(shape, dtype=np.int64)
+        index = (groups['type'] + 1, groups['pair'], groups['slice'], groups['row'] - first_row)
+        volumes[index] = results['volume']
+        voxels[index] = results['voxels']
+        # Prefix sums (with a leading zero)
+        profile.volume_sums = np.concatenate((np.zeros(shape[:3] + (1,)), np.cumsum(volumes, axis=3)), axis=3)
+        profile.voxel_sums = np.concatenate((np.zeros(shape[:3] + (1,), dtype=np.int64), np.cumsum(voxels, axis=3)),
+                                            axis=3)
+        return profile
+
+    # Check whether the profile covers slices and timepoint pairs
+    def covers(self, slice_names, pairs):
+        return set(slice_names) <= set(self.slice_names) and set(pairs) <= set(self.pairs)
+
+    # Prefix sums of a pair, combined over event types and slices (None for all of them)
+    def get_pair_sums(self, first_tp, second_tp, slice_names=None, event_types=None):
+        pair_idx = self.pairs.index((first_tp, second_tp))
+        type_idxs = [PROFILE_TYPES.index(event_type) for event_type in event_types] if event_types is not None \
+            else list(range(len(PROFILE_TYPES)))
+        slice_idxs = [self.slice_names.index(slice_name) for slice_name in slice_names] if slice_names is not None \
+            else list(range(len(self.slice_names)))
+        volume_sums = self.volume_sums[type_idxs, pair_idx][:, slice_idxs].sum(axis=(0, 1))
+        voxel_sums = self.voxel_sums[type_idxs, pair_idx][:, slice_idxs].sum(axis=(0, 1))
+        return volume_sums, voxel_sums
+
+    # Prefix sum positions of rows (clipped to the profile)
+    def get_positions(self, rows):
+        return np.clip(np.asarray(rows) - self.first_row, 0, self.volume_sums.shape[3] - 1)
+
+    # Absolute event volume of a pair between two rows (low included, high not)
+    def get_window_volume(self, low_row, high_row, first_tp, second_tp, slice_names=None, event_types=None):
+        volume_sums, voxel_sums = self.get_pair_sums(first_tp, second_tp, slice_names, event_types)
+        return float(volume_sums[self.get_positions(high_row)] - volume_sums[self.get_positions(low_row)])
+
+    # Absolute event volume and voxel count of a pair in height bins of bin_rows rows, for the bins with event
+    # voxels. Bin keys are floor(row / bin_rows)
+    def get_binned_volumes(self, bin_rows, first_tp, second_tp, slice_names=None, event_types=None):
+        volume_sums, voxel_sums = self.get_pair_sums(first_tp, second_tp, slice_names, event_types)
+        last_row = self.first_row + self.volume_sums.shape[3] - 2
+        # Bins covering the profile and their row edges
+        bin_keys = np.arange(self.first_row // bin_rows, last_row // bin_rows + 1)
+        low_positions = self.get_positions(bin_keys * bin_rows)
+        high_positions = self.get_positions((bin_keys + 1) * bin_rows)
+        # Totals in each bin
+        bin_volumes = volume_sums[high_positions] - volume_sums[low_positions]
+        bin_voxels = voxel_sums[high_positions] - voxel_sums[low_positions]
+        # Keep the bins with event voxels
+        occupied = bin_voxels > 0
+        return bin_keys[occupied], bin_volumes[occupied], bin_voxels[occupied]
+
+    # Save the profile to a directory
+    def save(self, dir_path):
+        header = {'Format Version': c_columnar.FORMAT_VERSION,
+                  'Slice Names': self.slice_names,
+                  'Pairs': self.pairs,
+                  'First Row': self.first_row,
+                  'Voxel Size': self.voxel_size,
+                  'Source Keys': self.source_keys}
+        c_columnar.save_arrays(dir_path, self, PROFILE_ARRAYS, header)
+
+    # Load a profile saved with save
+    @classmethod
+    def load(cls, dir_path, mmap_mode='r'):
+        # Load the header
+        with open(Path(dir_path, 'header.json'), 'r') as f:
+            header = json.load(f)
+        # Make the object
+        profile = cls(slice_names=header['Slice Names'],
+                      pairs=[tuple(pair) for pair in header['Pairs']],
+                      first_row=header['First Row'],
+                      voxel_size=header['Voxel Size'])
+        profile.source_keys = {pair_name: tuple(source_key)
+                               for pair_name, source_key in header.get('Source Keys', {}).items()}
+        # Map each array
+        for array_name in PROFILE_ARRAYS:
+            setattr(profile, array_name, np.load(Path(dir_path, f'{array_name}.npy'), mmap_mode=mmap_mode))
+        # Return the object
+        return profile
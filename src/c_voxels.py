@@ -1,19 +1,36 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import deque
 import json
 from datetime import date
+from itertools import chain, islice
 from os.path import exists
-from os import environ, walk, mkdir
+from os import environ, walk, mkdir, makedirs, replace, stat
 from dotenv import load_dotenv
 from pathlib import Path
 from numpy import floor
 import numpy as np
 import logging
+import time
 from matplotlib import pyplot as plt
 import matplotlib as mpl
+from h_grouped_stats import grouped_summary_stats
+import c_change_raster
+import c_columnar
+import c_dense_grid
+import c_event_table
+import c_project_store
+import c_volume_profile
+from h_file_lock import file_lock
+from h_json_stream import JsonStreamWriter
+from h_event_segmentation import get_event_numbers
 
 
 class Grid:
 
-    def __init__(self, spec_path=None, input_path=None):
+    # Coordinates that locate a voxel (the partial aggregate arrays are named after them)
+    coord_names = ['vox_x', 'vox_z']
+
+    def __init__(self, spec_path=None, input_path=None, stats_mode='exact', median_error=0.001, max_buckets=4096):
 
         # Name of the grid (project)
         self.name = None
@@ -33,8 +50,21 @@ class Grid:
         self.timepoints = {}
         # Dictionary of voxels. Nested keys [X][Z]
         self.voxels = {}
-        # Dictionary of events
-        self.events = {}
+        # Table of loaded events (c_event_table.EventTable, filled by load_events)
+        self.events = c_event_table.EventTable()
+        # How voxel values are accumulated: 'exact' keeps every value, 'streaming' keeps running moments
+        # and a quantile sketch so memory grows with the voxel count rather than the point count
+        self.stats_mode = stats_mode
+        # Error bound on the streaming median (same units as the values): a number for every set of stats, or a
+        # dictionary of set of stats: error bound (e.g. {'distance': 0.001, 'reflectance': 0.05})
+        self.median_error = median_error
+        # Maximum number of buckets in each streaming median sketch (memory per voxel). A sketch that needs more
+        # widens its error bound instead
+        self.max_buckets = max_buckets
+        # Project store (c_project_store.ProjectStore) that exports are also inserted into, if set
+        self.store = None
+        # Number of pairs kept when derived on demand (materialize_pairs); the least recently used are deleted past it
+        self.pair_cache_size = 500
 
         # If a path to a grid specification file was provided
         if self.spec_path:
@@ -115,7 +145,7 @@ class Grid:
                     continue
 
     # Process a point cloud file to get Voxel-level statistics for distance and reflectance
-    def process_point_cloud(self, file_path, summary_stats=True, export_file=True):
+    def process_point_cloud(self, file_path, summary_stats=True, export_file=True, use_cache=True, workers=1):
         # If the file path is not a Path object
         if not isinstance(file_path, Path):
             # Try and convert it
@@ -141,50 +171,172 @@ class Grid:
         # Add a scan to the Timepoint object
         self.timepoints[timepoint_name].add_scan(scan_name)
 
-        # Iterate over the rows in the file
-        for row in self.yield_ascii_rows(file_path):
-            values = row.strip().split(',')
-            x_co = float(values[0])
-            y_co = float(values[1])
-            z_co = float(values[2])
-            # Get the voxel coordinates
-            vox_x, _, vox_z = self.get_voxel_coords(x_co, y_co, z_co)
-            # Add a voxel (if necessary)
-            self.add_voxel(vox_x, vox_z)
-            # Reference the current voxel
-            curr_voxel = self.voxels[vox_x][vox_z]
-            # Add timepoint to the voxel
-            curr_voxel.add_timepoint_stats(self.timepoints[timepoint_name])
-            # Add the distance and reflectance values to the relevant stat generators
-            curr_voxel.stats_by_timepoint[timepoint_name]['distance'].values.append(float(values[1]))
-            # Check whether the reflectance properties were exported from Cloud Compare (by counting cols)
-            if len(values) == 10:
-                # If so, add the reflectance value
-                curr_voxel.stats_by_timepoint[timepoint_name]['reflectance'].values.append(float(values[4]))
-            # Check if the scan was already noted as contributing to the voxel
-            if scan_name not in curr_voxel.scans:
-                # Add it
-                curr_voxel.scans[scan_name] = 0
-            # Add to the point count for the scan
-            curr_voxel.scans[scan_name] += 1
+        # If using the binary cache and it is up to date
+        if use_cache and self.point_cloud_cache_is_current(file_path):
+            # Read the chunks from the memory-mapped cache
+            chunks = self.yield_cached_point_chunks(file_path)
+        # Otherwise, if parsing the ASCII file with several workers
+        elif workers > 1:
+            # Parse byte ranges of the file in parallel and merge the partial voxels
+            self.process_point_cloud_ranges(file_path, timepoint_name, scan_name, workers)
+            # Nothing left to parse here
+            chunks = []
+        # Otherwise
+        else:
+            # Parse the chunks from the ASCII file
+            chunks = self.yield_point_chunks(file_path)
+        # Iterate over the chunks of the file
+        for coords, reflectance in chunks:
+            # Bin the chunk into the voxels
+            self.add_point_chunk(timepoint_name, scan_name, coords, reflectance)
 
         # If generating summary stats
         if summary_stats:
-            # Iterate over the voxels
-            # For each voxel X
-            for vox_x in self.voxels.keys():
-                # For each voxel Z
-                for vox_z in self.voxels[vox_x].keys():
-                    # Reference the voxel object
-                    curr_voxel = self.voxels[vox_x][vox_z]
-                    # Generate summary stats
-                    curr_voxel.generate_summary_stats()
+            # Generate summary stats for all voxels
+            self.generate_summary_stats()
 
         # If exporting the file
         if export_file:
             # Export the results (save to disk)
             self.initial_export(timepoint_name, scan_name, slice_name)
 
+    # Generate summary statistics for every voxel at once
+    def generate_summary_stats(self, percentiles=None):
+        # List of (voxel, timepoint, stats set) entries that still hold a VoxelStatsGenerator
+        entries = []
+        # Number of streaming medians whose sketch could not keep the requested error bound, and the worst bound
+        widened_count = 0
+        worst_error = None
+        # For each voxel
+        for curr_voxel in self.iter_voxels():
+            # For each timepoint in the voxel
+            for timepoint in curr_voxel.stats_by_timepoint.keys():
+                # For each set of stats
+                for stats_set, stats_generator in curr_voxel.stats_by_timepoint[timepoint].items():
+                    # If the stats were already generated
+                    if not isinstance(stats_generator, (VoxelStatsGenerator, StreamingVoxelStatsGenerator)):
+                        # Skip them
+                        continue
+                    # If the stats has no entries (the file had no reflectance)
+                    if stats_generator.get_count() == 0:
+                        # Point to None
+                        curr_voxel.stats_by_timepoint[timepoint][stats_set] = None
+                        # Skip them
+                        continue
+                    # If the stats were accumulated in streaming mode
+                    if isinstance(stats_generator, StreamingVoxelStatsGenerator):
+                        # Create and populate a VoxelStats object directly from the accumulator
+                        vox_stats = VoxelStats()
+                        vox_stats.populate_from_accumulator(stats_generator, percentiles)
+                        # Replace the reference to the object
+                        curr_voxel.stats_by_timepoint[timepoint][stats_set] = vox_stats
+                        # If the requested error bound was exceeded
+                        if vox_stats.median_error > stats_generator.sketch.error:
+                            widened_count += 1
+                            worst_error = vox_stats.median_error if worst_error is None \
+                                else max(worst_error, vox_stats.median_error)
+                        # Skip the grouped computation
+                        continue
+                    # Add the entry
+                    entries.append((curr_voxel, timepoint, stats_set))
+        # If any streaming median missed the requested error bound
+        if widened_count:
+            # Warn once for the grid (each VoxelStats.median_error holds its own bound)
+            logging.warning(f'{widened_count} streaming medians exceeded the requested error bound of '
+                            f'{self.median_error} (worst {worst_error}). Raise max_buckets ({self.max_buckets}) '
+                            f'to keep it.')
+        # If there is nothing to summarize
+        if not entries:
+            return
+        # Number of values for each entry
+        counts = [len(entry[0].stats_by_timepoint[entry[1]][entry[2]].values) for entry in entries]
+        # All values in one array, grouped by entry
+        values = np.fromiter(chain.from_iterable(entry[0].stats_by_timepoint[entry[1]][entry[2]].values
+                                                 for entry in entries),
+                             dtype=np.float64,
+                             count=sum(counts))
+        # Compute the statistics for all entries in one pass
+        results = grouped_summary_stats(values, counts, percentiles)
+        # For each entry
+        for entry_idx, (curr_voxel, timepoint, stats_set) in enumerate(entries):
+            # Create a new VoxelStats object
+            vox_stats = VoxelStats()
+            # Populate the stats object
+            vox_stats.populate_from_results(results, entry_idx, percentiles)
+            # Replace the reference to the object
+            curr_voxel.stats_by_timepoint[timepoint][stats_set] = vox_stats
+
+    # Error bound on the streaming median for a set of stats ('distance' or 'reflectance')
+    def get_median_error(self, stats_set):
+        if isinstance(self.median_error, dict):
+            return self.median_error[stats_set]
+        return self.median_error
+
+    # Streaming accumulator for a set of stats, with the grid's error bound and sketch size
+    def make_streaming_generator(self, stats_set):
+        return StreamingVoxelStatsGenerator(self.get_median_error(stats_set), self.max_buckets)
+
+    # Yield every Voxel object in the grid
+    def iter_voxels(self):
+        # For each voxel X
+        for vox_x in self.voxels.keys():
+            # For each voxel Z
+            for vox_z in self.voxels[vox_x].keys():
+                yield self.voxels[vox_x][vox_z]
+
+    # Yield the coordinates (in coord_names order) and Voxel object of every voxel in the grid
+    def iter_located_voxels(self):
+        # For each voxel X
+        for vox_x in self.voxels.keys():
+            # For each voxel Z
+            for vox_z in self.voxels[vox_x].keys():
+                yield (vox_x, vox_z), self.voxels[vox_x][vox_z]
+
+    # Parse an ASCII point cloud as newline-aligned byte ranges on a pool of workers
+    def process_point_cloud_ranges(self, file_path, timepoint_name, scan_name, workers):
+        # Check the column layout once for the whole file
+        has_reflectance = self.get_point_cloud_layout(file_path)
+        # If the file has no points
+        if has_reflectance is None:
+            # Nothing to do
+            return
+        # Split the file into one range per worker
+        byte_ranges = self.get_byte_ranges(file_path, workers)
+        # Task for each range
+        tasks = [(type(self), self.voxel_size, (self.x_offset, self.y_offset, self.z_offset), self.stats_mode,
+                  (self.median_error, self.max_buckets), file_path, start, end, has_reflectance, timepoint_name,
+                  scan_name)
+                 for start, end in byte_ranges]
+        # Log info
+        logging.info(f'Processing {file_path} as {len(tasks)} byte ranges.')
+        # Make a process pool executor
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Merge the partial voxels in file order (so values keep their file order)
+            for partial_voxels in executor.map(process_byte_range, tasks):
+                self.merge_voxels(partial_voxels)
+
+    # Merge voxels from another grid (e.g. a partial aggregate from a worker) into this grid
+    def merge_voxels(self, other_voxels):
+        # For each voxel X
+        for vox_x in other_voxels.keys():
+            # For each voxel Z
+            for vox_z in other_voxels[vox_x].keys():
+                self.merge_voxel((vox_x, vox_z), other_voxels[vox_x][vox_z])
+
+    # Merge another Voxel object into this grid's voxel at the coordinates (in coord_names order)
+    def merge_voxel(self, coords, other_voxel):
+        vox_x, vox_z = coords
+        # If the voxel is not in this grid
+        if vox_x not in self.voxels.keys() or vox_z not in self.voxels[vox_x].keys():
+            # Add a voxel
+            self.add_voxel(vox_x, vox_z)
+        # Merge the other voxel into this grid's voxel
+        self.voxels[vox_x][vox_z].merge(other_voxel)
+
+    # Make an (empty) Voxel object at the coordinates (in coord_names order)
+    def make_voxel(self, coords):
+        return Voxel(x=coords[0], z=coords[1])
+
     # Add a voxel to the grid
     def add_voxel(self, vox_x, vox_z):
         # If there is no vox_x key in the dictionary
@@ -196,6 +348,53 @@ class Grid:
             # Add a Voxel object
             self.voxels[vox_x][vox_z] = Voxel(x=vox_x, z=vox_z)
 
+    # Bin a chunk of points into the voxels for a timepoint and scan
+    def add_point_chunk(self, timepoint_name, scan_name, coords, reflectance=None):
+        # If the chunk is empty
+        if len(coords) == 0:
+            # Nothing to do
+            return
+        # Get the voxel coordinates for every point at once
+        vox_coords = self.get_voxel_coords_array(coords)
+        # Unique X, Z voxels and the voxel index of each point
+        voxel_keys, point_voxels = np.unique(vox_coords[:, [0, 2]], axis=0, return_inverse=True)
+        point_voxels = point_voxels.reshape(-1)
+        # Order the points by voxel (stable, so values keep their file order)
+        order = np.argsort(point_voxels, kind='stable')
+        # Number of points in each voxel
+        counts = np.bincount(point_voxels, minlength=len(voxel_keys))
+        # Start and end of each voxel's points in the ordered arrays
+        bounds = np.concatenate(([0], np.cumsum(counts))).tolist()
+        # Distance and reflectance values grouped by voxel
+        distances = coords[order, 1]
+        if reflectance is not None:
+            reflectance = reflectance[order]
+        # For each voxel in the chunk
+        for voxel_idx, (vox_x, vox_z) in enumerate(voxel_keys.tolist()):
+            # Add a voxel (if necessary)
+            self.add_voxel(vox_x, vox_z)
+            # Reference the current voxel
+            curr_voxel = self.voxels[vox_x][vox_z]
+            # Add timepoint to the voxel
+            curr_voxel.add_timepoint_stats(self.timepoints[timepoint_name])
+            # Reference the voxel's stat generators for the timepoint
+            curr_stats = curr_voxel.stats_by_timepoint[timepoint_name]
+            # Slice of the ordered arrays for this voxel
+            start, end = bounds[voxel_idx], bounds[voxel_idx + 1]
+            # Add the distance values
+            curr_stats['distance'].add_values(distances[start:end])
+            # If the reflectance properties were exported from Cloud Compare
+            if reflectance is not None:
+                # Add the reflectance values
+                curr_stats['reflectance'].add_values(reflectance[start:end])
+            # Add to the point count for the scan
+            curr_voxel.scans[scan_name] = curr_voxel.scans.get(scan_name, 0) + end - start
+
+    # Get the voxel coordinates from an (N, 3) array of X, Y, Z point positions
+    def get_voxel_coords_array(self, coords):
+        # <> Include the offsets to 0,0 the grid
+        return np.floor(coords / self.voxel_size).astype(np.int64)
+
     # Get the voxel coordinates from X, Y, Z point positions
     def get_voxel_coords(self, x_co, y_co, z_co):
         # <> Include the offsets to 0,0 the grid
@@ -226,6 +425,408 @@ class Grid:
             row_count += 1
             yield row
 
+    # Yield the point cloud as NumPy arrays, chunk_size rows at a time
+    def yield_point_chunks(self, file_path, chunk_size=1000000, skip_first=True):
+        # Open the file
+        with open(file_path, 'r') as f:
+            # If the first row is a header
+            if skip_first:
+                # Skip it
+                f.readline()
+            # Read the first chunk of rows
+            rows = list(islice(f, chunk_size))
+            # If the file has no points
+            if not rows:
+                # Stop here
+                return
+            # Check once whether the reflectance properties were exported from Cloud Compare (by counting cols)
+            has_reflectance = len(rows[0].strip().split(',')) == 10
+            # X, Y and Z, plus reflectance if it was exported
+            use_cols = (0, 1, 2, 4) if has_reflectance else (0, 1, 2)
+            # While there are rows left
+            while rows:
+                # Parse the chunk straight into a float array
+                chunk = np.loadtxt(rows, delimiter=',', usecols=use_cols, ndmin=2, dtype=np.float64)
+                # Yield the coordinates and the reflectance (None if not exported)
+                yield chunk[:, :3], chunk[:, 3] if has_reflectance else None
+                # Read the next chunk of rows
+                rows = list(islice(f, chunk_size))
+
+    # Check the column layout of an ASCII point cloud from its first point
+    # Returns True if the reflectance properties were exported, False if not, and None if there are no points
+    def get_point_cloud_layout(self, file_path, skip_first=True):
+        # Open the file
+        with open(file_path, 'r') as f:
+            # If the first row is a header
+            if skip_first:
+                # Skip it
+                f.readline()
+            # Read the first point
+            row = f.readline()
+        # If there was no point
+        if not row.strip():
+            return None
+        # Count the columns
+        return len(row.strip().split(',')) == 10
+
+    # Split an ASCII point cloud into newline-aligned byte ranges [start, end) after the header
+    def get_byte_ranges(self, file_path, range_count, skip_first=True):
+        # Open the file in binary mode
+        with open(file_path, 'rb') as f:
+            # If the first row is a header
+            if skip_first:
+                # Skip it
+                f.readline()
+            # First byte of the points
+            first_byte = f.tell()
+            # Size of the file
+            f.seek(0, 2)
+            file_size = f.tell()
+            # Boundaries between the ranges
+            boundaries = [first_byte]
+            # For each nominal boundary
+            for range_idx in range(1, range_count):
+                # Go to the nominal boundary
+                f.seek(first_byte + (file_size - first_byte) * range_idx // range_count)
+                # Move to the start of the next row
+                f.readline()
+                # If the boundary moved past the last one
+                if f.tell() > boundaries[-1]:
+                    # Keep it
+                    boundaries.append(f.tell())
+            # If the last boundary is before the end of the file
+            if boundaries[-1] < file_size:
+                # Close the last range at the end of the file
+                boundaries.append(file_size)
+        # Return the ranges
+        return list(zip(boundaries[:-1], boundaries[1:]))
+
+    # Yield the points in a byte range of an ASCII point cloud as NumPy arrays, about chunk_bytes at a time
+    def yield_point_chunks_in_range(self, file_path, start, end, has_reflectance, chunk_bytes=64000000):
+        # X, Y and Z, plus reflectance if it was exported
+        use_cols = (0, 1, 2, 4) if has_reflectance else (0, 1, 2)
+        # Open the file in binary mode
+        with open(file_path, 'rb') as f:
+            # Go to the start of the range
+            f.seek(start)
+            # Bytes left in the range
+            remaining = end - start
+            # While there are bytes left
+            while remaining > 0:
+                # Read a block
+                block = f.read(min(chunk_bytes, remaining))
+                remaining -= len(block)
+                # If the block stopped part way through a row
+                if remaining > 0 and not block.endswith(b'\n'):
+                    # Read the rest of the row
+                    tail = f.readline()
+                    block += tail
+                    remaining -= len(tail)
+                # Split the block into rows
+                rows = block.decode().splitlines()
+                # If the block had no rows
+                if not rows:
+                    continue
+                # Parse the rows straight into a float array
+                chunk = np.loadtxt(rows, delimiter=',', usecols=use_cols, ndmin=2, dtype=np.float64)
+                # Yield the coordinates and the reflectance (None if not exported)
+                yield chunk[:, :3], chunk[:, 3] if has_reflectance else None
+
+    # Get the path of the partial aggregate for a single scan position
+    def get_scan_partial_path(self, slice_name, scan_name, timepoint_name):
+        return Path(Path(self.input_path).parents[1], 'output', self.name, 'scan_partials',
+                    f'{slice_name}_{scan_name}_{timepoint_name}.npz')
+
+    # Check whether the partial aggregate for a scan exists, is newer than its ASCII point cloud and was binned with
+    # the grid's voxel size, offsets and coordinates
+    def scan_partial_is_current(self, slice_name, scan_name, timepoint_name):
+        # Assemble the paths
+        partial_path = self.get_scan_partial_path(slice_name, scan_name, timepoint_name)
+        file_path = Path(self.input_path, f'{slice_name}_{scan_name}_{timepoint_name}.txt')
+        # If the partial does not exist
+        if not exists(partial_path):
+            return False
+        # If it is older than the point cloud
+        if stat(partial_path).st_mtime_ns < stat(file_path).st_mtime_ns:
+            return False
+        # Check that it was binned with the grid's voxel size, offsets and coordinates
+        with np.load(partial_path) as partial:
+            return self.partial_matches_grid(partial)
+
+    # Check whether a partial aggregate's arrays were binned with this grid's voxel size, offsets and coordinates
+    # (e.g. not a 2D partial for a 3D grid)
+    def partial_matches_grid(self, arrays):
+        return 'offsets' in arrays and 'coord_names' in arrays and \
+            np.array_equal(arrays['voxel_size'], np.array(self.voxel_size)) and \
+            np.array_equal(arrays['offsets'], self.get_offset_array(), equal_nan=True) and \
+            arrays['coord_names'].tolist() == self.coord_names
+
+    # Grid offsets (X, Y, Z) as an array, NaN where not set
+    def get_offset_array(self):
+        return np.array([np.nan if offset is None else offset
+                         for offset in (self.x_offset, self.y_offset, self.z_offset)], dtype=np.float64)
+
+    # Export the (not yet summarized) voxels of a single scan as a partial aggregate that can be merged later
+    def export_scan_partial(self, output_path, timepoint_name, scan_name):
+        # Voxel coordinates (for each of coord_names) and the scan's point count, in grid order
+        voxel_coords = {coord_name: [] for coord_name in self.coord_names}
+        point_counts = []
+        # Stat generators for each set of stats, in the same order
+        generators = {'distance': [], 'reflectance': []}
+        # For each voxel
+        for coords, curr_voxel in self.iter_located_voxels():
+            # If the voxel has no values for the timepoint
+            if timepoint_name not in curr_voxel.stats_by_timepoint.keys():
+                # Skip it
+                continue
+            # Store the voxel
+            for coord_name, coord in zip(self.coord_names, coords):
+                voxel_coords[coord_name].append(coord)
+            point_counts.append(curr_voxel.scans.get(scan_name, 0))
+            for stats_set in generators.keys():
+                generators[stats_set].append(curr_voxel.stats_by_timepoint[timepoint_name][stats_set])
+        # Arrays for the partial aggregate
+        arrays = {'timepoint_name': np.array(timepoint_name),
+                  'scan_name': np.array(scan_name),
+                  'stats_mode': np.array(self.stats_mode),
+                  'voxel_size': np.array(self.voxel_size),
+                  'offsets': self.get_offset_array(),
+                  'coord_names': np.array(self.coord_names),
+                  'point_count': np.array(point_counts, dtype=np.int64)}
+        for coord_name, coords in voxel_coords.items():
+            arrays[coord_name] = np.array(coords, dtype=np.int64)
+        # For each set of stats
+        for stats_set, stats_generators in generators.items():
+            # If the values were accumulated in streaming mode
+            if self.stats_mode == 'streaming':
+                # Running moments and extremes (NaN where there were no values)
+                arrays[f'{stats_set}_count'] = np.array([gen.count for gen in stats_generators], dtype=np.int64)
+                arrays[f'{stats_set}_mean'] = np.array([gen.mean for gen in stats_generators], dtype=np.float64)
+                arrays[f'{stats_set}_m2'] = np.array([gen.m2 for gen in stats_generators], dtype=np.float64)
+                arrays[f'{stats_set}_min'] = np.array([np.nan if gen.min is None else gen.min
+                                                       for gen in stats_generators], dtype=np.float64)
+                arrays[f'{stats_set}_max'] = np.array([np.nan if gen.max is None else gen.max
+                                                       for gen in stats_generators], dtype=np.float64)
+                # Sketch widths and buckets (voxel index, bucket id and count for every bucket)
+                arrays[f'{stats_set}_sketch_width'] = np.array([gen.sketch.width for gen in stats_generators],
+                                                               dtype=np.float64)
+                arrays[f'{stats_set}_bucket_count'] = np.array([len(gen.sketch.buckets) for gen in stats_generators],
+                                                               dtype=np.int64)
+                arrays[f'{stats_set}_bucket_ids'] = np.fromiter(
+                    chain.from_iterable(gen.sketch.buckets.keys() for gen in stats_generators), dtype=np.int64)
+                arrays[f'{stats_set}_bucket_counts'] = np.fromiter(
+                    chain.from_iterable(gen.sketch.buckets.values() for gen in stats_generators), dtype=np.int64)
+            # Otherwise (exact mode)
+            else:
+                # Number of values per voxel and every value, grouped by voxel
+                arrays[f'{stats_set}_count'] = np.array([len(gen.values) for gen in stats_generators], dtype=np.int64)
+                arrays[f'{stats_set}_values'] = np.fromiter(
+                    chain.from_iterable(gen.values for gen in stats_generators), dtype=np.float64)
+        # If the output directory does not exist
+        if not exists(Path(output_path).parent):
+            # Make it
+            makedirs(Path(output_path).parent, exist_ok=True)
+        # Write to a temporary file, then move it into place
+        with open(f'{output_path}.tmp', 'wb') as of:
+            np.savez(of, **arrays)
+        replace(f'{output_path}.tmp', output_path)
+
+    # Merge a partial aggregate written by export_scan_partial into this grid. Raises ValueError if the partial was
+    # binned with a different voxel size, offsets or coordinates
+    def merge_scan_partial(self, partial_path):
+        # Load the arrays
+        with np.load(partial_path) as partial:
+            arrays = {key: partial[key] for key in partial.files}
+        # Names for the partial
+        timepoint_name = str(arrays['timepoint_name'])
+        scan_name = str(arrays['scan_name'])
+        # If the partial was binned with a different voxel size, offsets or coordinates (e.g. a stale partial from
+        # another spec)
+        if not self.partial_matches_grid(arrays):
+            # Its voxels would be merged into the wrong bins
+            raise ValueError(f'Partial {partial_path} was binned with voxel size {arrays["voxel_size"]}, offsets '
+                             f'{arrays.get("offsets")} and coordinates {arrays.get("coord_names")}, but the grid has '
+                             f'voxel size {self.voxel_size}, offsets {self.get_offset_array()} and coordinates '
+                             f'{self.coord_names}. Re-ingest the scan.')
+        # If the partial was accumulated in a different mode
+        if str(arrays['stats_mode']) != self.stats_mode:
+            # Log an error
+            logging.error(f'Partial {partial_path} was accumulated in {arrays["stats_mode"]} mode, '
+                          f'but the grid is in {self.stats_mode} mode. Skipping it.')
+            # Stop here
+            return
+        # Create Timepoint
+        self.add_timepoint(timepoint_name)
+        # Add a scan to the Timepoint object
+        self.timepoints[timepoint_name].add_scan(scan_name)
+        # Stat generators for each voxel, for each set of stats
+        generators = {}
+        # For each set of stats
+        for stats_set in ['distance', 'reflectance']:
+            # If the values were accumulated in streaming mode
+            if self.stats_mode == 'streaming':
+                # Buckets split by voxel
+                bucket_splits = np.cumsum(arrays[f'{stats_set}_bucket_count'])[:-1]
+                bucket_ids = np.split(arrays[f'{stats_set}_bucket_ids'], bucket_splits)
+                bucket_counts = np.split(arrays[f'{stats_set}_bucket_counts'], bucket_splits)
+                generators[stats_set] = []
+                # For each voxel
+                for voxel_idx in range(len(arrays['vox_x'])):
+                    # Rebuild the accumulator
+                    gen = self.make_streaming_generator(stats_set)
+                    gen.count = int(arrays[f'{stats_set}_count'][voxel_idx])
+                    gen.mean = float(arrays[f'{stats_set}_mean'][voxel_idx])
+                    gen.m2 = float(arrays[f'{stats_set}_m2'][voxel_idx])
+                    if gen.count > 0:
+                        gen.min = float(arrays[f'{stats_set}_min'][voxel_idx])
+                        gen.max = float(arrays[f'{stats_set}_max'][voxel_idx])
+                    # Rebuild the sketch
+                    gen.sketch.width = float(arrays[f'{stats_set}_sketch_width'][voxel_idx])
+                    gen.sketch.buckets = dict(zip(bucket_ids[voxel_idx].tolist(), bucket_counts[voxel_idx].tolist()))
+                    gen.sketch.count = gen.count
+                    gen.sketch.min = gen.min
+                    gen.sketch.max = gen.max
+                    generators[stats_set].append(gen)
+            # Otherwise (exact mode)
+            else:
+                # Values split by voxel
+                values = np.split(arrays[f'{stats_set}_values'], np.cumsum(arrays[f'{stats_set}_count'])[:-1])
+                generators[stats_set] = []
+                # For each voxel
+                for voxel_values in values:
+                    # Rebuild the generator
+                    gen = VoxelStatsGenerator()
+                    gen.values = voxel_values.tolist()
+                    generators[stats_set].append(gen)
+        # For each voxel
+        for voxel_idx, coords in enumerate(zip(*(arrays[coord_name].tolist() for coord_name in self.coord_names))):
+            # Make the Voxel object
+            new_voxel = self.make_voxel(coords)
+            new_voxel.stats_by_timepoint[timepoint_name] = {'distance': generators['distance'][voxel_idx],
+                                                            'reflectance': generators['reflectance'][voxel_idx]}
+            new_voxel.scans[scan_name] = int(arrays['point_count'][voxel_idx])
+            # Merge it into the grid
+            self.merge_voxel(coords, new_voxel)
+
+    # Get the paths of the binary cache (data and header) for an ASCII point cloud
+    def get_point_cloud_cache_paths(self, file_path):
+        # If the grid has an input path
+        if self.input_path:
+            # Cache directory next to the input and output directories
+            cache_dir = Path(Path(self.input_path).parents[1], 'cache', 'point_clouds')
+        # Otherwise
+        else:
+            # Cache directory next to the file
+            cache_dir = Path(Path(file_path).parent, 'cache')
+        # Name the cache files after the ASCII file
+        file_stem = Path(file_path).stem
+        return Path(cache_dir, f'{file_stem}.bin'), Path(cache_dir, f'{file_stem}.json')
+
+    # Check whether the binary cache for an ASCII point cloud exists and was built from the current file
+    def point_cloud_cache_is_current(self, file_path):
+        # Get the cache paths
+        data_path, header_path = self.get_point_cloud_cache_paths(file_path)
+        # If either cache file is missing
+        if not exists(data_path) or not exists(header_path):
+            return False
+        # Current size and modification time of the source
+        source_stat = stat(file_path)
+        # Load the header
+        try:
+            with open(header_path, 'r') as f:
+                header = json.load(f)
+            # If the source changed since the cache was built
+            if header['source_size'] != source_stat.st_size or header['source_mtime_ns'] != source_stat.st_mtime_ns:
+                return False
+            # If the data file is not the expected size (e.g. an interrupted build)
+            if stat(data_path).st_size != header['point_count'] * len(header['columns']) * 8:
+                return False
+        # If the header is unreadable or incomplete (e.g. truncated), the cache is stale
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.warning(f'Unreadable point cloud cache header {header_path} ({e}). Treating the cache as stale.')
+            return False
+        return True
+
+    # Convert an ASCII point cloud into the binary cache (raw float64 rows plus a JSON header)
+    def build_point_cloud_cache(self, file_path, chunk_size=1000000):
+        # Get the cache paths
+        data_path, header_path = self.get_point_cloud_cache_paths(file_path)
+        # If the cache directory does not exist
+        if not exists(data_path.parent):
+            # Make it
+            makedirs(data_path.parent, exist_ok=True)
+        # Size and modification time of the source (before reading it)
+        source_stat = stat(file_path)
+        # Point count and column layout
+        point_count = 0
+        has_reflectance = False
+        # Log info
+        logging.info(f'Building point cloud cache {data_path}.')
+        # Write the chunks to a temporary file
+        with open(f'{data_path}.tmp', 'wb') as of:
+            for coords, reflectance in self.yield_point_chunks(file_path, chunk_size=chunk_size):
+                # Reassemble the columns
+                has_reflectance = reflectance is not None
+                chunk = np.column_stack((coords, reflectance)) if has_reflectance else coords
+                # Write the rows
+                of.write(np.ascontiguousarray(chunk, dtype='<f8').tobytes())
+                point_count += len(chunk)
+        # Header describing the layout
+        header = {'source': str(file_path),
+                  'source_size': source_stat.st_size,
+                  'source_mtime_ns': source_stat.st_mtime_ns,
+                  'point_count': point_count,
+                  'columns': ['x', 'y', 'z', 'reflectance'] if has_reflectance else ['x', 'y', 'z'],
+                  'dtype': '<f8'}
+        # Move the data into place, then the header (the cache only counts once both exist)
+        replace(f'{data_path}.tmp', data_path)
+        # Write the header to a temporary file and replace the old one (so it is never left half-written)
+        with open(f'{header_path}.tmp', 'w') as of:
+            json.dump(header, of)
+        replace(f'{header_path}.tmp', header_path)
+
+    # Build the binary cache for every ASCII point cloud in the project that does not have a current one
+    def build_all_point_cloud_caches(self):
+        # Assess the project structure
+        self.assess_project_structure()
+        # For each timepoint
+        for timepoint in self.proj_struct.keys():
+            # For each slice
+            for slice in self.proj_struct[timepoint].keys():
+                # For each scan position
+                for scan in self.proj_struct[timepoint][slice]:
+                    # Assemble the file path
+                    file_path = Path(self.input_path, f'{slice}_{scan}_{timepoint}.txt')
+                    # If the cache is already current
+                    if self.point_cloud_cache_is_current(file_path):
+                        # Skip it
+                        continue
+                    # Build the cache
+                    self.build_point_cloud_cache(file_path)
+
+    # Yield the point cloud from the memory-mapped binary cache, chunk_size rows at a time
+    def yield_cached_point_chunks(self, file_path, chunk_size=1000000):
+        # Get the cache paths
+        data_path, header_path = self.get_point_cloud_cache_paths(file_path)
+        # Load the header
+        with open(header_path, 'r') as f:
+            header = json.load(f)
+        # If the file has no points
+        if header['point_count'] == 0:
+            # Stop here
+            return
+        # Memory map the rows
+        points = np.memmap(data_path, dtype=header['dtype'], mode='r',
+                           shape=(header['point_count'], len(header['columns'])))
+        # Whether the reflectance column is present
+        has_reflectance = 'reflectance' in header['columns']
+        # For each chunk of rows
+        for start in range(0, header['point_count'], chunk_size):
+            # Read the chunk into memory
+            chunk = np.array(points[start:start + chunk_size])
+            # Yield the coordinates and the reflectance (None if not exported)
+            yield chunk[:, :3], chunk[:, 3] if has_reflectance else None
+
     # Initial export of results
     def initial_export(self, timepoint_name, scan_name, slice_name):
         dir_name = f'F:/UMB/Geomorphology/output/{self.name}'
@@ -234,24 +835,57 @@ class Grid:
             # Make it
             mkdir(dir_name)
 
-        # Output dictionary
-        output_dict = {'Grid Name': self.name,
-                       'Timepoint Name': timepoint_name,
-                       'Scan Name': scan_name,
-                       'Slice Name': slice_name,
-                       'Voxels': {}}
-        # Transfer keys and results
-        for vox_x in self.voxels.keys():
-            output_dict['Voxels'][vox_x] = {}
-            for vox_z in self.voxels[vox_x].keys():
-                output_dict['Voxels'][vox_x][vox_z] = self.voxels[vox_x][vox_z].flatten()
+        # Header of the output file
+        header = {'Grid Name': self.name,
+                  'Timepoint Name': timepoint_name,
+                  'Scan Name': scan_name,
+                  'Slice Name': slice_name}
         # Log before output
         logging.info(f'Exporting to {slice_name}_{scan_name}_{timepoint_name}.json.')
-        # Open output file
-        with open(Path(f'F:/UMB/Geomorphology/output/{self.name}/{slice_name}_{scan_name}_{timepoint_name}.json'), 'w') as of:
-            json.dump(output_dict, of)
+        # Stream the voxels to the output file one column at a time
+        with JsonStreamWriter(Path(f'F:/UMB/Geomorphology/output/{self.name}/{slice_name}_{scan_name}_{timepoint_name}.json'),
+                              header=header, stream_key='Voxels') as writer:
+            for key, export_column in self.iter_export_voxels():
+                writer.write_entry(key, export_column)
         # Log after output
         logging.info(f'Exporting to {slice_name}_{scan_name}_{timepoint_name}.json complete.')
+        # If there is a project store
+        if self.store:
+            # Bulk insert the voxel statistics
+            self.store.insert_voxel_stats(self.get_slice_timepoint_columns(slice_name, timepoint_name), scan_name)
+
+    # Path of the project store (SQLite database) for the grid
+    def get_project_store_path(self):
+        return Path(self.input_path.parents[1], 'output', self.name, f'{self.name}.sqlite')
+
+    # Flattened voxel results for export. Nested keys [X][Z]
+    def get_export_voxels(self):
+        return dict(self.iter_export_voxels())
+
+    # Yield the flattened voxel results for export one top-level entry at a time (X: {Z: flattened voxel})
+    def iter_export_voxels(self):
+        for vox_x in self.voxels.keys():
+            yield vox_x, {vox_z: curr_voxel.flatten() for vox_z, curr_voxel in self.voxels[vox_x].items()}
+
+    # Columnar form of the (summarized) voxel results for a slice and timepoint
+    def get_slice_timepoint_columns(self, slice_name, timepoint_name):
+        return c_columnar.SliceTimepointColumns.from_voxels_dict(self.get_export_voxels(),
+                                                                 grid_name=self.name,
+                                                                 slice_name=slice_name,
+                                                                 timepoint_name=timepoint_name)
+
+    # Voxel (X, Z) of the grid offsets, or None if the specification has no offsets
+    def get_voxel_origin(self):
+        if self.x_offset is None or self.z_offset is None:
+            return None
+        return int(floor(self.x_offset / self.voxel_size)), int(floor(self.z_offset / self.voxel_size))
+
+    # Array-backed (c_dense_grid.DenseVoxelGrid) form of a slice/timepoint result in a directory, loaded from its
+    # columnar form (or the JSON) rather than into Voxel objects
+    def load_dense_timepoint(self, dir_path, slice_name, timepoint_name):
+        columns = c_columnar.load_slice_timepoint(dir_path, slice_name, timepoint_name)
+        return c_dense_grid.DenseVoxelGrid.from_columns(columns, origin=self.get_voxel_origin(),
+                                                        voxel_size=self.voxel_size)
 
     # Assess project structure from ASCII files
     def assess_project_structure(self):
@@ -301,8 +935,19 @@ class Grid:
             # Derive the events
             self.derive_all_events_for_slice(slice, slices[slice])
 
-    # Derive all loss & gain events from all pairs of timepoints in a slice
-    def derive_all_events_for_slice(self, slice, timepoints):
+    # Derive all loss & gain events from all pairs of timepoints in a slice (O(n^2) pairs, kept until deleted;
+    # derive_events_for_slice can derive only the adjacent ones and leave the rest to materialize_pairs)
+    # column_workers: processes each pair's columns are split across (1 derives them in this process)
+    def derive_all_events_for_slice(self, slice, timepoints, column_workers=1):
+        # List of timepoint pairs for the slice
+        timepoint_pairs = [(a, b) for idx, a in enumerate(timepoints) for b in timepoints[idx + 1:]]
+        # Derive them
+        self.derive_events_for_slice(slice, timepoints, timepoint_pairs, column_workers=column_workers)
+
+    # Derive loss & gain events for pairs of timepoints in a slice, skipping those whose results already exist
+    # timepoint_pairs: (first_tp, second_tp) pairs to derive, or None for each timepoint and the next one in time
+    # column_workers: processes each pair's columns are split across (1 derives them in this process)
+    def derive_events_for_slice(self, slice, timepoints, timepoint_pairs=None, column_workers=1):
         # Empty the timepoints
         self.timepoints = {}
         # Assemble output directory
@@ -311,41 +956,164 @@ class Grid:
         if not exists(output_dir):
             # Make it
             mkdir(output_dir)
-        # Assemble the file directory
-        dir_path = Path(self.input_path.parents[1], 'output', self.name, 'slice_timepoint')
-        # For each timepoint
-        for timepoint in timepoints:
-            # Add a timepoint object
-            self.add_timepoint(timepoint)
-            # Assemble the file path
-            file_path = Path(dir_path, f'{slice}_{timepoint}.json')
-            # Open the file
-            with open(file_path, 'r') as f:
-                # Load the input dictionary
-                input_dict = json.load(f)
-            # Transfer the dictionary
-            self.timepoints[timepoint].voxels = input_dict['Voxels']
-        # List of timepoint pairs for the slice
-        timepoint_pairs = [(a, b) for idx, a in enumerate(timepoints) for b in timepoints[idx + 1:]]
+        # If no pairs were given
+        if timepoint_pairs is None:
+            # Pair each timepoint with the next one in time
+            ordered_timepoints = sorted(timepoints, key=lambda timepoint_name: int(timepoint_name[2:]))
+            timepoint_pairs = list(zip(ordered_timepoints, ordered_timepoints[1:]))
+        # Aligned rasters of the pairs' timepoints (read and rasterized once for all of the pairs, when needed)
+        stack = None
         # For each timepoint pair
         for timepoint_pair in timepoint_pairs:
+            # Order the timepoints (earlier timepoint first)
+            first_tp, second_tp = self.order_timepoints(timepoint_pair[0], timepoint_pair[1])
             # Assemble output path
-            output_path = Path(output_dir, f'{slice}_{timepoint_pair[0]}_{timepoint_pair[1]}.json')
-            # If the file already exists
-            if exists(output_path):
+            output_path = Path(output_dir, f'{slice}_{first_tp}_{second_tp}.json')
+            # If the results already exist (JSON or migrated columnar form)
+            if c_columnar.pair_results_exist(output_dir, slice, first_tp, second_tp):
                 # Skip it
                 continue
-            # If the first timepoint in the pair is the lower number (earlier) timepoint
-            if int(timepoint_pair[0][2:]) < int(timepoint_pair[1][2:]):
-                # Derive the events
-                pair_results = self.derive_events_from_timepoints(timepoint_pair[0], timepoint_pair[1])
-            # Otherwise (second timepoint is before first)
+            # Load the rasters
+            if stack is None:
+                stack = self.get_raster_stack(slice, list(dict.fromkeys(chain.from_iterable(timepoint_pairs))))
+            # Derive the events (only the segmentation is done per pair) and write them
+            pair_columns = stack.get_change_raster(first_tp, second_tp).to_pair_columns(slice_name=slice,
+                                                                                        workers=column_workers)
+            self.write_pair_results(output_path, slice, first_tp, second_tp, pair_columns.iter_pair_results())
+
+    # Aligned mean distance rasters of a slice's timepoints (c_change_raster.RasterStack). A saved stack in the change
+    # directory is used if it has the timepoints and was built from the current versions of their results; otherwise
+    # the stack is (re)built with them (and the saved stack's other timepoints) and saved
+    def get_raster_stack(self, slice, timepoints):
+        # Assemble the paths
+        dir_path = Path(self.input_path.parents[1], 'output', self.name, 'slice_timepoint')
+        stack_path = Path(self.input_path.parents[1], 'output', self.name, 'change', 'rasters',
+                          f'{slice}{c_columnar.COLUMNS_SUFFIX}')
+        # Keys of the timepoints' current results
+        source_keys = {timepoint_name: c_columnar.get_source_key(
+            c_columnar.get_slice_timepoint_source(dir_path, slice, timepoint_name)) for timepoint_name in timepoints}
+        # If there is a saved stack
+        if exists(Path(stack_path, 'header.json')):
+            stack = c_change_raster.RasterStack.load(stack_path)
+            # If it is current for the timepoints
+            if all(stack.source_keys.get(timepoint_name) == source_key
+                   for timepoint_name, source_key in source_keys.items()):
+                return stack
+            # Otherwise, keep its other timepoints (if their results still exist) in the new one
+            for timepoint_name in stack.timepoint_names:
+                source_path = c_columnar.get_slice_timepoint_source(dir_path, slice, timepoint_name)
+                if timepoint_name not in source_keys and exists(source_path):
+                    source_keys[timepoint_name] = c_columnar.get_source_key(source_path)
+        # Load each timepoint (columnar if available, JSON otherwise)
+        timepoint_arrays = {}
+        for timepoint_name in source_keys:
+            timepoint = Timepoint(timepoint_name)
+            timepoint.columns = c_columnar.load_slice_timepoint(dir_path, slice, timepoint_name)
+            timepoint_arrays[timepoint_name] = timepoint.get_voxel_arrays()
+        # Build the stack and save it
+        stack = c_change_raster.RasterStack.from_voxel_arrays(slice, timepoint_arrays)
+        stack.source_keys = source_keys
+        makedirs(stack_path.parent, exist_ok=True)
+        stack.save(stack_path)
+        return stack
+
+    # Write (column, results) pairs for a slice and timepoint pair to the output file, streaming each column as it is
+    # finished, and insert them into the project store (if there is one)
+    def write_pair_results(self, output_path, slice, first_tp, second_tp, pair_results_iter):
+        # Stream the columns to the output file
+        with JsonStreamWriter(output_path) as writer:
+
+            # Write each column as it is derived, passing it on
+            def write_columns():
+                for col, col_results in pair_results_iter:
+                    writer.write_entry(col, col_results)
+                    yield col, col_results
+
+            # If there is a project store
+            if self.store:
+                # Insert the events and missing data as the columns are written
+                self.store.insert_pair_results(slice, first_tp, second_tp, write_columns())
+            # Otherwise
             else:
-                # Derive the events
-                pair_results = self.derive_events_from_timepoints(timepoint_pair[1], timepoint_pair[0])
-            # Open output file
-            with open(output_path, 'w') as of:
-                json.dump(pair_results, of)
+                # Just write them
+                for _ in write_columns():
+                    pass
+
+    # Derive the results for (slice, first_tp, second_tp) requests that do not exist yet, so pairs are only computed
+    # when someone asks for them (load_events does). Pairs derived here are recorded with their last use in the pair
+    # cache manifest, and the least recently used of them (files and project store rows) are deleted once there are
+    # more than pair_cache_size. Existing results (e.g. from derive_events_for_slice) are used as they are and never
+    # deleted. The manifest is only read, changed and saved under a lock file, so processes sharing it take turns
+    def materialize_pairs(self, pair_requests, column_workers=1):
+        # Assemble the directories
+        change_dir = Path(self.input_path.parents[1], 'output', self.name, 'change')
+        output_dir = Path(change_dir, 'slice_timepoint_pairs')
+        # Manifest (pair name: time of last use) and its lock file
+        manifest_path = Path(change_dir, 'pair_cache.json')
+        lock_path = Path(f'{manifest_path}.lock')
+        # Uses of the requested pairs (pair name: time), and whether each was derived by this call
+        pair_uses = {}
+        derived = set()
+        # For each request
+        for slice, first_tp, second_tp in pair_requests:
+            # Order the timepoints (earlier timepoint first)
+            first_tp, second_tp = self.order_timepoints(first_tp, second_tp)
+            pair_name = f'{slice}_{first_tp}_{second_tp}'
+            pair_uses[pair_name] = time.time()
+            # If the results already exist
+            if c_columnar.pair_results_exist(output_dir, slice, first_tp, second_tp):
+                continue
+            # Log info
+            logging.info(f'Deriving {pair_name} on demand.')
+            # Derive the events from the slice's rasters (only the segmentation is done per pair) and write them
+            makedirs(output_dir, exist_ok=True)
+            pair_columns = self.get_raster_stack(slice, [first_tp, second_tp]).get_change_raster(first_tp, second_tp) \
+                .to_pair_columns(slice_name=slice, workers=column_workers)
+            self.write_pair_results(Path(output_dir, f'{pair_name}.json'), slice, first_tp, second_tp,
+                                    pair_columns.iter_pair_results())
+            derived.add(pair_name)
+        # If nothing was derived and there is no manifest of pairs to update
+        if not derived and not exists(manifest_path):
+            return
+        makedirs(change_dir, exist_ok=True)
+        with file_lock(lock_path):
+            # Load the manifest
+            pair_cache = {}
+            if exists(manifest_path):
+                with open(manifest_path, 'r') as f:
+                    pair_cache = json.load(f)
+            # Record the uses of the pairs derived on demand (by this call, or earlier)
+            used = {pair_name: use_time for pair_name, use_time in pair_uses.items()
+                    if pair_name in derived or pair_name in pair_cache}
+            # If none were used
+            if not used:
+                return
+            pair_cache.update(used)
+            # Delete the least recently used pairs past the cache size
+            evicted = []
+            for pair_name in sorted(pair_cache, key=pair_cache.get):
+                if len(pair_cache) <= self.pair_cache_size:
+                    break
+                if pair_name in pair_uses:
+                    continue
+                c_columnar.remove_pair_results(output_dir, *pair_name.rsplit('_', 2))
+                del pair_cache[pair_name]
+                evicted.append(pair_name)
+                # Log info
+                logging.info(f'Evicted {pair_name} from the pair cache.')
+            # Delete the evicted pairs' rows from the project store (opening it if this grid has none set)
+            store_path = self.get_project_store_path()
+            if evicted and (self.store or exists(store_path)):
+                store = self.store or c_project_store.ProjectStore(store_path)
+                for pair_name in evicted:
+                    store.delete_pair_results(*pair_name.rsplit('_', 2))
+                if store is not self.store:
+                    store.close()
+            # Save the manifest (via a temporary file, so an interrupted save never corrupts it)
+            tmp_path = Path(f'{manifest_path}.tmp')
+            with open(tmp_path, 'w') as of:
+                json.dump(pair_cache, of, indent=1)
+            replace(tmp_path, manifest_path)
 
     def order_timepoints(self, first_tp, second_tp):
         if int(first_tp[2:]) < int(second_tp[2:]):
@@ -355,147 +1123,65 @@ class Grid:
 
     # Derive all loss & gain events from a pair or timepoints
     def derive_events_from_timepoints(self, first_tp, second_tp):
-        # Dictionary for results
-        results_dict = {}
-        # List of all X coordinates from both timepoints
-        vox_x_list = []
-        # For each timepoint
-        for timepoint in [first_tp, second_tp]:
-            # For each voxel x in the timepoint
-            for vox_x in self.timepoints[timepoint].voxels.keys():
-                # If the key is not in the list
-                if vox_x not in vox_x_list:
-                    # Add it
-                    vox_x_list.append(vox_x)
-        # Sorted voxel list
-        sorted_vox_x = sorted(vox_x_list, key=int)
-        # First (leftmost) voxel
-        curr_vox_x = int(sorted_vox_x[0]) - 1
-        # Iterate through the voxel xs
-        for vox_x in sorted_vox_x[1:]:
-            # Increment the current column
-            curr_vox_x += 1
-            # While curr voxel is less than the voxel minus one
-            while curr_vox_x < int(vox_x) - 1:
-                # Add a record of the missing column
-                results_dict[str(curr_vox_x + 1)] = [first_tp, second_tp]
-                # Increment the current column
-                curr_vox_x += 1
-        # Iterate through the voxel xs
-        for vox_x in sorted_vox_x[1:]:
-            # Set up a list for the column
-            results_dict[vox_x] = []
-            # For each timepoint
-            for timepoint in [first_tp, second_tp]:
-                # If the column is not in the timepoint
-                if vox_x not in self.timepoints[timepoint].voxels.keys():
-                    # Add it to the missing data
-                    results_dict[vox_x].append(timepoint)
-            # If both timepoints have data for the column
-            if len(results_dict[vox_x]) == 0:
-                # Proceed
-                column_results = self.derive_events_from_column(first_tp,
-                                                                second_tp,
-                                                                self.timepoints[first_tp].voxels[vox_x],
-                                                                self.timepoints[second_tp].voxels[vox_x])
-                # Store the results for the column
-                results_dict[vox_x] = column_results
         # Return the results dictionary
-        return results_dict
+        return dict(self.yield_events_from_timepoints(first_tp, second_tp))
+
+    # Yield (column, results) for a pair of timepoints (missing columns first), derived for the whole slice at once
+    # (split into column chunks across column_workers processes if more than 1)
+    def yield_events_from_timepoints(self, first_tp, second_tp, column_workers=1):
+        pair_columns = self.get_change_raster(first_tp, second_tp).to_pair_columns(workers=column_workers)
+        yield from pair_columns.iter_pair_results()
+
+    # Aligned rasters of the two timepoints' voxels (c_change_raster.ChangeRaster)
+    def get_change_raster(self, first_tp, second_tp):
+        return c_change_raster.ChangeRaster.from_voxel_arrays(first_tp,
+                                                              second_tp,
+                                                              self.timepoints[first_tp].get_voxel_arrays(),
+                                                              self.timepoints[second_tp].get_voxel_arrays())
 
     # Derive loss & gain events from a column of voxels
     def derive_events_from_column(self, first_tp, second_tp, first_col, second_col):
-        # Dictionary for results
+        # Rows and mean distances of each timepoint's voxels
+        first_rows = np.fromiter(map(int, first_col.keys()), dtype=np.int64, count=len(first_col))
+        second_rows = np.fromiter(map(int, second_col.keys()), dtype=np.int64, count=len(second_col))
+        # Rows of the column, from the top down (as always, the bottom two rows are not included)
+        top_row = max(first_rows.max(), second_rows.max())
+        rows = np.arange(top_row, min(first_rows.min(), second_rows.min()) + 1, -1)
+        # If there are no rows
+        if not len(rows):
+            return {}
+        # Align both timepoints to the rows (NaN where a timepoint has no voxel)
+        aligned = []
+        for tp_rows, tp_col in [(first_rows, first_col), (second_rows, second_col)]:
+            tp_values = np.fromiter((voxel[0][2] for voxel in tp_col.values()), dtype=np.float64, count=len(tp_col))
+            row_idxs = top_row - tp_rows
+            in_range = row_idxs < len(rows)
+            values = np.full(len(rows), np.nan)
+            values[row_idxs[in_range]] = tp_values[in_range]
+            present = np.zeros(len(rows), dtype=bool)
+            present[row_idxs[in_range]] = True
+            aligned.append((values, present))
+        (first_values, first_present), (second_values, second_present) = aligned
+        # Change and missing data of every row
+        changes = second_values - first_values
+        missing = ~(first_present & second_present)
+        # Segment the rows into events
+        column_starts = np.zeros(len(rows), dtype=bool)
+        column_starts[:1] = True
+        event_numbers = get_event_numbers(missing, changes, column_starts)
+        # Value of every row: the change, or the timepoints missing it
+        row_values = changes.tolist()
+        for row_idx in np.flatnonzero(missing).tolist():
+            row_values[row_idx] = [timepoint for timepoint, present in [(first_tp, first_present[row_idx]),
+                                                                        (second_tp, second_present[row_idx])]
+                                   if not present]
+        # Dictionary for results (event number: {row: value}), one slice of the rows per event
         results_dict = {}
-        # List of all Z coordinates from both timepoints
-        vox_z_list = []
-        # For each timepoint
-        for timepoint in [first_col, second_col]:
-            # For each voxel z in the timepoint
-            for vox_z in timepoint.keys():
-                # If the key is not in the list
-                if vox_z not in vox_z_list:
-                    # Add it as integer
-                    vox_z_list.append(int(vox_z))
-
-        # Starting current event
-        curr_event = EventParser()
-
-        # Sorted voxel list
-        sorted_vox_z = list(range(max(vox_z_list), min(vox_z_list) + 1, -1))
-
-        # First voxel switch
-        first_voxel = True
-        last_missing = False
-
-        while sorted_vox_z:
-            # Pop the next value
-            curr_vox_z = str(sorted_vox_z.pop(0))
-            # If the row is not in both timepoints
-            if curr_vox_z not in first_col.keys() or curr_vox_z not in second_col.keys():
-                # If this is the first voxel
-                if first_voxel:
-                    # Flip switch
-                    first_voxel = False
-                # Otherwise (not first voxel)
-                else:
-                    # Increment event counter
-                    curr_event.count += 1
-                # If there is no dictionary for the event
-                if curr_event.count not in results_dict.keys():
-                    # Set up a dictionary for it
-                    results_dict[curr_event.count] = {}
-                results_dict[curr_event.count][curr_vox_z] = []
-                # If the row is not in the timepoint 1
-                if curr_vox_z not in first_col.keys():
-                    # Append the timepoint
-                    results_dict[curr_event.count][curr_vox_z].append(first_tp)
-                # If the row is not in the timepoint 2
-                if curr_vox_z not in second_col.keys():
-                    # Append the timepoint
-                    results_dict[curr_event.count][curr_vox_z].append(second_tp)
-                # (Re)set change to None
-                curr_event.type = None
-                # Set Last Missing to True
-                last_missing = True
-                # Skip the rest of the loop
-                continue
-            # Derive the change
-            change = second_col[curr_vox_z][0][2] - first_col[curr_vox_z][0][2]
-            # If the ongoing event matches the change
-            if self.event_matches_change(curr_event, change):
-                # If the last change was missing value(s)
-                if last_missing:
-                    # Flip switch
-                    last_missing = False
-                    # Increment event
-                    curr_event.count += 1
-                # If there is no dictionary for the event
-                if curr_event.count not in results_dict.keys():
-                    # Set up a dictionary for it
-                    results_dict[curr_event.count] = {}
-                # Record the voxel and change to the event
-                results_dict[curr_event.count][curr_vox_z] = change
-            # Otherwise (ongoing event does not match change)
-            else:
-                # If this is the first voxel
-                if first_voxel:
-                    # Flip switch
-                    first_voxel = False
-                # Otherwise (not first voxel)
-                else:
-                    # Increment event counter
-                    curr_event.count += 1
-                # If there is no dictionary for the event
-                if curr_event.count not in results_dict.keys():
-                    # Set up a dictionary for it
-                    results_dict[curr_event.count] = {}
-                # Add the voxel and change to the current event
-                results_dict[curr_event.count][curr_vox_z] = change
-            # If first voxel still active
-            if first_voxel:
-                # Flip switch
-                first_voxel = False
+        row_keys = list(map(str, rows.tolist()))
+        bounds = [0] + (np.flatnonzero(np.diff(event_numbers)) + 1).tolist() + [len(rows)]
+        for event_start, event_end in zip(bounds[:-1], bounds[1:]):
+            results_dict[int(event_numbers[event_start])] = dict(zip(row_keys[event_start:event_end],
+                                                                     row_values[event_start:event_end]))
         # Return the results dictionary
         return results_dict
 
@@ -539,8 +1225,12 @@ class Grid:
 
     def json_to_visualization_file(self, file_path):
 
-        with open(file_path, 'r') as f:
-            input_dict = json.load(f)
+        # Load the slice/timepoint result as dense arrays (the file is named {slice}_{timepoint}.json)
+        slice_name, timepoint_name = file_path.stem.rsplit('_', 1)
+        dense = self.load_dense_timepoint(file_path.parent, slice_name, timepoint_name)
+        # Occupied voxels and their distance stats
+        vox_xs, vox_zs = dense.get_voxel_coords()
+        distance_rows = dense.distance[dense.occupied]
 
         # Visualization directory path
         vis_dir = Path(f'F:/UMB/Geomorphology/output/visualization')
@@ -563,107 +1253,143 @@ class Grid:
             with open(output_path, 'w') as of:
                 # Write header line
                 of.write(f'X, Y, Z, stdev, covar')
-                # For each voxel x
-                for vox_x in input_dict['Voxels'].keys():
-                    for vox_z in input_dict['Voxels'][vox_x].keys():
-                        distance_stats = input_dict['Voxels'][vox_x][vox_z][0]
-                        # write the line
-                        of.write(f'\n{(int(vox_x) * self.voxel_size) + (self.voxel_size / 2)}, '
-                                 f'{distance_stats[stat_ind]}, '
-                                 f'{(int(vox_z) * self.voxel_size) + (self.voxel_size / 2)}, '
-                                 f'{distance_stats[4]}, {distance_stats[4] / distance_stats[2]}')
-
+                # For each voxel
+                for vox_x, vox_z, distance_stats in zip(vox_xs.tolist(), vox_zs.tolist(), distance_rows.tolist()):
+                    # write the line
+                    of.write(f'\n{(int(vox_x) * self.voxel_size) + (self.voxel_size / 2)}, '
+                             f'{distance_stats[stat_ind]}, '
+                             f'{(int(vox_z) * self.voxel_size) + (self.voxel_size / 2)}, '
+                             f'{distance_stats[4]}, {distance_stats[4] / distance_stats[2]}')
+
+    # Load the events for a slice and timepoint pair into the event table
     def load_events(self, slice, first_tp, second_tp):
         # Order the timepoints correctly
         first_tp, second_tp = self.order_timepoints(first_tp, second_tp)
+        # If they are already loaded
+        if self.events.has_results(slice, first_tp, second_tp):
+            # Nothing to do
+            return
+        # Derive them if they do not exist yet
+        self.materialize_pairs([(slice, first_tp, second_tp)])
         # Assemble the directory path
         dir_path = Path(self.input_path.parents[1], 'output', self.name, 'change', 'slice_timepoint_pairs')
-        # Assemble the file path
-        file_path = Path(dir_path, f'{slice}_{first_tp}_{second_tp}.json')
-        # Open the file
-        with open(file_path, mode='r') as f:
-            # Retrieve the dictionary
-            input_dict = json.load(f)
-        # For each column in the input dictionary
-        for col in input_dict.keys():
-            # For each event in the column
-            for event_number in input_dict[col].keys():
-                # Get the first voxel key
-                first_voxel_key = list(input_dict[col][event_number].keys())[0]
-                # If there is a list in the event (i.e. there were missing data)
-                if isinstance(input_dict[col][event_number][first_voxel_key], list):
-                    # Create a MissingObservation object
-                    new_obs = MissingObservation()
-                    # Transfer the values
-                    new_obs.voxels = input_dict[col][event_number]
-                    # Store the object
-                    if col not in self.voxels.keys():
-                        self.voxels[col] = {}
-                    self.voxels[col][event_number] = new_obs
-                # If it was a gain or loss event
-                else:
-                    # Create an Event object
-                    new_event = Event()
-                    # Transfer the values
-                    new_event.voxels = input_dict[col][event_number]
-                    new_event.grid = self
-                    new_event.timepoints = [first_tp, second_tp]
-                    # If it is a gain event
-                    if new_event.voxels[first_voxel_key] > 0:
-                        new_event.type = 'Gain'
-                    elif new_event.voxels[first_voxel_key] < 0:
-                        new_event.type = 'Loss'
-                    else:
-                        new_event.type = 'No Change'
-                    # Store the object
-                    if col not in self.voxels.keys():
-                        self.voxels[col] = {}
-                    self.voxels[col][event_number] = new_event
+        # Load the results (columnar if migrated, otherwise read from the JSON one column at a time)
+        pair_columns = c_columnar.load_pair_results(dir_path, slice, first_tp, second_tp)
+        # Add the events and missing data to the table
+        self.events.add_pair_columns(pair_columns, self.voxel_size)
+
+    # Load the events for a list of (slice, first_tp, second_tp) requests, reading and decoding the files on a pool of
+    # workers (threads, or processes when JSON decoding dominates). At most prefetch files are read ahead of the
+    # table, and they are added in request order, so the table is the same as loading them one by one.
+    # table: c_event_table.EventTable to load into (the grid's event table if None)
+    def load_events_batch(self, event_requests, workers=4, use_processes=False, prefetch=None, table=None):
+        # Table to load into
+        if table is None:
+            table = self.events
+        # Assemble the directory path
+        dir_path = Path(self.input_path.parents[1], 'output', self.name, 'change', 'slice_timepoint_pairs')
+        # Requests that are not loaded yet (timepoints ordered, duplicates dropped, in the order given)
+        load_requests = []
+        for slice, first_tp, second_tp in event_requests:
+            first_tp, second_tp = self.order_timepoints(first_tp, second_tp)
+            if not table.has_results(slice, first_tp, second_tp):
+                load_requests.append((slice, first_tp, second_tp))
+        load_requests = list(dict.fromkeys(load_requests))
+        # Derive the pairs that do not exist yet
+        self.materialize_pairs(load_requests)
+        # Files read ahead of the table
+        prefetch = prefetch or workers * 2
+        pending = deque()
+        # Make the pool
+        executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        with executor_class(max_workers=workers) as executor:
+            for slice, first_tp, second_tp in load_requests:
+                # Submit the file
+                pending.append(executor.submit(c_columnar.load_pair_results, dir_path, slice, first_tp, second_tp))
+                # If enough files are read ahead, add the oldest to the table
+                if len(pending) >= prefetch:
+                    table.add_pair_columns(pending.popleft().result(), self.voxel_size)
+            # Add the rest
+            while pending:
+                table.add_pair_columns(pending.popleft().result(), self.voxel_size)
+
+    # Height profile of event volume (c_volume_profile.VolumeProfile) for slices and timepoint pairs, loaded from
+    # the change directory if a saved one covers them and was built from the current versions of their results,
+    # otherwise built from their events (and the saved profile's other slices and pairs) and saved
+    def get_volume_profile(self, slice_list, timepoint_pairs):
+        # Order the timepoints correctly
+        timepoint_pairs = [self.order_timepoints(first_tp, second_tp) for first_tp, second_tp in timepoint_pairs]
+        # Assemble the paths
+        dir_path = Path(self.input_path.parents[1], 'output', self.name, 'change', 'slice_timepoint_pairs')
+        profile_path = Path(self.input_path.parents[1], 'output', self.name, 'change',
+                            f'volume_profile{c_columnar.COLUMNS_SUFFIX}')
+        # Derive the pairs that do not exist yet
+        self.materialize_pairs([(slice, first_tp, second_tp) for first_tp, second_tp in timepoint_pairs
+                                for slice in slice_list])
+        # Keys of the pairs' current results
+        source_keys = {f'{slice}_{first_tp}_{second_tp}': c_columnar.get_source_key(
+            c_columnar.get_pair_source(dir_path, slice, first_tp, second_tp))
+            for first_tp, second_tp in timepoint_pairs for slice in slice_list}
+        # If there is a saved profile
+        if exists(Path(profile_path, 'header.json')):
+            profile = c_volume_profile.VolumeProfile.load(profile_path)
+            # If it covers the slices and pairs and is current for them
+            if profile.covers(slice_list, timepoint_pairs) and profile.voxel_size == self.voxel_size and \
+                    all(profile.source_keys.get(pair_name) == source_key
+                        for pair_name, source_key in source_keys.items()):
+                return profile
+            # Otherwise, include its slices and pairs in the new one
+            slice_list = list(dict.fromkeys(chain(profile.slice_names, slice_list)))
+            timepoint_pairs = list(dict.fromkeys(chain(profile.pairs, timepoint_pairs)))
+        # Requests for every slice and pair of the profile
+        event_requests = [(slice, first_tp, second_tp) for first_tp, second_tp in timepoint_pairs
+                          for slice in slice_list]
+        # Load their events into a table of their own (so the profile holds only them)
+        table = c_event_table.EventTable()
+        self.load_events_batch(event_requests, table=table)
+        # Build the profile from the events, with the keys of the results they were loaded from, and save it
+        profile = c_volume_profile.VolumeProfile.from_event_table(table)
+        profile.source_keys = {f'{slice}_{first_tp}_{second_tp}': c_columnar.get_source_key(
+            c_columnar.get_pair_source(dir_path, slice, first_tp, second_tp))
+            for slice, first_tp, second_tp in event_requests}
+        profile.save(profile_path)
+        return profile
+
+    # Event object for an event in the event table (for per-event plotting)
+    def get_event(self, event_idx):
+        # Reference the event record
+        event_record = self.events.events[event_idx]
+        # Create an Event object
+        new_event = Event()
+        # Transfer the values
+        rows, changes = self.events.get_event_voxels(event_idx)
+        new_event.voxels = {str(row): change for row, change in zip(rows.tolist(), changes.tolist())}
+        new_event.grid = self
+        new_event.timepoints = list(self.events.pairs[event_record['pair']])
+        new_event.type = c_event_table.TYPE_NAMES[int(event_record['type'])]
+        return new_event
 
     def get_mean_event_count_per_col(self):
-        # Event counts
-        event_counts = []
-        # For each column
-        for col_key in self.voxels.keys():
-            event_counts.append(len(list(self.voxels[col_key].keys())))
-        # Return the mean
-        return np.mean(event_counts)
+        # Return the mean of the event counts for each column (of each slice and pair)
+        return np.mean(self.events.get_event_counts_per_col())
 
     def get_median_event_count_per_col(self):
-        # Event counts
-        event_counts = []
-        # For each column
-        for col_key in self.voxels.keys():
-            event_counts.append(len(list(self.voxels[col_key].keys())))
-        # Return the median
-        return np.median(event_counts)
+        # Return the median of the event counts for each column (of each slice and pair)
+        return np.median(self.events.get_event_counts_per_col())
 
     def get_event_summary(self, slice, first_tp, second_tp):
         # Make sure the timepoints are ordered correctly
         first_tp, second_tp = self.order_timepoints(first_tp, second_tp)
+        # Events for the slice and pair
+        event_types = self.events.events['type'][self.events.select(slice, first_tp, second_tp)]
         # Counts
-        gain_count = 0
-        loss_count = 0
-        no_change_count = 0
-        missing_data_count = 0
-        # For each col
-        for col in self.voxels.keys():
-            # For each event number
-            for event_number in self.voxels[col].keys():
-                # Get event obj
-                curr_event = self.voxels[col][event_number]
-                # If it's a MissingObservation obj
-                if isinstance(curr_event, MissingObservation):
-                    missing_data_count += len(list(curr_event.voxels.keys()))
-                    # Skip the rest of the loop
-                    continue
-                # If it's gain
-                if curr_event.type == 'Gain':
-                    gain_count += 1
-                elif curr_event.type == 'Loss':
-                    loss_count += 1
-                elif curr_event.type == 'No Change':
-                    no_change_count += 1
+        gain_count = np.count_nonzero(event_types == c_event_table.GAIN)
+        loss_count = np.count_nonzero(event_types == c_event_table.LOSS)
+        no_change_count = np.count_nonzero(event_types == c_event_table.NO_CHANGE)
+        # Missing voxels for the slice and pair
+        missing_data_count = np.count_nonzero(self.events.select(slice, first_tp, second_tp,
+                                                                 records=self.events.missing) &
+                                              (self.events.missing['row'] != c_event_table.WHOLE_COLUMN))
 
         # Print a summary
         print(f'For slice {slice} change ({second_tp} - {first_tp}).')
@@ -673,54 +1399,33 @@ class Grid:
     def visualize_events(self, slice, first_tp, second_tp):
         # Make sure the timepoints are ordered correctly
         first_tp, second_tp = self.order_timepoints(first_tp, second_tp)
-        # Mins and maxes
-        min_row = None
-        max_row = None
-        min_col = None
-        max_col = None
-
-        # Get row and col extents
-        for col in self.voxels.keys():
-            if min_col is None:
-                min_col = int(col)
-            elif int(col) < min_col:
-                min_col = int(col)
-            if max_col is None:
-                max_col = int(col)
-            elif int(col) > max_col:
-                max_col = int(col)
-            for event_number in self.voxels[col].keys():
-                for row in self.voxels[col][event_number].voxels.keys():
-                    if min_row is None:
-                        min_row = int(row)
-                    elif int(row) < min_row:
-                        min_row = int(row)
-                    if max_row is None:
-                        max_row = int(row)
-                    elif int(row) > max_row:
-                        max_row = int(row)
-
-        # Visualization array
+        # Voxels of the slice and pair's events
+        voxel_events = self.events.get_voxel_event_index()
+        voxel_mask = self.events.select(slice, first_tp, second_tp)[voxel_events]
+        event_rows = self.events.voxel_rows[voxel_mask]
+        event_cols = self.events.events['col'][voxel_events[voxel_mask]]
+        event_types = self.events.events['type'][voxel_events[voxel_mask]]
+        event_changes = self.events.voxel_changes[voxel_mask]
+        # Missing voxels of the slice and pair
+        missing = self.events.missing[self.events.select(slice, first_tp, second_tp, records=self.events.missing) &
+                                      (self.events.missing['row'] != c_event_table.WHOLE_COLUMN)]
+
+        # Get row and col extents (of events and missing voxels)
+        all_rows = np.concatenate((event_rows, missing['row']))
+        all_cols = np.concatenate((event_cols, missing['col']))
+        min_row, max_row = int(all_rows.min()), int(all_rows.max())
+        min_col, max_col = int(all_cols.min()), int(all_cols.max())
+
+        # Visualization array (1 for gain, -1 for loss, 0 otherwise)
         vis_arr = np.zeros(((max_row - min_row) + 1, (max_col - min_col) + 1))
 
         change_arr = np.zeros(((max_row - min_row) + 1, (max_col - min_col) + 1))
 
-        # Get row and col extents
-        for col in self.voxels.keys():
-            for event_number in self.voxels[col].keys():
-                # Get the object
-                curr_obj = self.voxels[col][event_number]
-                if isinstance(curr_obj, Event):
-                    for row in self.voxels[col][event_number].voxels.keys():
-                        array_row = (max_row - min_row) - (int(row) - min_row)
-                        array_col = int(col) - min_col
-                        if curr_obj.type == 'Gain':
-                            vis_arr[array_row, array_col] = 1
-                        elif curr_obj.type == 'Loss':
-                            vis_arr[array_row, array_col] = -1
-                        else:
-                            vis_arr[array_row, array_col] = 0
-                        change_arr[array_row, array_col] = curr_obj.voxels[row]
+        # Array rows (top row first) and columns of the event voxels
+        array_rows = (max_row - min_row) - (event_rows - min_row)
+        array_cols = event_cols - min_col
+        vis_arr[array_rows, array_cols] = event_types
+        change_arr[array_rows, array_cols] = event_changes
         # Make a figure
         fig = plt.figure(figsize=(12, 12))
         # Make some space between the subplots4.
@@ -753,119 +1458,101 @@ class Grid:
 
         plt.show()
 
-    def visualize_change_profile(self, x_co):
+    def visualize_change_profile(self, x_co, slice=None, first_tp=None, second_tp=None):
         # Make a figure
         fig = plt.figure(figsize=(12, 12))
         # Start a subplot
         ax = fig.add_subplot(1, 1, 1)
 
-        max_row = None
-        min_row = None
+        # Events in the col (optionally for one slice and pair)
+        event_idxs = np.flatnonzero(self.events.select(slice, first_tp, second_tp, col=x_co))
+        # Rows of all of the events
+        all_rows = np.concatenate([self.events.get_event_voxels(event_idx)[0] for event_idx in event_idxs])
+        max_row = int(all_rows.max())
+        min_row = int(all_rows.min())
 
         # For each event in the col
-        for event_number in self.voxels[x_co].keys():
-            # Reference the event
-            curr_event = self.voxels[x_co][event_number]
-            # If the event is a missing observation
-            if isinstance(curr_event, MissingObservation):
-                # Set the color for the patch
-                color = 'k'
-                # Skip it
-                continue
-
-            elif isinstance(curr_event, Event):
-                # For each voxel in the path (row)
-                for row in curr_event.voxels.keys():
-                    if max_row is None:
-                        max_row = int(row)
-                    elif int(row) > max_row:
-                        max_row = int(row)
-                    if min_row is None:
-                        min_row = int(row)
-                    elif int(row) < min_row:
-                        min_row = int(row)
-                    # Get change volume
-                    curr_vol = self.get_voxel_volume(curr_event.voxels[row])
-                    # If event is a gain
-                    if curr_event.type == 'Gain':
-                        # Add the patch to the plot
-                        curr_patch = mpl.patches.Rectangle((0, int(row) - 0.5),
-                                                           width=curr_vol,
-                                                           height=1,
-                                                           fill=True,
-                                                           facecolor='b')
-                    # Otherwise, if it's a loss
-                    elif curr_event.type == 'Loss':
-                        # Add the patch to the plot
-                        curr_patch = mpl.patches.Rectangle((0 + curr_vol, int(row) - 0.5),
-                                                           width=abs(curr_vol),
-                                                           height=1,
-                                                           fill=True,
-                                                           facecolor='r')
-                    ax.add_patch(curr_patch)
+        for event_idx in event_idxs:
+            # Reference the event type
+            event_type = self.events.events['type'][event_idx]
+            # For each voxel in the path (row)
+            for row, change in zip(*self.events.get_event_voxels(event_idx)):
+                # Get change volume
+                curr_vol = self.get_voxel_volume(change)
+                # If event is a gain
+                if event_type == c_event_table.GAIN:
+                    # Add the patch to the plot
+                    curr_patch = mpl.patches.Rectangle((0, int(row) - 0.5),
+                                                       width=curr_vol,
+                                                       height=1,
+                                                       fill=True,
+                                                       facecolor='b')
+                # Otherwise, if it's a loss
+                elif event_type == c_event_table.LOSS:
+                    # Add the patch to the plot
+                    curr_patch = mpl.patches.Rectangle((0 + curr_vol, int(row) - 0.5),
+                                                       width=abs(curr_vol),
+                                                       height=1,
+                                                       fill=True,
+                                                       facecolor='r')
+                # No change
+                else:
+                    continue
+                ax.add_patch(curr_patch)
 
         ax.plot((0, 0), (max_row, min_row), 'k')
 
         plt.show()
 
-    def visualize_cumulative_profile(self, x_co):
+    def visualize_cumulative_profile(self, x_co, slice=None, first_tp=None, second_tp=None):
 
         # Make a figure
         fig = plt.figure(figsize=(12, 12))
         # Start a subplot
         ax = fig.add_subplot(1, 1, 1)
 
-        max_row = None
-        min_row = None
+        # Events in the col (optionally for one slice and pair), in event number order
+        event_idxs = np.flatnonzero(self.events.select(slice, first_tp, second_tp, col=x_co))
+        event_idxs = event_idxs[np.argsort(self.events.events['event'][event_idxs], kind='stable')]
+        # Rows of all of the events
+        all_rows = np.concatenate([self.events.get_event_voxels(event_idx)[0] for event_idx in event_idxs])
+        max_row = int(all_rows.max())
+        min_row = int(all_rows.min())
 
         # Current cumulative change
         curr_change = 0
 
         # For each event in the col
-        for event_number in sorted(self.voxels[x_co].keys(), key=int):
-            # Reference the event
-            curr_event = self.voxels[x_co][event_number]
-            # If the event is a missing observation
-            if isinstance(curr_event, MissingObservation):
-                # Set the color for the patch
-                color = 'k'
-                # Skip it
-                continue
-
-            elif isinstance(curr_event, Event):
-                # For each voxel in the path (row)
-                for row in curr_event.voxels.keys():
-                    if max_row is None:
-                        max_row = int(row)
-                    elif int(row) > max_row:
-                        max_row = int(row)
-                    if min_row is None:
-                        min_row = int(row)
-                    elif int(row) < min_row:
-                        min_row = int(row)
-                # For each row (sorted top to bottom)
-                for row in sorted(curr_event.voxels.keys(), key=int, reverse=True):
-                    # Update current change
-                    curr_change += curr_event.voxels[row]
-                    # Get volume
-                    curr_vol = self.get_voxel_volume(curr_change)
-                    # If we are in cumulative gain (change > 0)
-                    if curr_change > 0:
-                        # Add the patch to the plot
-                        curr_patch = mpl.patches.Rectangle((0, int(row) - 0.5),
-                                                           width=curr_vol,
-                                                           height=1,
-                                                           fill=True,
-                                                           facecolor='b')
-                    # Otherwise, if it's a loss
-                    elif curr_change < 0:
-                        # Add the patch to the plot
-                        curr_patch = mpl.patches.Rectangle((0 + curr_vol, int(row) - 0.5),
-                                                           width=abs(curr_vol),
-                                                           height=1,
-                                                           fill=True,
-                                                           facecolor='r')
-                    ax.add_patch(curr_patch)
+        for event_idx in event_idxs:
+            # Rows and changes of the event
+            rows, changes = self.events.get_event_voxels(event_idx)
+            # For each row (sorted top to bottom)
+            for voxel_idx in np.argsort(-rows, kind='stable'):
+                row = rows[voxel_idx]
+                # Update current change
+                curr_change += changes[voxel_idx]
+                # Get volume
+                curr_vol = self.get_voxel_volume(curr_change)
+                # If we are in cumulative gain (change > 0)
+                if curr_change > 0:
+                    # Add the patch to the plot
+                    curr_patch = mpl.patches.Rectangle((0, int(row) - 0.5),
+                                                       width=curr_vol,
+                                                       height=1,
+                                                       fill=True,
+                                                       facecolor='b')
+                # Otherwise, if it's a loss
+                elif curr_change < 0:
+                    # Add the patch to the plot
+                    curr_patch = mpl.patches.Rectangle((0 + curr_vol, int(row) - 0.5),
+                                                       width=abs(curr_vol),
+                                                       height=1,
+                                                       fill=True,
+                                                       facecolor='r')
+                # No cumulative change
+                else:
+                    continue
+                ax.add_patch(curr_patch)
 
         ax.plot((0, 0), (max_row, min_row), 'k')
 
@@ -875,6 +1562,25 @@ class Grid:
         return dimension * (self.voxel_size ** 2)
 
 
+# Worker for Grid.process_point_cloud_ranges. Parses one byte range into a partial grid and returns its voxels
+def process_byte_range(task):
+    # Split out the information from the task
+    grid_class, voxel_size, offsets, stats_mode, sketch_settings, file_path, start, end, has_reflectance, \
+        timepoint_name, scan_name = task
+    # Make a Grid object (of the same class) for the partial aggregate (no specification needed)
+    grid = grid_class(stats_mode=stats_mode, median_error=sketch_settings[0], max_buckets=sketch_settings[1])
+    grid.voxel_size = voxel_size
+    grid.x_offset, grid.y_offset, grid.z_offset = offsets
+    # Create Timepoint
+    grid.add_timepoint(timepoint_name)
+    # Iterate over the chunks of the range
+    for coords, reflectance in grid.yield_point_chunks_in_range(file_path, start, end, has_reflectance):
+        # Bin the chunk into the voxels
+        grid.add_point_chunk(timepoint_name, scan_name, coords, reflectance)
+    # Return the voxels
+    return grid.voxels
+
+
 class Timepoint:
 
     def __init__(self, name):
@@ -884,6 +1590,8 @@ class Timepoint:
         # Dictionary of scans for the timepoint
         self.scans = {}
         self.voxels = None
+        # Columnar slice/timepoint result (c_columnar.SliceTimepointColumns), used instead of voxels if loaded
+        self.columns = None
         self.grid = None
 
     # Add a scan (with a name)
@@ -899,6 +1607,12 @@ class Timepoint:
         new_scan.timepoint = self
         self.scans[name] = new_scan
 
+    # (vox_x, vox_z, mean distance) arrays of the timepoint's voxels
+    def get_voxel_arrays(self):
+        if self.columns is not None:
+            return self.columns.vox_x, self.columns.vox_z, self.columns.distance[:, 2]
+        return c_change_raster.get_voxel_arrays(self.voxels)
+
 
 class Scan:
 
@@ -933,10 +1647,36 @@ class Voxel:
             #logging.warning(f'Timepoint {timepoint.name} already exists in voxel X:{self.x}, Z:{self.z}. Skipping it.')
             # End the process
             return
+        # If the grid accumulates values in streaming mode
+        if timepoint.grid is not None and timepoint.grid.stats_mode == 'streaming':
+            # Add a subdictionary of streaming accumulators for distance and reflectance
+            self.stats_by_timepoint[timepoint.name] = {
+                'distance': timepoint.grid.make_streaming_generator('distance'),
+                'reflectance': timepoint.grid.make_streaming_generator('reflectance')}
+            # End the process
+            return
         # Otherwise, add a subdictionary for distance and reflectance
         self.stats_by_timepoint[timepoint.name] = {'distance': VoxelStatsGenerator(),
                                                    'reflectance': VoxelStatsGenerator()}
 
+    # Merge another voxel's (not yet summarized) values and scan counts into this voxel
+    def merge(self, other):
+        # For each timepoint in the other voxel
+        for timepoint in other.stats_by_timepoint.keys():
+            # If the timepoint is not in this voxel
+            if timepoint not in self.stats_by_timepoint.keys():
+                # Take the other voxel's stat generators
+                self.stats_by_timepoint[timepoint] = other.stats_by_timepoint[timepoint]
+                continue
+            # For each set of stats
+            for stats_set in other.stats_by_timepoint[timepoint].keys():
+                # Merge the stat generators
+                self.stats_by_timepoint[timepoint][stats_set].merge(other.stats_by_timepoint[timepoint][stats_set])
+        # For each scan in the other voxel
+        for scan_name in other.scans.keys():
+            # Add to the point count for the scan
+            self.scans[scan_name] = self.scans.get(scan_name, 0) + other.scans[scan_name]
+
     # Generate summary statistics from the VoxelStatsGenerator objects
     def generate_summary_stats(self):
         # For each timepoint in the voxel
@@ -944,15 +1684,21 @@ class Voxel:
             # For each set of stats
             for stats_set in self.stats_by_timepoint[timepoint].keys():
                 # If the stats has no entries (the file had no reflectance)
-                if len(self.stats_by_timepoint[timepoint][stats_set].values) == 0:
+                if self.stats_by_timepoint[timepoint][stats_set].get_count() == 0:
                     # Point to None
                     self.stats_by_timepoint[timepoint][stats_set] = None
                     # Skip the loop
                     continue
                 # Create a new VoxelStats object
                 vox_stats = VoxelStats()
-                # Populate the stats object
-                vox_stats.populate(self.stats_by_timepoint[timepoint][stats_set])
+                # If the stats were accumulated in streaming mode
+                if isinstance(self.stats_by_timepoint[timepoint][stats_set], StreamingVoxelStatsGenerator):
+                    # Populate the stats object from the accumulator
+                    vox_stats.populate_from_accumulator(self.stats_by_timepoint[timepoint][stats_set])
+                # Otherwise (exact mode)
+                else:
+                    # Populate the stats object
+                    vox_stats.populate(self.stats_by_timepoint[timepoint][stats_set])
                 # Replace the reference to the object
                 self.stats_by_timepoint[timepoint][stats_set] = vox_stats
 
@@ -988,6 +1734,187 @@ class VoxelStatsGenerator:
 
         self.values = []
 
+    # Add an array of values
+    def add_values(self, values):
+        self.values.extend(values.tolist())
+
+    # Merge another VoxelStatsGenerator into this one
+    def merge(self, other):
+        self.values.extend(other.values)
+
+    # Number of values added
+    def get_count(self):
+        return len(self.values)
+
+
+# Bounded-memory alternative to VoxelStatsGenerator. Keeps running moments (Welford) and a quantile
+# sketch instead of every value, so it can be merged with others and never grows with the point count
+class StreamingVoxelStatsGenerator:
+
+    def __init__(self, median_error=0.001, max_buckets=4096):
+
+        # Number of (non-NaN) values added
+        self.count = 0
+        # Running mean and sum of squared deviations from the mean
+        self.mean = 0.0
+        self.m2 = 0.0
+        # Running extremes
+        self.min = None
+        self.max = None
+        # Sketch for the median
+        self.sketch = QuantileSketch(median_error, max_buckets)
+
+    # Add an array of values
+    def add_values(self, values):
+        # Drop NaN values (to match the nan* functions)
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        # If there is nothing to add
+        if len(values) == 0:
+            return
+        # Moments of the new batch
+        batch_mean = float(np.mean(values))
+        batch_m2 = float(np.sum((values - batch_mean) ** 2))
+        # Combine them with the running moments
+        self.combine_moments(len(values), batch_mean, batch_m2, float(np.min(values)), float(np.max(values)))
+        # Add the values to the sketch
+        self.sketch.add_values(values)
+
+    # Merge another streaming accumulator into this one
+    def merge(self, other):
+        # If the other accumulator is empty
+        if other.count == 0:
+            return
+        # Combine the moments
+        self.combine_moments(other.count, other.mean, other.m2, other.min, other.max)
+        # Merge the sketches
+        self.sketch.merge(other.sketch)
+
+    # Combine a batch's moments with the running moments (Chan et al. parallel form of Welford's update)
+    def combine_moments(self, batch_count, batch_mean, batch_m2, batch_min, batch_max):
+        # Total count
+        total = self.count + batch_count
+        # Difference between the means
+        delta = batch_mean - self.mean
+        # Update the mean and sum of squared deviations
+        self.mean += delta * batch_count / total
+        self.m2 += batch_m2 + delta ** 2 * self.count * batch_count / total
+        self.count = total
+        # Update the extremes
+        self.min = batch_min if self.min is None else min(self.min, batch_min)
+        self.max = batch_max if self.max is None else max(self.max, batch_max)
+
+    # Number of values added
+    def get_count(self):
+        return self.count
+
+    # Population standard deviation (as numpy.nanstd)
+    def get_stdev(self):
+        return np.sqrt(self.m2 / self.count)
+
+
+# Fixed-width histogram sketch for quantiles. Values are counted in buckets of width 2 * error, so a quantile
+# is reported to within error of the true value (and never outside the observed min and max). If a sketch exceeds
+# max_buckets, neighbouring buckets are merged to keep memory bounded, which doubles the width and the error bound
+# (get_error returns the bound actually achieved; Grid.generate_summary_stats warns once for the grid)
+class QuantileSketch:
+
+    def __init__(self, error=0.001, max_buckets=4096):
+
+        # Requested error bound and bucket width
+        self.error = error
+        self.width = 2 * error
+        # Observed extremes (quantiles are clamped to them)
+        self.min = None
+        self.max = None
+        # Maximum number of buckets kept
+        self.max_buckets = max_buckets
+        # Dictionary of bucket index: count
+        self.buckets = {}
+        # Total count
+        self.count = 0
+
+    # Add an array of values
+    def add_values(self, values):
+        # If there is nothing to add
+        if len(values) == 0:
+            return
+        # Update the extremes
+        self.min = float(np.min(values)) if self.min is None else min(self.min, float(np.min(values)))
+        self.max = float(np.max(values)) if self.max is None else max(self.max, float(np.max(values)))
+        # Bucket index of each value
+        bucket_ids, bucket_counts = np.unique(np.floor(values / self.width).astype(np.int64), return_counts=True)
+        # Add the counts
+        for bucket_id, bucket_count in zip(bucket_ids.tolist(), bucket_counts.tolist()):
+            self.buckets[bucket_id] = self.buckets.get(bucket_id, 0) + bucket_count
+        self.count += len(values)
+        # Keep the sketch bounded
+        self.compact()
+
+    # Merge another sketch into this one
+    def merge(self, other):
+        # Bring both sketches to the coarser width
+        while self.width < other.width:
+            self.coarsen()
+        other_buckets = other.buckets
+        other_width = other.width
+        while other_width < self.width:
+            # Coarsen a copy of the other sketch's buckets
+            coarse_buckets = {}
+            for bucket_id, bucket_count in other_buckets.items():
+                coarse_buckets[bucket_id // 2] = coarse_buckets.get(bucket_id // 2, 0) + bucket_count
+            other_buckets = coarse_buckets
+            other_width *= 2
+        # Add the counts
+        for bucket_id, bucket_count in other_buckets.items():
+            self.buckets[bucket_id] = self.buckets.get(bucket_id, 0) + bucket_count
+        self.count += other.count
+        # Update the extremes
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        # Keep the sketch bounded
+        self.compact()
+
+    # Merge neighbouring buckets until the sketch is within max_buckets
+    def compact(self):
+        while len(self.buckets) > self.max_buckets:
+            self.coarsen()
+
+    # Error bound the sketch currently guarantees
+    def get_error(self):
+        return self.width / 2
+
+    # Double the bucket width
+    def coarsen(self):
+        coarse_buckets = {}
+        for bucket_id, bucket_count in self.buckets.items():
+            coarse_buckets[bucket_id // 2] = coarse_buckets.get(bucket_id // 2, 0) + bucket_count
+        self.buckets = coarse_buckets
+        self.width *= 2
+
+    # Value at a (zero-based) rank, as the centre of its bucket (clamped to the observed extremes)
+    def get_value_at_ranks(self, ranks):
+        # Sorted buckets and their cumulative counts
+        bucket_ids = np.array(sorted(self.buckets.keys()), dtype=np.int64)
+        cumulative = np.cumsum([self.buckets[bucket_id] for bucket_id in bucket_ids.tolist()])
+        # Bucket holding each rank
+        bucket_idx = np.searchsorted(cumulative, np.asarray(ranks) + 1)
+        # Return the bucket centres
+        return np.clip((bucket_ids[bucket_idx] + 0.5) * self.width, self.min, self.max)
+
+    # Linearly interpolated percentile (0-100)
+    def get_percentile(self, percentile):
+        # Fractional rank
+        position = (self.count - 1) * (percentile / 100)
+        lower, upper = self.get_value_at_ranks([int(np.floor(position)), int(np.ceil(position))])
+        # If the percentile is the median
+        if percentile == 50:
+            # Average the two middle values (as numpy.median)
+            return (lower + upper) / 2
+        # Interpolate between them
+        return lower + (upper - lower) * (position - np.floor(position))
+
 
 class VoxelStats:
 
@@ -998,18 +1925,44 @@ class VoxelStats:
         self.mean = None
         self.median = None
         self.stdev = None
+        # Optional percentiles keyed by percentile (not exported)
+        self.percentiles = {}
+        # Error bound of the median and percentiles (None when exact, otherwise the sketch's achieved bound)
+        self.median_error = None
 
     def coefficient_variation(self):
 
         return self.stdev / self.mean
 
     # Populate the statistics based on a VoxelStatsGenerator object as input
-    def populate(self, stats_generator):
-        self.min = np.nanmin(stats_generator.values)
-        self.max = np.nanmax(stats_generator.values)
-        self.mean = np.nanmean(stats_generator.values)
-        self.median = np.nanmedian(stats_generator.values)
-        self.stdev = np.nanstd(stats_generator.values)
+    def populate(self, stats_generator, percentiles=None):
+        # Compute the statistics for the single group of values
+        results = grouped_summary_stats(stats_generator.values, [len(stats_generator.values)], percentiles)
+        # Transfer the results
+        self.populate_from_results(results, 0, percentiles)
+
+    # Populate the statistics from a StreamingVoxelStatsGenerator object (median from its sketch)
+    def populate_from_accumulator(self, accumulator, percentiles=None):
+        self.min = accumulator.min
+        self.max = accumulator.max
+        self.mean = accumulator.mean
+        self.median = accumulator.sketch.get_percentile(50)
+        self.median_error = accumulator.sketch.get_error()
+        self.stdev = accumulator.get_stdev()
+        # For each percentile requested
+        for percentile in percentiles or []:
+            self.percentiles[percentile] = accumulator.sketch.get_percentile(percentile)
+
+    # Populate the statistics from one entry of the grouped_summary_stats results
+    def populate_from_results(self, results, idx, percentiles=None):
+        self.min = results['min'][idx]
+        self.max = results['max'][idx]
+        self.mean = results['mean'][idx]
+        self.median = results['median'][idx]
+        self.stdev = results['stdev'][idx]
+        # For each percentile requested
+        for percentile in percentiles or []:
+            self.percentiles[percentile] = results[f'p{percentile}'][idx]
 
     # Flatten for export to JSON
     def flatten(self):
@@ -1065,7 +2018,7 @@ class Event:
 
     def get_volume(self):
         # If volume is not set
-        if not self.volume:
+        if self.volume is None:
             # Set it
             self.set_volume()
         # Return the volume
@@ -1088,10 +2041,10 @@ class Event:
         return (row_total / len(list(self.voxels.keys()))) * self.grid.voxel_size
 
     def get_min_height(self):
-        return int(sorted(list(self.voxels.keys()), key=int)[0]) * self.grid.voxel_size
+        return min(int(row_key) for row_key in self.voxels.keys()) * self.grid.voxel_size
 
     def get_max_height(self):
-        return int(sorted(list(self.voxels.keys()), key=int)[-1]) * self.grid.voxel_size
+        return max(int(row_key) for row_key in self.voxels.keys()) * self.grid.voxel_size
 
     def get_height_range(self):
         return self.get_max_height() - self.get_min_height()
@@ -0,0 +1,165 @@
+import numpy as np
+
+# Fields that can be grouped by or aggregated (besides custom (name, array) pairs):
+# Both levels: pair, slice, type, col, event, height_bin
+# 'event' level: voxel_count, min_row, max_row, net_change and the EventTable.get_metrics fields
+#                (volume, mean_height, min_height, max_height, height_range, coeff_var), abs_volume
+# 'voxel' level: row, change, volume, abs_volume, height
+EVENT_KEY_FIELDS = ['pair', 'slice', 'type', 'col', 'event']
+
+
+# Values of the named fields for the rows (events or event voxels) of an EventTable, computed once each
+class EventFields:
+
+    def __init__(self, table, level='event', mask=None, bin_rows=1):
+
+        # Event table and the level of its rows ('event' or 'voxel')
+        self.table = table
+        self.level = level
+        # Rows per height bin
+        self.bin_rows = bin_rows
+        # Event of every row, and the rows to use
+        if level == 'event':
+            self.row_events = np.arange(len(table.events))
+            self.row_mask = np.ones(len(table.events), dtype=bool) if mask is None else mask
+        elif level == 'voxel':
+            self.row_events = table.get_voxel_event_index()
+            self.row_mask = np.ones(len(self.row_events), dtype=bool) if mask is None else mask[self.row_events]
+        else:
+            raise ValueError(f'Unknown aggregation level {level}.')
+        # Computed fields
+        self.cache = {}
+
+    # Values of a field for the used rows. field is a name, or a (name, array) pair with a value for every row
+    def get(self, field):
+        # Custom values
+        if isinstance(field, tuple):
+            return np.asarray(field[1])[self.row_mask]
+        # If it has been computed
+        if field in self.cache:
+            return self.cache[field]
+        # Compute it for all rows
+        events = self.table.events
+        if field in EVENT_KEY_FIELDS:
+            values = events[field][self.row_events]
+        elif self.level == 'event':
+            values = self.get_event_field(field)
+        else:
+            values = self.get_voxel_field(field)
+        # Cache the used rows
+        self.cache[field] = values[self.row_mask]
+        return self.cache[field]
+
+    # Values of an event-level field for every event
+    def get_event_field(self, field):
+        events = self.table.events
+        metrics = self.table.get_metrics()
+        if field in metrics:
+            return metrics[field]
+        if field == 'abs_volume':
+            return np.abs(metrics['volume'])
+        if field == 'height_bin':
+            return np.floor(events['mean_height'] / self.table.voxel_size / self.bin_rows)
+        if field in events.dtype.names:
+            return events[field]
+        raise ValueError(f'Unknown event field {field}.')
+
+    # Values of a voxel-level field for every event voxel
+    def get_voxel_field(self, field):
+        if field == 'row':
+            return self.table.voxel_rows
+        if field == 'change':
+            return self.table.voxel_changes
+        if field == 'volume':
+            return self.table.get_voxel_volumes()
+        if field == 'abs_volume':
+            return np.abs(self.table.get_voxel_volumes())
+        if field == 'height':
+            return self.table.voxel_rows * self.table.voxel_size
+        if field == 'height_bin':
+            return np.floor(self.table.voxel_rows / self.bin_rows)
+        raise ValueError(f'Unknown voxel field {field}.')
+
+
+# Group the rows (events, or event voxels) of an EventTable and run several aggregations over the groups at once.
+# group_by: list of fields (see EventFields), e.g. ['pair', 'type', 'height_bin']. Pair and slice are codes into
+#           table.pairs and table.slice_names
+# aggregations: dictionary of result name: (operation, field[, parameter[, weight field]]), where operation is
+#               'count' (no field needed), 'sum', 'mean', 'min', 'max', 'quantile' (parameter: a quantile or a
+#               list of them) or 'histogram' (parameter: bin edges, optionally weighted, e.g. by volume)
+# level: 'event' or 'voxel', mask: optional boolean mask over the events, bin_rows: rows per height bin
+# Returns a dictionary of the group keys (field: one value per group, groups in sorted key order) and a
+# dictionary of the results (name: one value, quantile list or histogram row per group)
+def aggregate_events(table, group_by, aggregations, level='event', mask=None, bin_rows=1):
+    # Field values for the rows
+    fields = EventFields(table, level, mask, bin_rows)
+    row_count = int(np.count_nonzero(fields.row_mask))
+    # Group of every row
+    key_names = [field[0] if isinstance(field, tuple) else field for field in group_by]
+    if group_by:
+        keys = np.empty(row_count, dtype=[(name, fields.get(field).dtype) for name, field in zip(key_names, group_by)])
+        for name, field in zip(key_names, group_by):
+            keys[name] = fields.get(field)
+        group_keys, row_groups = np.unique(keys, return_inverse=True)
+        row_groups = row_groups.reshape(-1)
+        groups = {name: group_keys[name] for name in key_names}
+    else:
+        row_groups = np.zeros(row_count, dtype=np.int64)
+        groups = {}
+    group_count = int(row_groups.max()) + 1 if row_count else 0
+    # Rows per group
+    counts = np.bincount(row_groups, minlength=group_count)
+    # Rows sorted by group then value, for the order statistics (one sort per field)
+    sorted_values = {}
+
+    def get_sorted(field):
+        name = field[0] if isinstance(field, tuple) else field
+        if name not in sorted_values:
+            values = fields.get(field)
+            sorted_values[name] = values[np.lexsort((values, row_groups))]
+        return sorted_values[name]
+
+    # Start of each group in the sorted rows
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1])) if group_count else np.empty(0, dtype=np.int64)
+    # Run each aggregation
+    results = {}
+    for result_name, aggregation in aggregations.items():
+        operation = aggregation[0]
+        if operation == 'count':
+            results[result_name] = counts
+        elif operation == 'sum':
+            results[result_name] = np.bincount(row_groups, weights=fields.get(aggregation[1]), minlength=group_count)
+        elif operation == 'mean':
+            sums = np.bincount(row_groups, weights=fields.get(aggregation[1]), minlength=group_count)
+            results[result_name] = sums / counts
+        elif operation in ('min', 'max'):
+            values = get_sorted(aggregation[1])
+            results[result_name] = values[starts] if operation == 'min' else values[starts + counts - 1]
+        elif operation == 'quantile':
+            values = get_sorted(aggregation[1])
+            quantiles = np.atleast_1d(aggregation[2])
+            # Linear interpolation between the closest ranks (as np.quantile)
+            positions = quantiles[np.newaxis, :] * (counts[:, np.newaxis] - 1)
+            lower = np.floor(positions).astype(np.int64)
+            upper = np.ceil(positions).astype(np.int64)
+            lower_values = values[starts[:, np.newaxis] + lower]
+            upper_values = values[starts[:, np.newaxis] + upper]
+            group_quantiles = lower_values + (upper_values - lower_values) * (positions - lower)
+            results[result_name] = group_quantiles if np.ndim(aggregation[2]) else group_quantiles[:, 0]
+        elif operation == 'histogram':
+            values = fields.get(aggregation[1])
+            edges = np.asarray(aggregation[2])
+            weights = fields.get(aggregation[3]) if len(aggregation) > 3 else None
+            # Bin of every row (the last bin includes its right edge, as np.histogram)
+            bins = np.searchsorted(edges, values, side='right') - 1
+            bins[values == edges[-1]] = len(edges) - 2
+            in_range = (bins >= 0) & (bins < len(edges) - 1)
+            flat_bins = row_groups[in_range] * (len(edges) - 1) + bins[in_range]
+            histograms = np.bincount(flat_bins,
+                                     weights=None if weights is None else weights[in_range],
+                                     minlength=group_count * (len(edges) - 1))
+            results[result_name] = histograms.reshape(group_count, len(edges) - 1)
+        else:
+            raise ValueError(f'Unknown aggregation {operation}.')
+    # Return the groups and results
+    return groups, results
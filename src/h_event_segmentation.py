@@ -0,0 +1,33 @@
+import numpy as np
+
+
+# Event number of every voxel of one or more columns (each column's voxels in derivation order, top row first),
+# with the rules of Grid.derive_events_from_column's original voxel-by-voxel parser:
+# - numbering starts at 0 in each column, and the first voxel of a column never starts a new event
+# - a voxel missing from either timepoint is an event of its own
+# - the first present voxel after a missing one starts a new event
+# - a zero change joins the ongoing event, and a non-zero change starts a new event only if its sign differs from
+#   the last non-zero change since the column start or the last missing voxel
+# missing: boolean array, changes: change of every voxel (ignored where missing; NaN counts as no change),
+# column_starts: boolean array, True at the first voxel of each column
+def get_event_numbers(missing, changes, column_starts):
+    missing = np.asarray(missing, dtype=bool)
+    column_starts = np.asarray(column_starts, dtype=bool)
+    # Sign of every present voxel's change (0 for no change, NaN and missing voxels)
+    with np.errstate(invalid='ignore'):
+        signs = (changes > 0).astype(np.int8) - (changes < 0).astype(np.int8)
+    signs[missing] = 0
+    # Missing voxels and the present voxels right after them start new events
+    previous_missing = np.concatenate(([False], missing[:-1]))
+    event_starts = missing | previous_missing
+    # Runs of present voxels (split by missing voxels and columns) and the sign flips inside them
+    run_ids = np.cumsum(column_starts | missing | previous_missing)
+    signed = np.flatnonzero(signs != 0)
+    flips = signed[1:][(run_ids[signed[1:]] == run_ids[signed[:-1]]) & (signs[signed[1:]] != signs[signed[:-1]])]
+    event_starts[flips] = True
+    # The first voxel of a column never starts a new event
+    event_starts[column_starts] = False
+    # Count the starts, restarting at each column
+    start_counts = np.cumsum(event_starts)
+    column_ids = np.cumsum(column_starts) - 1
+    return start_counts - start_counts[np.flatnonzero(column_starts)][column_ids]
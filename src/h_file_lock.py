@@ -0,0 +1,52 @@
+from contextlib import contextmanager
+from os import O_CREAT, O_EXCL, O_WRONLY, close, getpid, open as os_open, remove, stat, write
+from os.path import exists
+import logging
+import time
+
+# Seconds between attempts to take a lock
+LOCK_POLL_INTERVAL = 0.1
+
+
+# Hold an exclusive lock file while the block runs, so processes sharing a file (e.g. a manifest they read, change
+# and save) take turns. The lock is taken by creating lock_path, which fails while another process has it.
+# timeout: seconds to wait for the lock before raising TimeoutError
+# stale_after: seconds after which a lock file is taken to be left behind by a process that died, and removed
+@contextmanager
+def file_lock(lock_path, timeout=60, stale_after=600):
+    deadline = time.monotonic() + timeout
+    # Until the lock is taken
+    while True:
+        try:
+            # Create the lock file (fails if it exists)
+            lock_fd = os_open(lock_path, O_CREAT | O_EXCL | O_WRONLY)
+            break
+        except FileExistsError:
+            pass
+        # If the lock file was left behind
+        try:
+            if time.time() - stat(lock_path).st_mtime > stale_after:
+                # Log a warning
+                logging.warning(f'Removing stale lock file {lock_path}.')
+                remove(lock_path)
+                continue
+        # If it was released in the meantime
+        except FileNotFoundError:
+            continue
+        # If the wait is over
+        if time.monotonic() > deadline:
+            raise TimeoutError(f'Timed out after {timeout} s waiting for the lock file {lock_path}.')
+        # Wait before trying again
+        time.sleep(LOCK_POLL_INTERVAL)
+    # Record the owner (for debugging)
+    try:
+        write(lock_fd, str(getpid()).encode())
+    finally:
+        close(lock_fd)
+    # Run the block
+    try:
+        yield
+    # Release the lock
+    finally:
+        if exists(lock_path):
+            remove(lock_path)
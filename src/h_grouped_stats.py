@@ -0,0 +1,80 @@
+import numpy as np
+
+
+# Summary statistics for many groups at once from a value array ordered by group
+# values: 1D array with each group's values stored contiguously
+# counts: number of values in each group, in the same order as the groups appear in values
+# percentiles: optional list of percentiles (0-100) to compute as well
+# Returns a dictionary of arrays (one entry per group) keyed by statistic name
+def grouped_summary_stats(values, counts, percentiles=None):
+    # Make sure the inputs are arrays
+    values = np.asarray(values, dtype=np.float64)
+    counts = np.asarray(counts, dtype=np.int64)
+    # Number of groups
+    group_count = len(counts)
+    # Group index of every value
+    group_ids = np.repeat(np.arange(group_count), counts)
+    # Drop NaN values (to match the nan* functions)
+    not_nan = ~np.isnan(values)
+    if not not_nan.all():
+        values = values[not_nan]
+        group_ids = group_ids[not_nan]
+        counts = np.bincount(group_ids, minlength=group_count)
+    # Sort the values within each group (needed for the median and percentiles)
+    order = np.lexsort((values, group_ids))
+    sorted_values = values[order]
+    # Start of each group in the sorted array
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.int64)
+    # Groups with at least one value (reduceat cannot handle empty groups)
+    has_values = counts > 0
+    valid_starts = starts[has_values]
+    valid_counts = counts[has_values]
+
+    # Dictionary of results, NaN for groups without values
+    results = {'count': counts}
+    for stat in ['min', 'max', 'mean', 'median', 'stdev']:
+        results[stat] = np.full(group_count, np.nan)
+    # If there are no values at all
+    if len(valid_starts) == 0:
+        # Add the empty percentiles and stop here
+        for percentile in percentiles or []:
+            results[f'p{percentile}'] = np.full(group_count, np.nan)
+        return results
+
+    # Min and max are the ends of each sorted group
+    results['min'][has_values] = sorted_values[valid_starts]
+    results['max'][has_values] = sorted_values[valid_starts + valid_counts - 1]
+    # Mean from the group sums
+    means = np.add.reduceat(sorted_values, valid_starts) / valid_counts
+    results['mean'][has_values] = means
+    # Population standard deviation (as numpy.nanstd) from the squared deviations
+    deviations = sorted_values - np.repeat(means, valid_counts)
+    results['stdev'][has_values] = np.sqrt(np.add.reduceat(deviations ** 2, valid_starts) / valid_counts)
+    # Median is the 50th percentile
+    results['median'][has_values] = _sorted_group_percentile(sorted_values, valid_starts, valid_counts, 50)
+    # Any other percentiles requested
+    for percentile in percentiles or []:
+        results[f'p{percentile}'] = np.full(group_count, np.nan)
+        results[f'p{percentile}'][has_values] = _sorted_group_percentile(sorted_values,
+                                                                        valid_starts,
+                                                                        valid_counts,
+                                                                        percentile)
+    # Return the results
+    return results
+
+
+# Linearly interpolated percentile (as numpy.percentile) of each non-empty sorted group
+def _sorted_group_percentile(sorted_values, starts, counts, percentile):
+    # Fractional position of the percentile within each group
+    position = (counts - 1) * (percentile / 100)
+    lower = np.floor(position).astype(np.int64)
+    upper = np.ceil(position).astype(np.int64)
+    # Values either side of the position
+    lower_values = sorted_values[starts + lower]
+    upper_values = sorted_values[starts + upper]
+    # If the percentile is the median
+    if percentile == 50:
+        # Average the two middle values (as numpy.median)
+        return (lower_values + upper_values) / 2
+    # Interpolate between them
+    return lower_values + (upper_values - lower_values) * (position - lower)
@@ -0,0 +1,198 @@
+from os import remove, replace
+import json
+import re
+
+# Characters that can follow a complete value inside an object (':' after a key)
+_VALUE_ENDS = ',}:'
+# Whitespace allowed between JSON tokens, and the next token after it
+_WHITESPACE = ' \t\n\r'
+_NEXT_TOKEN = re.compile(r'[^ \t\n\r]')
+# Characters that can continue a number (e.g. '0.' or '1.5e' cut off at the end of the buffer)
+_NUMBER_TAIL = re.compile(r'[0-9.eE+-]*')
+
+
+# Writes a JSON object one entry at a time, so the whole object never has to be held in memory.
+# header: dictionary of small entries written first (e.g. 'Grid Name')
+# stream_key: key of the streamed sub-object (e.g. 'Voxels'), or None to stream the top-level object's entries
+# The output is the same as json.dump of the complete dictionary. It is written to a temporary file that replaces
+# file_path only when the writer exits cleanly, so an interrupted write never looks complete
+class JsonStreamWriter:
+
+    def __init__(self, file_path, header=None, stream_key=None):
+
+        self.file_path = file_path
+        self.header = header or {}
+        self.stream_key = stream_key
+        # Temporary path, open file and whether an entry has been written yet
+        self.tmp_path = f'{file_path}.tmp'
+        self.file = None
+        self.first_entry = True
+
+    def __enter__(self):
+        # Open the file
+        self.file = open(self.tmp_path, 'w')
+        # Start the object
+        self.file.write('{')
+        # Write the header entries
+        for key, value in self.header.items():
+            self.write_entry(key, value)
+        # If streaming a sub-object
+        if self.stream_key is not None:
+            # Start it (its first entry needs no separator)
+            self.write_key(self.stream_key)
+            self.file.write('{')
+            self.first_entry = True
+        return self
+
+    # Write one entry of the streamed object
+    def write_entry(self, key, value):
+        # Write the key and value
+        self.write_key(key)
+        json.dump(value, self.file)
+
+    # Write a key (and the separator before all but the first entry)
+    def write_key(self, key):
+        if not self.first_entry:
+            self.file.write(', ')
+        self.first_entry = False
+        self.file.write(f'{json.dumps(str(key))}: ')
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # If the write failed
+        if exc_type is not None:
+            # Discard the partial file
+            self.file.close()
+            remove(self.tmp_path)
+            return
+        # Close the streamed sub-object
+        if self.stream_key is not None:
+            self.file.write('}')
+        # Close the object and the file
+        self.file.write('}')
+        self.file.close()
+        # Move the complete file into place
+        replace(self.tmp_path, self.file_path)
+
+
+# Yield (key, value) for each entry of the top-level JSON object in a file, or of the object under key,
+# decoding one entry at a time (memory depends on the largest entry, not the file size).
+# If header is a dictionary, the top-level entries before key are stored in it (e.g. 'Grid Name')
+def iter_json_object_entries(file_path, key=None, header=None, chunk_size=1000000):
+    # Reader over the file
+    reader = _JsonReader(file_path, chunk_size)
+    try:
+        # Start of the top-level object
+        reader.expect('{')
+        # If streaming the top-level object
+        if key is None:
+            yield from reader.iter_entries()
+            return
+        # Otherwise, look for the key in the top-level object
+        for entry_key in reader.iter_keys():
+            # If it is the streamed object
+            if entry_key == key:
+                # Start of the object
+                reader.expect('{')
+                yield from reader.iter_entries()
+                return
+            # Otherwise, decode the value (keeping it if requested)
+            value = reader.decode_value()
+            if header is not None:
+                header[entry_key] = value
+    finally:
+        reader.close()
+
+
+# Minimal incremental reader for iter_json_object_entries
+class _JsonReader:
+
+    def __init__(self, file_path, chunk_size):
+
+        self.file = open(file_path, 'r')
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        # Text read but not yet consumed, and position in it
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def close(self):
+        self.file.close()
+
+    # Read another chunk into the buffer (dropping consumed text). Returns False at the end of the file
+    def read_more(self, size=None):
+        if self.eof:
+            return False
+        chunk = self.file.read(size or self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    # Next non-whitespace character (not consumed), or None at the end of the file
+    def peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.read_more():
+                return None
+
+    # Consume an expected character
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f'Expected {char!r} in {self.file.name}, found {found!r}.')
+        self.pos += 1
+
+    # Decode the next complete value
+    def decode_value(self):
+        self.peek()
+        # Size of the next read (doubled on each retry, so a large value is not re-parsed many times)
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # The value is not complete in the buffer yet
+                if not self.read_more(size):
+                    raise
+                size *= 2
+                continue
+            # A number at the end of the buffer may continue in the next chunk (including after a partial
+            # fraction or exponent, which raw_decode stops short of)
+            next_token = _NEXT_TOKEN.search(self.buffer, end)
+            cut_number = isinstance(value, (int, float)) and not isinstance(value, bool) and \
+                _NUMBER_TAIL.fullmatch(self.buffer, end) is not None
+            if (next_token is None or cut_number) and self.read_more(size):
+                size *= 2
+                continue
+            if next_token is not None and next_token.group() not in _VALUE_ENDS:
+                raise ValueError(f'Unexpected {next_token.group()!r} after a value in {self.file.name}.')
+            self.pos = end
+            return value
+
+    # Yield the keys of the current object (the caller must consume each value)
+    def iter_keys(self):
+        # Empty object
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            entry_key = self.decode_value()
+            self.expect(':')
+            yield entry_key
+            # Separator or end of the object
+            if self.peek() == ',':
+                self.pos += 1
+                continue
+            self.expect('}')
+            return
+
+    # Yield (key, value) for the entries of the current object
+    def iter_entries(self):
+        for entry_key in self.iter_keys():
+            yield entry_key, self.decode_value()
@@ -0,0 +1,68 @@
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import logging
+import datetime
+import c_voxels
+
+# Set the logging config
+logging.basicConfig(filename=f'F:/UMB/Geomorphology/logs/{datetime.datetime.now():%Y%m%d%H%M%S}.log',
+                    filemode='w',
+                    format=' %(levelname)s - %(asctime)s - %(message)s',
+                    level=logging.DEBUG)
+
+
+def parallel_process(file_set):
+    # Split out the information from the file set
+    spec_path = file_set[0]
+    input_path = file_set[1]
+    file_path = file_set[2]
+
+    # Make a Grid object
+    grid = c_voxels.Grid(spec_path=spec_path,
+                         input_path=input_path)
+    # Log info
+    logging.info(f'Caching {file_path}.')
+    # Convert the ASCII point cloud into the binary cache
+    grid.build_point_cloud_cache(file_path)
+    # Log info
+    logging.info(f'Finished caching {file_path}.')
+
+
+def main(spec_path, input_path):
+    # List for file sets
+    file_set_list = []
+    # Make a Grid object
+    grid = c_voxels.Grid(spec_path=Path(spec_path),
+                         input_path=Path(input_path))
+    # Assess the structure of the project
+    grid.assess_project_structure()
+    # For each timepoint
+    for timepoint in grid.proj_struct.keys():
+        # For each slice
+        for slice in grid.proj_struct[timepoint].keys():
+            # For each scan position
+            for scan in grid.proj_struct[timepoint][slice]:
+                # Assemble the file path
+                file_path = Path(input_path, f'{slice}_{scan}_{timepoint}.txt')
+                # If the cache is already current
+                if grid.point_cloud_cache_is_current(file_path):
+                    # Log it
+                    logging.info(f'Point cloud cache for {file_path} is current, skipping.')
+                    # Skip it
+                    continue
+                # Add the file set to the list
+                file_set_list.append((spec_path, input_path, file_path))
+
+    # Make a process pool executor
+    with ProcessPoolExecutor(max_workers=3) as executor:
+        executor.map(parallel_process, file_set_list)
+
+
+if __name__ == '__main__':
+
+    # Specify paths to specification file and input directory (where ASCII point clouds are stored)
+    spec_path = Path(r'F:\UMB\Geomorphology\support\grid_rainsford')
+    input_path = Path(r'F:\UMB\Geomorphology\input\07_top_bot_sliced_trimmed_rotated_pointcloud')
+
+    # Call the main function
+    main(spec_path, input_path)
@@ -5,6 +5,7 @@ from pathlib import Path
 import logging
 import datetime
 import c_voxels
+import c_project_store
 import json
 
 # Set the logging config
@@ -19,22 +20,33 @@ def parallel_process(slice_list):
     spec_path = slice_list[0][0]
     input_path = slice_list[0][1]
     slice = slice_list[0][2]
+    column_workers = slice_list[0][3]
+    timepoint_pairs = slice_list[0][4]
 
     # Make a Grid object
     grid = c_voxels.Grid(spec_path=spec_path,
                          input_path=input_path)
 
+    # Also insert the events into the project store
+    grid.store = c_project_store.ProjectStore(grid.get_project_store_path())
+
     # Log info
     logging.info(f'Processing Slice {slice}.')
 
-    # Derive events for the slice
-    grid.derive_all_events_for_slice(slice, slice_list[1])
+    # Derive events for the slice's pairs (the others are derived on demand by Grid.materialize_pairs)
+    grid.derive_events_for_slice(slice, slice_list[1], timepoint_pairs, column_workers=column_workers)
+
+    # Close the project store
+    grid.store.close()
 
     # Log info
     logging.info(f'Finished processing Slice {slice}.')
 
 
-def main(spec_path, input_path):
+# workers: slices derived at once, column_workers: processes each slice's columns are split across
+# timepoint_pairs: (first_tp, second_tp) pairs to precompute for each slice that has both timepoints, or None for
+# each timepoint and the next one in time. Other pairs are derived (and cached) when they are loaded
+def main(spec_path, input_path, workers=3, column_workers=1, timepoint_pairs=None):
     # List for slices
     slice_list = []
     # Make a Grid object
@@ -62,9 +74,14 @@ def main(spec_path, input_path):
             slices[slice].append(timepoint)
     # For each slice
     for slice in slices.keys():
-        slice_list.append([(spec_path, input_path, slice), slices[slice]])
+        # Pairs to precompute for the slice (None for the adjacent ones)
+        slice_pairs = None
+        if timepoint_pairs is not None:
+            slice_pairs = [(first_tp, second_tp) for first_tp, second_tp in timepoint_pairs
+                           if first_tp in slices[slice] and second_tp in slices[slice]]
+        slice_list.append([(spec_path, input_path, slice, column_workers, slice_pairs), slices[slice]])
     # Make a process pool executor
-    with ProcessPoolExecutor(max_workers=3) as executor:
+    with ProcessPoolExecutor(max_workers=workers) as executor:
         executor.map(parallel_process, slice_list)
 
 
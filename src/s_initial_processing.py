@@ -5,6 +5,7 @@ from pathlib import Path
 import logging
 import datetime
 import c_voxels
+import c_project_store
 
 # Set the logging config
 logging.basicConfig(filename=f'F:/UMB/Geomorphology/logs/{datetime.datetime.now():%Y%m%d%H%M%S}.log',
@@ -15,11 +16,16 @@ logging.basicConfig(filename=f'F:/UMB/Geomorphology/logs/{datetime.datetime.now(
 
 def parallel_process(file_path):
     # Make a Grid object
-    grid = c_voxels.Grid(spec_path=Path(r'F:\UMB\Geomorphology\support\grid_rainsford'))
+    grid = c_voxels.Grid(spec_path=Path(r'F:\UMB\Geomorphology\support\grid_rainsford'),
+                         input_path=file_path.parent)
+    # Also insert the voxel statistics into the project store
+    grid.store = c_project_store.ProjectStore(grid.get_project_store_path())
     # Log info
     logging.info(f'Processing {file_path}.')
     # Have the grid process the file
     grid.process_point_cloud(file_path)
+    # Close the project store
+    grid.store.close()
     # Log info
     logging.info(f'Finished processing {file_path}.')
 
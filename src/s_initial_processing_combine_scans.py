@@ -5,7 +5,11 @@ from pathlib import Path
 import logging
 import datetime
 import c_voxels
-import json
+import c_sparse_grid
+import c_columnar
+import c_external_sort
+import c_project_store
+from h_json_stream import JsonStreamWriter
 
 # Set the logging config
 logging.basicConfig(filename=f'F:/UMB/Geomorphology/logs/{datetime.datetime.now():%Y%m%d%H%M%S}.log',
@@ -14,36 +18,81 @@ logging.basicConfig(filename=f'F:/UMB/Geomorphology/logs/{datetime.datetime.now(
                     level=logging.DEBUG)
 
 
+def parallel_ingest_scan(scan_set):
+    # Split out the information from the scan set
+    spec_path = scan_set[0]
+    input_path = scan_set[1]
+    timepoint = scan_set[2]
+    slice = scan_set[3]
+    scan_position = scan_set[4]
+    grid_class = scan_set[5]
+
+    # Make a Grid object (of the class for the mode)
+    grid = grid_class(spec_path=spec_path,
+                      input_path=input_path)
+    # Assemble the file path
+    file_path = Path(input_path, f'{slice}_{scan_position}_{timepoint}.txt')
+    # Log info
+    logging.info(f'Processing {file_path}.')
+    # Have the grid process the file
+    grid.process_point_cloud(file_path, summary_stats=False, export_file=False)
+    # Save the scan's partial aggregate
+    grid.export_scan_partial(grid.get_scan_partial_path(slice, scan_position, timepoint), timepoint, scan_position)
+    # Log info
+    logging.info(f'Finished processing {file_path}.')
+
+
 def parallel_process(file_set):
     # Split out the information from the file set
     spec_path = file_set[0][0]
     input_path = file_set[0][1]
     timepoint = file_set[0][2]
     slice = file_set[0][3]
+    json_export = file_set[0][4]
+    grid_class = file_set[0][5]
+
+    # Make a Grid object (of the class for the mode)
+    grid = grid_class(spec_path=spec_path,
+                      input_path=input_path)
+    # For each scan position in the set
+    for scan_position in file_set[1]:
+        # Merge the scan's partial aggregate (in project order, so values keep their order)
+        grid.merge_scan_partial(grid.get_scan_partial_path(slice, scan_position, timepoint))
+    # Now all scans are merged, generate summary stats for all voxels
+    grid.generate_summary_stats()
+    # Export the results
+    export_slice_timepoint(grid, grid.get_slice_timepoint_columns(slice, timepoint), json_export)
+
+
+def parallel_process_out_of_core(file_set):
+    # Split out the information from the file set
+    spec_path = file_set[0][0]
+    input_path = file_set[0][1]
+    timepoint = file_set[0][2]
+    slice = file_set[0][3]
+    json_export = file_set[0][4]
+    memory_budget = file_set[0][5]
 
     # Make a Grid object
     grid = c_voxels.Grid(spec_path=spec_path,
                          input_path=input_path)
-    # For each scan position in the set
-    for scan_position in file_set[1]:
-        # Assemble the file path
-        file_path = Path(input_path, f'{slice}_{scan_position}_{timepoint}.txt')
-        # Log info
-        logging.info(f'Processing {file_path}.')
-        # Have the grid process the file
-        grid.process_point_cloud(file_path, summary_stats=False, export_file=False)
-        # Log info
-        logging.info(f'Finished processing {file_path}.')
-    # Now all scans are done, generate summary stats
-    # Iterate over the voxels
-    # For each voxel X
-    for vox_x in grid.voxels.keys():
-        # For each voxel Z
-        for vox_z in grid.voxels[vox_x].keys():
-            # Reference the voxel object
-            curr_voxel = grid.voxels[vox_x][vox_z]
-            # Generate summary stats
-            curr_voxel.generate_summary_stats()
+    # Assemble the file paths (in project order, so values keep their order)
+    file_paths = [Path(input_path, f'{slice}_{scan_position}_{timepoint}.txt') for scan_position in file_set[1]]
+    # Log info
+    logging.info(f'Processing {slice}_{timepoint} out of core ({len(file_paths)} scans).')
+    # Ingest all scans at once with bounded memory, reducing the voxels straight into dense arrays (summary stats are
+    # generated as the voxels complete, and no Voxel objects are made)
+    ingest = c_external_sort.ExternalSortIngest(grid, memory_budget=memory_budget, dense=True)
+    ingest.process_point_clouds(file_paths)
+    # Export the results
+    export_slice_timepoint(grid, ingest.dense_grid.to_columns(slice), json_export)
+
+
+# Export the columnar form (c_columnar.SliceTimepointColumns) of a slice/timepoint result of a grid
+def export_slice_timepoint(grid, columns, json_export):
+    # Slice and timepoint of the result
+    slice = columns.slice_name
+    timepoint = columns.timepoint_name
     # Output directory
     output_dir = Path(f'F:/UMB/Geomorphology/output/{grid.name}/slice_timepoint/')
     # If the output directory for this grid does not exist
@@ -51,33 +100,57 @@ def parallel_process(file_set):
         # Make it
         mkdir(output_dir)
 
-    # Output dictionary
-    output_dict = {'Grid Name': grid.name,
-                   'Timepoint Name': timepoint,
-                   'Slice Name': slice,
-                   'Voxels': {}}
-    # Transfer keys and results
-    for vox_x in grid.voxels.keys():
-        output_dict['Voxels'][vox_x] = {}
-        for vox_z in grid.voxels[vox_x].keys():
-            output_dict['Voxels'][vox_x][vox_z] = grid.voxels[vox_x][vox_z].flatten()
-    # Assemble the output path
-    output_path = Path(output_dir, f'{slice}_{timepoint}.json.')
+    # If also exporting JSON (for interchange)
+    if json_export:
+        # Header of the output file
+        header = {'Grid Name': grid.name,
+                  'Timepoint Name': timepoint,
+                  'Slice Name': slice}
+        # Assemble the output path
+        json_path = Path(output_dir, f'{slice}_{timepoint}.json')
+        # Log before output
+        logging.info(f'Exporting to {json_path}')
+        # Stream the voxels to the output file one column at a time
+        with JsonStreamWriter(json_path, header=header, stream_key='Voxels') as writer:
+            for vox_x, export_column in columns.iter_voxel_columns():
+                writer.write_entry(vox_x, export_column)
+        # Log after output
+        logging.info(f'Export to {json_path} complete.')
+
+    # Columnar output path
+    columns_path = c_columnar.get_columns_path(output_dir, slice, timepoint)
     # Log before output
-    logging.info(f'Exporting to {output_path}')
-    # Open output file
-    with open(output_path, 'w') as of:
-        json.dump(output_dict, of)
+    logging.info(f'Exporting to {columns_path}')
+    # Save the columnar (memory-mappable) form after the JSON, recording the JSON's version so
+    # c_columnar.columns_are_current accepts it
+    columns.save(columns_path, source_header=c_columnar.get_source_header(json_path) if json_export else None)
+    # Check that readers will load the columnar form rather than re-parse the JSON
+    if not c_columnar.columns_are_current(columns_path, Path(output_dir, f'{slice}_{timepoint}.json')):
+        logging.warning(f'{columns_path} is not current against the JSON and will not be used by readers.')
     # Log after output
-    logging.info(f'Export to {output_path} complete.')
+    logging.info(f'Export to {columns_path} complete.')
+    # Bulk insert the voxel statistics into the project store
+    store = c_project_store.ProjectStore(grid.get_project_store_path())
+    store.insert_voxel_stats(columns)
+    store.close()
 
 
-def main(spec_path, input_path):
+# out_of_core: ingest each slice/timepoint with c_external_sort.ExternalSortIngest (memory bounded by memory_budget
+# bytes per worker) instead of through per-scan partial aggregates
+# sparse_3d: keep the Y axis, ingesting into c_sparse_grid.SparseVoxelGrid (not with out_of_core)
+def main(spec_path, input_path, json_export=False, out_of_core=False, memory_budget=1000000000, sparse_3d=False):
+    # If both modes were asked for
+    if sparse_3d and out_of_core:
+        raise ValueError('Out-of-core ingest keys voxels by X and Z only, so it cannot be used with sparse_3d.')
+    # Class of the grids
+    grid_class = c_sparse_grid.SparseVoxelGrid if sparse_3d else c_voxels.Grid
+    # List for scan sets (scans needing a new partial aggregate)
+    scan_set_list = []
     # List for file sets
     file_set_list = []
-    # Make a Grid object
-    grid = c_voxels.Grid(spec_path=Path(spec_path),
-                         input_path=Path(input_path))
+    # Make a Grid object (of the class for the mode, so partials are checked against its coordinates)
+    grid = grid_class(spec_path=Path(spec_path),
+                      input_path=Path(input_path))
     # Assess the structure of the project
     grid.assess_project_structure()
 
@@ -91,18 +164,40 @@ def main(spec_path, input_path):
     for timepoint in grid.proj_struct.keys():
         # For each slice
         for slice in grid.proj_struct[timepoint].keys():
-            # If the output file already exists
-            if exists(Path(output_path, f'{slice}_{timepoint}.json')):
+            # If the output (columnar or JSON) already exists
+            if exists(Path(c_columnar.get_columns_path(output_path, slice, timepoint), 'header.json')) or \
+                    exists(Path(output_path, f'{slice}_{timepoint}.json')):
                 # Log it
-                logging.info(f'Output file {slice}_{timepoint}.json already exists, skipping.')
+                logging.info(f'Output for {slice}_{timepoint} already exists, skipping.')
                 # Skip it
                 continue
+            # If ingesting out of core
+            if out_of_core:
+                # Add the file set to the list (no partial aggregates needed)
+                file_set_list.append([(spec_path, input_path, timepoint, slice, json_export, memory_budget),
+                                      grid.proj_struct[timepoint][slice]])
+                # Next slice
+                continue
+            # For each scan position
+            for scan_position in grid.proj_struct[timepoint][slice]:
+                # If the scan's partial aggregate is newer than its point cloud
+                if grid.scan_partial_is_current(slice, scan_position, timepoint):
+                    # Log it
+                    logging.info(f'Partial for {slice}_{scan_position}_{timepoint} is current, skipping ingest.')
+                    # Skip it
+                    continue
+                # Add the scan set to the list
+                scan_set_list.append((spec_path, input_path, timepoint, slice, scan_position, grid_class))
             # Add the file set to the list
-            file_set_list.append([(spec_path, input_path, timepoint, slice), grid.proj_struct[timepoint][slice]])
+            file_set_list.append([(spec_path, input_path, timepoint, slice, json_export, grid_class),
+                                  grid.proj_struct[timepoint][slice]])
 
     # Make a process pool executor
     with ProcessPoolExecutor(max_workers=3) as executor:
-        executor.map(parallel_process, file_set_list)
+        # Ingest the scans into partial aggregates
+        list(executor.map(parallel_ingest_scan, scan_set_list))
+        # Merge the partial aggregates (or ingest out of core) for each slice and timepoint
+        list(executor.map(parallel_process_out_of_core if out_of_core else parallel_process, file_set_list))
 
 
 if __name__ == '__main__':
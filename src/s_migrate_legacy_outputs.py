@@ -0,0 +1,229 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from os import replace, stat
+from os.path import exists
+from pathlib import Path
+import hashlib
+import shutil
+import logging
+import datetime
+import json
+import c_voxels
+import c_columnar
+from h_json_stream import iter_json_object_entries
+
+# Set the logging config
+logging.basicConfig(filename=f'F:/UMB/Geomorphology/logs/{datetime.datetime.now():%Y%m%d%H%M%S}.log',
+                    filemode='w',
+                    format=' %(levelname)s - %(asctime)s - %(message)s',
+                    level=logging.DEBUG)
+
+# Name of the manifest in the grid's output directory
+MANIFEST_NAME = 'migration_manifest.json'
+
+
+# SHA-256 of a file (read in chunks)
+def get_file_checksum(file_path, chunk_size=16000000):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# SHA-256 over the .npy files of a columnar directory (in name order)
+def get_columns_checksum(columns_path):
+    digest = hashlib.sha256()
+    for array_path in sorted(Path(columns_path).glob('*.npy')):
+        with open(array_path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+# Check whether two decoded JSON values are the same (numbers by value, so 4 matches 4.0 and NaN matches NaN)
+def values_match(first_value, second_value):
+    # Dictionaries (key order is ignored)
+    if isinstance(first_value, dict) and isinstance(second_value, dict):
+        return first_value.keys() == second_value.keys() and \
+            all(values_match(value, second_value[key]) for key, value in first_value.items())
+    # Lists (or tuples)
+    if isinstance(first_value, (list, tuple)) and isinstance(second_value, (list, tuple)):
+        return len(first_value) == len(second_value) and \
+            all(values_match(first, second) for first, second in zip(first_value, second_value))
+    # Numbers
+    if isinstance(first_value, (int, float)) and isinstance(second_value, (int, float)) and \
+            not isinstance(first_value, bool) and not isinstance(second_value, bool):
+        return first_value == second_value or (first_value != first_value and second_value != second_value)
+    # Anything else (strings, None)
+    return first_value == second_value
+
+
+# Convert a slice/timepoint JSON output to the columnar form and verify it. Returns the counts
+def migrate_slice_timepoint(file_path, columns_path):
+    # Slice and timepoint from the file name
+    slice_name, timepoint_name = file_path.stem.rsplit('_', 1)
+    # Build the columnar form, reading the JSON one column at a time (the header entries are read before the voxels)
+    header = {}
+    columns = c_columnar.SliceTimepointColumns.from_voxel_columns(
+        iter_json_object_entries(file_path, key='Voxels', header=header))
+    columns.grid_name = header.get('Grid Name')
+    columns.slice_name = header.get('Slice Name', slice_name)
+    columns.timepoint_name = header.get('Timepoint Name', timepoint_name)
+    columns.save(columns_path, source_header=c_columnar.get_source_header(file_path))
+    # Reload the saved arrays and rebuild the JSON layout from them
+    voxels_dict = c_columnar.SliceTimepointColumns.load(columns_path).to_voxels_dict()
+    # Compare every column of the JSON with the rebuilt one
+    column_count = 0
+    voxel_count = 0
+    for vox_x, voxel_column in iter_json_object_entries(file_path, key='Voxels'):
+        if not values_match(voxels_dict.get(vox_x), voxel_column):
+            raise ValueError(f'Column {vox_x} of {file_path} does not match its columnar form.')
+        column_count += 1
+        voxel_count += len(voxel_column)
+    # Compare the counts
+    if column_count != len(voxels_dict) or voxel_count != columns.get_voxel_count():
+        raise ValueError(f'Counts of {file_path} ({column_count} columns, {voxel_count} voxels) do not match its '
+                         f'columnar form ({len(voxels_dict)} columns, {columns.get_voxel_count()} voxels).')
+    return {'Columns': column_count, 'Voxels': voxel_count}
+
+
+# Convert a slice/timepoint pair JSON output to the columnar form and verify it. Returns the counts
+def migrate_pair(file_path, columns_path):
+    # Slice and timepoints from the file name
+    slice_name, first_tp, second_tp = file_path.stem.rsplit('_', 2)
+    # Build the columnar form, reading the JSON one column at a time
+    pair_columns = c_columnar.PairColumns.from_pair_results(iter_json_object_entries(file_path),
+                                                            slice_name=slice_name,
+                                                            first_tp=first_tp,
+                                                            second_tp=second_tp)
+    pair_columns.save(columns_path, source_header=c_columnar.get_source_header(file_path))
+    # Reload the saved arrays
+    saved_columns = c_columnar.PairColumns.load(columns_path)
+    # Compare every column of the JSON with the rebuilt one (both are in file order)
+    column_count = 0
+    voxel_count = 0
+    rebuilt_results = saved_columns.iter_pair_results()
+    for col, col_results in iter_json_object_entries(file_path):
+        if not values_match(next(rebuilt_results, None), [col, col_results]):
+            raise ValueError(f'Column {col} of {file_path} does not match its columnar form.')
+        column_count += 1
+        if isinstance(col_results, dict):
+            voxel_count += sum(len(event_voxels) for event_voxels in col_results.values())
+    # Compare the counts
+    if next(rebuilt_results, None) is not None or column_count != saved_columns.get_column_count() or \
+            voxel_count != saved_columns.get_voxel_count():
+        raise ValueError(f'Counts of {file_path} ({column_count} columns, {voxel_count} voxels) do not match its '
+                         f'columnar form ({saved_columns.get_column_count()} columns, '
+                         f'{saved_columns.get_voxel_count()} voxels).')
+    return {'Columns': column_count, 'Voxels': voxel_count}
+
+
+def parallel_process(file_set):
+    # Split out the information from the file set
+    kind = file_set[0]
+    file_path = file_set[1]
+    columns_path = file_set[2]
+
+    # Log info
+    logging.info(f'Migrating {file_path}.')
+    # Size and modification time of the source before reading it
+    file_stat = stat(file_path)
+    try:
+        # Convert and verify
+        if kind == 'slice_timepoint':
+            counts = migrate_slice_timepoint(file_path, columns_path)
+        else:
+            counts = migrate_pair(file_path, columns_path)
+    except Exception as e:
+        # Remove the unverified output, so it is never used
+        shutil.rmtree(columns_path, ignore_errors=True)
+        # Log an error
+        logging.error(f'Migration of {file_path} failed. {e}')
+        return None
+    # Log info
+    logging.info(f'Finished migrating {file_path}.')
+    # Return the manifest record
+    return {'Kind': kind,
+            'Columns Path': str(columns_path),
+            'Size': file_stat.st_size,
+            'Modified': file_stat.st_mtime,
+            'Source SHA256': get_file_checksum(file_path),
+            'Columns SHA256': get_columns_checksum(columns_path),
+            **counts}
+
+
+# Load the manifest (file path: record of a verified migration)
+def load_manifest(manifest_path):
+    if not exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+
+# Save the manifest (via a temporary file, so an interrupted save never corrupts it)
+def save_manifest(manifest_path, manifest):
+    tmp_path = Path(f'{manifest_path}.tmp')
+    with open(tmp_path, 'w') as of:
+        json.dump(manifest, of, indent=1)
+    replace(tmp_path, manifest_path)
+
+
+# Check whether a manifest record is still valid for a source file
+def record_is_current(record, file_path):
+    if record is None or not exists(Path(record['Columns Path'], 'header.json')):
+        return False
+    file_stat = stat(file_path)
+    return record['Size'] == file_stat.st_size and record['Modified'] == file_stat.st_mtime
+
+
+def main(spec_path, input_path, workers=3):
+    # List for file sets
+    file_set_list = []
+    # Make a Grid object
+    grid = c_voxels.Grid(spec_path=Path(spec_path),
+                         input_path=Path(input_path))
+    # Grid output directory
+    output_dir = Path(grid.input_path.parents[1], 'output', grid.name)
+    # Load the manifest of completed migrations
+    manifest_path = Path(output_dir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+    # Directories of legacy JSON outputs
+    for kind, dir_path in [('slice_timepoint', Path(output_dir, 'slice_timepoint')),
+                           ('pair', Path(output_dir, 'change', 'slice_timepoint_pairs'))]:
+        # For each JSON file
+        for file_path in sorted(dir_path.glob('*.json')):
+            # If it was already migrated and has not changed since
+            if record_is_current(manifest.get(str(file_path)), file_path):
+                # Log it
+                logging.info(f'{file_path} already migrated, skipping.')
+                # Skip it
+                continue
+            # Columnar output path
+            columns_path = Path(dir_path, f'{file_path.stem}{c_columnar.COLUMNS_SUFFIX}')
+            # Add the file set to the list
+            file_set_list.append((kind, file_path, columns_path))
+
+    # Make a process pool executor
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Submit the files
+        futures = {executor.submit(parallel_process, file_set): file_set for file_set in file_set_list}
+        # As each file finishes
+        for future in as_completed(futures):
+            record = future.result()
+            # If it was verified
+            if record is not None:
+                # Record it in the manifest straight away, so an interrupted run can resume
+                manifest[str(futures[future][1])] = record
+                save_manifest(manifest_path, manifest)
+    # Log info
+    logging.info(f'Migrated {len(manifest)} files, '
+                 f'{len(file_set_list)} attempted in this run.')
+
+
+if __name__ == '__main__':
+
+    # Specify paths to specification file and input directory (where ASCII point clouds are stored)
+    spec_path = Path(r'F:\UMB\Geomorphology\support\grid_rainsford')
+    input_path = Path(r'F:\UMB\Geomorphology\input\07_top_bot_sliced_trimmed_rotated_pointcloud')
+
+    # Call the main function
+    main(spec_path, input_path)
@@ -41,10 +41,8 @@ for slice_num in list(range(0, 23)):
 
 
 # Event counts
-tp1_tp2_event_counts = []
-# For each column
-for col_key in grid.voxels.keys():
-    tp1_tp2_event_counts.append(len(list(grid.voxels[col_key].keys())))
+# Event count for each column (of each slice)
+tp1_tp2_event_counts = grid.events.get_event_counts_per_col().tolist()
 
 print(f'For TP1 to TP2 there was a mean of {grid.get_mean_event_count_per_col()} events per voxel column.')
 
@@ -66,10 +64,8 @@ for slice_num in list(range(0, 23)):
 
 
 # Event counts
-tp1_tp4_event_counts = []
-# For each column
-for col_key in grid.voxels.keys():
-    tp1_tp4_event_counts.append(len(list(grid.voxels[col_key].keys())))
+# Event count for each column (of each slice)
+tp1_tp4_event_counts = grid.events.get_event_counts_per_col().tolist()
 
 # Start a plot
 fig = plt.figure(figsize=(10, 6))
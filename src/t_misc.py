@@ -33,6 +33,6 @@ for slice_num in list(range(0, 23)):
 
     #grid.visualize_events(slice, first_tp, second_tp)
 
-    #grid.visualize_cumulative_profile(list(grid.voxels.keys())[0])
+    #grid.visualize_cumulative_profile(int(grid.events.events['col'][0]), slice, first_tp, second_tp)
 
-    grid.visualize_change_profile(list(grid.voxels.keys())[0])
\ No newline at end of file
+    grid.visualize_change_profile(int(grid.events.events['col'][0]), slice, first_tp, second_tp)
\ No newline at end of file
@@ -1,4 +1,5 @@
 import c_voxels
+import c_event_table
 import logging
 import datetime
 from pathlib import Path
@@ -26,33 +27,19 @@ def event_stats(first_tp, second_tp, spec_path, input_path):
     grid = c_voxels.Grid(spec_path=spec_path,
                          input_path=input_path)
 
-    # Loading all events into grid object
-    for slice_num in nv.nonveg_slices():
+    # Loading all events into grid object (the slice files are read concurrently)
+    grid.load_events_batch([(str(slice_num).zfill(2), first_tp, second_tp) for slice_num in nv.nonveg_slices()])
 
-        slice = str(slice_num)
+    # Events of all of the slices, and their metrics
+    events = grid.events.events
+    metrics = grid.events.get_metrics()
+    # Gain events (the others are counted with the losses)
+    is_gain = events['type'] == c_event_table.GAIN
 
-        while len(slice) < 2:
-            slice = '0' + slice
-        # method on the grid object
-        grid.load_events(slice, first_tp, second_tp)
-
-    net_vol = 0
-    gross_vol = 0
-    gain_count = 0
-    loss_count = 0
-
-    # make loop that iterates over all events
-    for col_key in grid.voxels.keys():
-        for event_key in grid.voxels[col_key].keys():
-            curr_event = grid.voxels[col_key][event_key]
-            # Check for Missing event, if event is instance of event class
-            if isinstance(curr_event, c_voxels.Event):
-                if curr_event.is_gain():
-                    gain_count += len(list(curr_event.voxels.keys()))
-                else:
-                    loss_count += len(list(curr_event.voxels.keys()))
-                net_vol += curr_event.get_volume()
-                gross_vol += abs(curr_event.get_volume())
+    net_vol = metrics['volume'].sum()
+    gross_vol = np.abs(metrics['volume']).sum()
+    gain_count = events['voxel_count'][is_gain].sum()
+    loss_count = events['voxel_count'][~is_gain].sum()
 
     print(f'For {first_tp} to {second_tp} there was a net vol_change of {net_vol} m^3.')
     print(f'For {first_tp} to {second_tp} there was a gross vol_change of {gross_vol} m^3.')
@@ -1,5 +1,4 @@
-import json
-import c_voxels
+import c_columnar
 import logging
 import datetime
 from pathlib import Path
@@ -39,25 +38,17 @@ for timepoint in timepoint_list:
 
         while len(slice) < 2:
             slice = '0' + slice
-        file_path = Path(input_path, f'{slice}_{timepoint}.json')
-
-        with open(file_path, 'r') as f:
-            # Load input dictionary
-            input_dict = json.load(f)
-        for col_key in input_dict['Voxels']:
-            for row_key in input_dict['Voxels'][col_key].keys():
-                voxel_values = input_dict['Voxels'][col_key][row_key][0]
-                if len(input_dict['Voxels'][col_key][row_key]) > 2:
-                    scan_pos = input_dict['Voxels'][col_key][row_key][2]
-                    # If more than 1 key in dictionary or if there is only one scan position, does it have more than one point
-                    if len(list(scan_pos.keys())) > 1 or scan_pos[list(scan_pos.keys())[0]] > 1:
-                        voxel_cv = voxel_values[-1]/voxel_values[2]
-                        tp_cv_list.append(voxel_cv)
-                        tp_voxel_count += 1
-                elif voxel_values[0] != voxel_values[1]:
-                    voxel_cv = voxel_values[-1] / voxel_values[2]
-                    tp_cv_list.append(voxel_cv)
-                    tp_voxel_count += 1
+        # Load the slice/timepoint result (columnar if available, JSON otherwise)
+        columns = c_columnar.load_slice_timepoint(input_path, slice, timepoint)
+        # Voxels with reflectance results have scan counts: keep those with more than one point in total
+        # Voxels without them: keep those where the min and max distance differ
+        keep = np.where(columns.has_reflectance,
+                        np.asarray(columns.scan_counts).sum(axis=1) > 1,
+                        columns.distance[:, 0] != columns.distance[:, 1])
+        # Coefficient of variation (stdev / mean) of the kept voxels
+        voxel_cvs = columns.distance[keep, -1] / columns.distance[keep, 2]
+        tp_cv_list.extend(voxel_cvs.tolist())
+        tp_voxel_count += len(voxel_cvs)
     cv_list.append(tp_cv_list)
     total_voxel_list.append(tp_voxel_count)
 
@@ -25,19 +25,11 @@ def event_stats(first_tp, second_tp, spec_path, input_path):
     grid = c_voxels.Grid(spec_path=spec_path,
                          input_path=input_path)
 
-    # Loading all events into grid object
-    for slice_num in list(range(0, 23)):
+    # Loading all events into grid object (the slice files are read concurrently)
+    grid.load_events_batch([(str(slice_num).zfill(2), first_tp, second_tp) for slice_num in list(range(0, 23))])
 
-        slice = str(slice_num)
-
-        while len(slice) < 2:
-            slice = '0' + slice
-        # method on the grid object
-        grid.load_events(slice, first_tp, second_tp)
-
-    event_count_list = []
-    for col_key in grid.voxels.keys():
-        event_count_list.append(len(list(grid.voxels[col_key].keys())))
+    # Event count for each column (of each slice)
+    event_count_list = grid.events.get_event_counts_per_col().tolist()
     print(
         f'For {first_tp} to {second_tp} there was a mean of {grid.get_mean_event_count_per_col()} events per voxel column.\n'
         f'For {first_tp} to {second_tp} there was a median of {grid.get_median_event_count_per_col()} events per voxel column.')
@@ -1,4 +1,5 @@
 import c_voxels
+import c_event_table
 import logging
 import datetime
 from pathlib import Path
@@ -25,40 +26,24 @@ def event_stats(first_tp, second_tp, spec_path, input_path):
     grid = c_voxels.Grid(spec_path=spec_path,
                          input_path=input_path)
 
-    # Loading all events into grid object
-    for slice_num in list(range(0, 23)):
-
-        slice = str(slice_num)
-
-        while len(slice) < 2:
-            slice = '0' + slice
-        # method on the grid object
-        grid.load_events(slice, first_tp, second_tp)
-
-    gain_event_vol = []
-    gain_event_height = []
-    gain_count = 0
-
-    loss_event_vol = []
-    loss_event_height = []
-    loss_count = 0
-
-    # make loop that iterates over all events
-    for col_key in grid.voxels.keys():
-        for event_key in grid.voxels[col_key].keys():
-            curr_event = grid.voxels[col_key][event_key]
-            # Check for Missing event, if event is instance of event class
-            if isinstance(curr_event, c_voxels.Event):
-                if curr_event.is_gain():
-                    gain_event_vol.append(abs(curr_event.get_volume()))
-                    # Subtracting 15.5 to set min height to 0
-                    gain_event_height.append(curr_event.get_mean_height() - 15.5)
-                    gain_count += len(list(curr_event.voxels.keys()))
-                else:
-                    loss_event_vol.append(abs(curr_event.get_volume()))
-                    # Subtracting 15.5 to set min height to 0
-                    loss_event_height.append(curr_event.get_mean_height() - 15.5)
-                    loss_count += len(list(curr_event.voxels.keys()))
+    # Loading all events into grid object (the slice files are read concurrently)
+    grid.load_events_batch([(str(slice_num).zfill(2), first_tp, second_tp) for slice_num in list(range(0, 23))])
+
+    # Events of all of the slices, and their metrics
+    events = grid.events.events
+    metrics = grid.events.get_metrics()
+    # Gain events (the others are counted with the losses)
+    is_gain = events['type'] == c_event_table.GAIN
+
+    gain_event_vol = np.abs(metrics['volume'][is_gain]).tolist()
+    # Subtracting 15.5 to set min height to 0
+    gain_event_height = (metrics['mean_height'][is_gain] - 15.5).tolist()
+    gain_count = events['voxel_count'][is_gain].sum()
+
+    loss_event_vol = np.abs(metrics['volume'][~is_gain]).tolist()
+    # Subtracting 15.5 to set min height to 0
+    loss_event_height = (metrics['mean_height'][~is_gain] - 15.5).tolist()
+    loss_count = events['voxel_count'][~is_gain].sum()
     return [gain_event_vol, loss_event_vol], [gain_event_height, loss_event_height], [gain_count, loss_count]
 
 
@@ -1,17 +1,14 @@
 import c_voxels
+import c_event_table
 import logging
 import datetime
 from pathlib import Path
 from matplotlib import pyplot as plt
 import matplotlib as mpl
-import numpy as np
 
 # Height bin size = voxel_size * BINNING_VARIABLE
 BINNING_VARIABLE=20
 
-def get_bin_key(bin_factor, row_key):
-    return np.floor(int(row_key)/bin_factor)
-
 def get_plt_var_from_dict(input_dict):
     vol_list = []
     height_list = []
@@ -48,39 +45,25 @@ timepoint_list = [('TP1', 'TP2'),
 vh_list_gain = []
 vh_list_loss = []
 
+# Make a Grid object
+grid = c_voxels.Grid(spec_path=spec_path,
+                     input_path=input_path)
+
+# Slices
+slice_list = [str(slice_num).zfill(2) for slice_num in range(0, 23)]
+# Height profile of the event volume of every slice and pair (built from the events the first time)
+profile = grid.get_volume_profile(slice_list, timepoint_list)
+
 for timepoint_pair in timepoint_list:
-    binned_dict_loss = {}
-    binned_dict_gain = {}
-    # Loading all events into grid object
-    for slice_num in list(range(0, 23)):
-        # Make a Grid object
-        grid = c_voxels.Grid(spec_path=spec_path,
-                             input_path=input_path)
-
-        slice = str(slice_num)
-
-        while len(slice) < 2:
-            slice = '0' + slice
-        # method on the grid object
-        grid.load_events(slice, timepoint_pair[0], timepoint_pair[1])
-        # make loop that iterates over all events
-        for col_key in grid.voxels.keys():
-            for event_key in grid.voxels[col_key].keys():
-                curr_event = grid.voxels[col_key][event_key]
-                # Check for Missing event, if event is instance of event class
-                if isinstance(curr_event, c_voxels.Event):
-                    for vox_row in curr_event.voxels.keys():
-                        bin_key = get_bin_key(BINNING_VARIABLE, vox_row)
-                        if curr_event.is_gain():
-                            if bin_key not in binned_dict_gain.keys():
-                                binned_dict_gain[bin_key] = 0
-                            # Grabbing median distance
-                            binned_dict_gain[bin_key] += grid.get_voxel_volume(curr_event.voxels[vox_row])
-                        else:
-                            if bin_key not in binned_dict_loss.keys():
-                                binned_dict_loss[bin_key] = 0
-                            # Grabbing median distance
-                            binned_dict_loss[bin_key] += grid.get_voxel_volume(abs(curr_event.voxels[vox_row]))
+    # Volume in each height bin, for gain events and for the others (counted with the losses)
+    bin_keys, bin_volumes, _ = profile.get_binned_volumes(BINNING_VARIABLE, timepoint_pair[0], timepoint_pair[1],
+                                                          slice_names=slice_list,
+                                                          event_types=[c_event_table.GAIN])
+    binned_dict_gain = dict(zip(bin_keys.tolist(), bin_volumes.tolist()))
+    bin_keys, bin_volumes, _ = profile.get_binned_volumes(BINNING_VARIABLE, timepoint_pair[0], timepoint_pair[1],
+                                                          slice_names=slice_list,
+                                                          event_types=[c_event_table.LOSS, c_event_table.NO_CHANGE])
+    binned_dict_loss = dict(zip(bin_keys.tolist(), bin_volumes.tolist()))
     vh_list_gain.append(binned_dict_gain)
     vh_list_loss.append(binned_dict_loss)
 